@@ -1,11 +1,17 @@
-from dotenv import load_dotenv; import os; load_dotenv()
 import os
 import logging
 
+from dotenv import load_dotenv
+
+load_dotenv()
+
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 
+# Свой Bot API сервер (local bot api или stub бенчмарка), пусто = api.telegram.org
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "").strip().rstrip("/")
+
 # Database configuration
 DATABASE_TYPE = os.getenv("DATABASE_TYPE", "postgres").lower()
 DATABASE_URL = os.getenv("DATABASE_URL", "")
@@ -22,17 +28,45 @@ STORAGE_BASE_PATH = os.getenv("STORAGE_BASE_PATH", "/app/storage")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
 
+# Webhook: фоновая обработка апдейтов (app/webhook_intake.py)
+WEBHOOK_MAX_TASKS = int(os.getenv("WEBHOOK_MAX_TASKS", "64"))        # хендлеров одновременно
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "256"))   # ждут слота, дальше — backpressure
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # set_webhook max_connections
+WEBHOOK_DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "25"))
+# Несколько процессов бота: общий порт через SO_REUSEPORT или PORT+i за nginx upstream
+WEBHOOK_PROCESSES = int(os.getenv("WEBHOOK_PROCESSES", "1"))
+WEBHOOK_REUSE_PORT = os.getenv("WEBHOOK_REUSE_PORT", "true").lower() in ("1", "true", "yes")
+# /metrics бота на отдельном порту BOT_METRICS_PORT + номер процесса (0 — на PORT).
+# При нескольких процессах на общем порту scrape попал бы в случайный процесс —
+# тогда без BOT_METRICS_PORT берётся DEFAULT_BOT_METRICS_PORT
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "0") or 0)
+DEFAULT_BOT_METRICS_PORT = 9200
+
+# KIE callback (app/kie_callback.py): KIE сообщает боту о готовности задачи, воркер
+# просыпается по NOTIFY. Пустой KIE_CALLBACK_TOKEN = callback выключен, только poll.
+KIE_CALLBACK_PATH = "/kie/callback"
+KIE_CALLBACK_TOKEN = os.getenv("KIE_CALLBACK_TOKEN", "").strip()
+KIE_CALLBACK_BASE_URL = os.getenv("KIE_CALLBACK_BASE_URL", PUBLIC_BASE_URL).strip().rstrip("/")
+# Интервал страховочного poll при включённом callback, сек
+KIE_CALLBACK_POLL_INTERVAL = int(os.getenv("KIE_CALLBACK_POLL_INTERVAL", "120"))
+
 # Support & UI
 SUPPORT_URL = os.getenv("SUPPORT_URL", "https://t.me/fabricbothelper")
 
 # Welcome video file_id (after first upload to Telegram)
-# If empty, will use FSInputFile to upload from disk (slow!)
+# If empty, welcome videos come from the assets/ file_id registry
 WELCOME_VIDEO_FILE_ID = os.getenv("WELCOME_VIDEO_FILE_ID", "")
 # Comma-separated list of video file_ids for fast startup demo
 WELCOME_VIDEO_FILE_IDS = [
     s.strip() for s in os.getenv("WELCOME_VIDEO_FILE_IDS", "").split(",") if s.strip()
 ]
 
+# Статичные файлы бота (меню, приветственные видео assets/welcome*.mp4).
+# При старте заливаются в служебный канал, file_id берутся из реестра
+# (app/services/media_registry.py); без канала — как раньше, с диска
+ASSETS_DIR = os.getenv("ASSETS_DIR", "/app/assets")
+SERVICE_CHANNEL_ID = int(os.getenv("SERVICE_CHANNEL_ID", "0") or 0)
+
 # Proxy Configuration
 PROXY_FILE = os.getenv("PROXY_FILE", "/app/proxies.txt")
 PROXY_COOLDOWN = int(os.getenv("PROXY_COOLDOWN", "300"))  # 5 минут по умолчанию
@@ -43,6 +77,58 @@ try:
 except Exception:
     ADMIN_IDS = []
 
+class ConfigError(RuntimeError):
+    """Конфигурация процесса неполная: все проблемы одним сообщением"""
+
+
+# Без этих переменных процесс роли не может работать
+REQUIRED_ENV = {
+    "bot": ("BOT_TOKEN", "DATABASE_URL"),
+    "worker": ("BOT_TOKEN", "DATABASE_URL"),
+}
+
+
+def validate_config(role: str, webhook: bool = False) -> None:
+    """
+    Явная проверка конфигурации при старте процесса (а не при импорте модулей):
+    собирает все пропущенные и противоречивые настройки и падает одним ConfigError.
+    webhook=True — бот в webhook режиме, нужен PUBLIC_BASE_URL.
+    """
+    problems = [f"{name} is not set" for name in REQUIRED_ENV.get(role, ()) if not os.getenv(name, "").strip()]
+
+    if role == "worker":
+        # Как в worker/kie_key_rotator.py: список через запятую или KIE_API_KEY_1, _2, ...
+        if not (os.getenv("KIE_API_KEY", "").strip() or os.getenv("KIE_API_KEY_1", "").strip()):
+            problems.append("KIE_API_KEY (or KIE_API_KEY_1, ...) is not set")
+    if webhook and not PUBLIC_BASE_URL:
+        problems.append("PUBLIC_BASE_URL is not set (webhook URL)")
+    if KIE_CALLBACK_TOKEN and not KIE_CALLBACK_BASE_URL:
+        problems.append("KIE_CALLBACK_TOKEN is set but KIE_CALLBACK_BASE_URL/PUBLIC_BASE_URL is empty")
+    if os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes") and not os.getenv("DATABASE_DIRECT_URL"):
+        problems.append("DB_PGBOUNCER=true requires DATABASE_DIRECT_URL")
+
+    if problems:
+        for problem in problems:
+            logger.critical(f"❌ Config: {problem}")
+        raise ConfigError(f"Invalid {role} configuration: " + "; ".join(problems))
+    logger.info(f"✅ Config validated for {role}")
+
+
+def telegram_api_server():
+    """TelegramAPIServer для AiohttpSession(api=...) с учётом TELEGRAM_API_BASE"""
+    from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+    if not TELEGRAM_API_BASE:
+        return PRODUCTION
+    return TelegramAPIServer.from_base(TELEGRAM_API_BASE)
+
+
+def kie_callback_url() -> str:
+    """callBackUrl для createTask KIE; пусто, если callback не настроен"""
+    if not KIE_CALLBACK_TOKEN or not KIE_CALLBACK_BASE_URL:
+        return ""
+    return f"{KIE_CALLBACK_BASE_URL}{KIE_CALLBACK_PATH}?token={KIE_CALLBACK_TOKEN}"
+
+
 def load_proxies_from_file(filepath: str) -> list:
     """Загрузить прокси из файла (один прокси на строку в формате ip:port:user:pass)."""
     try:
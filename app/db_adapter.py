@@ -6,14 +6,22 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
+import time
+from contextlib import asynccontextmanager
 from functools import partial
-from typing import Any, Callable, Dict, Optional, TypeVar
+from typing import Any, AsyncIterator, Callable, Dict, Optional, TypeVar
 
 T = TypeVar("T")
 
 logger = logging.getLogger(__name__)
 
 
+def _metrics():
+    """app.metrics (prometheus_client) — при первой метрике, а не при импорте адаптера"""
+    from app import metrics
+    return metrics
+
+
 async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
     """Runs a synchronous function in a separate thread to prevent blocking the event loop."""
     return await asyncio.to_thread(func, *args, **kwargs)
@@ -26,41 +34,151 @@ DATABASE_TYPE = os.getenv("DATABASE_TYPE", "postgres").lower()  # Default to pos
 if USE_POSTGRES or DATABASE_TYPE == "postgres":
     # Используем прямое подключение к PostgreSQL через asyncpg
     import asyncpg
-    from asyncpg import Pool
+
+    from app.db_pool import MeteredPool, direct_database_url, pgbouncer_mode, pool_options
     
     # Глобальный пул подключений
-    _pool: Optional[Pool] = None
+    _pool: Optional[MeteredPool] = None
     
-    async def init_db_pool() -> Pool:
-        """Инициализирует пул подключений к PostgreSQL"""
+    async def init_db_pool(role: Optional[str] = None) -> MeteredPool:
+        """
+        Инициализирует пул подключений к PostgreSQL.
+        Размер — из бюджета подключений по роли процесса (app/db_pool.py):
+        bot | worker | script, по умолчанию DB_ROLE или script.
+        """
         global _pool
         if _pool is None:
             database_url = os.getenv("DATABASE_URL")
             if not database_url:
                 raise ValueError("DATABASE_URL environment variable is required for PostgreSQL mode")
             
-            _pool = await asyncpg.create_pool(
-                database_url,
-                min_size=2,
-                max_size=10,
-                command_timeout=60
+            role = role or os.getenv("DB_ROLE", "script")
+            options = pool_options(role)
+            pool = await asyncpg.create_pool(database_url, **options)
+            _pool = MeteredPool(pool, role)
+            logger.info(
+                f"✅ PostgreSQL pool initialized: role={role}, "
+                f"size {options['min_size']}..{options['max_size']}"
+                f"{', pgbouncer mode' if pgbouncer_mode() else ''}"
             )
-            logger.info("✅ PostgreSQL pool initialized")
         return _pool
     
-    async def get_pool() -> Pool:
+    async def get_pool() -> MeteredPool:
         """Возвращает пул подключений (создает если не существует)"""
         if _pool is None:
             return await init_db_pool()
         return _pool
     
     async def close_db_pool():
-        """Закрывает пул подключений"""
-        global _pool
+        """Закрывает пул подключений (и пул реплики, если открыт)"""
+        global _pool, _replica_pool
         if _pool:
             await _pool.close()
             _pool = None
             logger.info("✅ PostgreSQL pool closed")
+        if _replica_pool:
+            await _replica_pool.close()
+            _replica_pool = None
+            logger.info("✅ PostgreSQL replica pool closed")
+
+    # ---------------- READ REPLICA ----------------
+    # Read-only запросы кабинета и статистики очереди (read_connection) идут на
+    # streaming реплику DATABASE_REPLICA_URL, если её отставание не больше
+    # DB_REPLICA_MAX_LAG секунд. Реплика недоступна или отстала — читаем с primary.
+    # Списание кредитов, claim очереди и всё, что пишет, — только primary (get_pool).
+
+    DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "").strip()
+    DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+    # Как часто перепроверять отставание и как долго не трогать упавшую реплику, сек
+    DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+    DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+
+    # Отставание 0, если реплика стримит WAL и проиграла всё полученное: на
+    # простаивающем primary pg_last_xact_replay_timestamp() стареет, хотя данные
+    # свежие. Без streaming receiver'а (поток WAL оборвался) receive LSN замирает
+    # и replay его догоняет — тогда только возраст последней проигранной
+    # транзакции, а NULL (ничего не проиграно) — реплика недоступна.
+    # status в pg_stat_wal_receiver видят роли с pg_read_all_stats (pg_monitor):
+    # без неё реплика на простое считается отставшей и чтения идут на primary.
+    REPLICA_LAG_SQL = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                 AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+            ELSE EXTRACT(EPOCH FROM (NOW() - pg_last_xact_replay_timestamp()))
+        END
+    """
+
+    _replica_pool: Optional[MeteredPool] = None
+    _replica_lag: Optional[float] = None
+    _replica_checked_at = 0.0
+    _replica_down_until = 0.0
+    _replica_lock = asyncio.Lock()
+
+    def _replica_down(error: Exception) -> None:
+        global _replica_down_until, _replica_lag
+        _replica_down_until = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+        _replica_lag = None
+        logger.warning(f"⚠️ Read replica unavailable, reading from primary for {DB_REPLICA_RETRY_SECONDS:g}s: {error}")
+
+    async def _replica_lag_seconds() -> Optional[float]:
+        """Отставание реплики (кэш на DB_REPLICA_CHECK_INTERVAL); None — реплики нет или она недоступна"""
+        global _replica_pool, _replica_lag, _replica_checked_at
+        if not DATABASE_REPLICA_URL or time.monotonic() < _replica_down_until:
+            return None
+        if time.monotonic() - _replica_checked_at < DB_REPLICA_CHECK_INTERVAL:
+            return _replica_lag
+
+        async with _replica_lock:
+            if time.monotonic() - _replica_checked_at < DB_REPLICA_CHECK_INTERVAL:
+                return _replica_lag
+            try:
+                if _replica_pool is None:
+                    role = _pool.role if _pool else os.getenv("DB_ROLE", "script")
+                    pool = await asyncpg.create_pool(DATABASE_REPLICA_URL, **pool_options(role))
+                    _replica_pool = MeteredPool(pool, role)
+                    logger.info("✅ PostgreSQL replica pool initialized")
+                async with _replica_pool.acquire(timeout=2) as conn:
+                    lag = await conn.fetchval(REPLICA_LAG_SQL, timeout=2)
+                if lag is None:
+                    raise RuntimeError("no WAL stream and nothing replayed")
+                _replica_lag = float(lag)
+                _metrics().observe_replica_lag(_replica_lag)
+            except Exception as e:
+                _replica_down(e)
+            _replica_checked_at = time.monotonic()
+            return _replica_lag
+
+    @asynccontextmanager
+    async def read_connection(max_lag: Optional[float] = None) -> AsyncIterator[Any]:
+        """
+        Подключение для read-only запроса: реплика, если она отстаёт не больше
+        max_lag (по умолчанию DB_REPLICA_MAX_LAG) секунд, иначе primary.
+        """
+        max_lag = DB_REPLICA_MAX_LAG if max_lag is None else max_lag
+        lag = await _replica_lag_seconds()
+        if lag is not None and lag <= max_lag:
+            try:
+                acquire = _replica_pool.acquire(timeout=2)
+                conn = await acquire.__aenter__()
+            except Exception as e:
+                _replica_down(e)
+                _metrics().db_read("primary_down")
+            else:
+                _metrics().db_read("replica")
+                try:
+                    yield conn
+                finally:
+                    await acquire.__aexit__(None, None, None)
+                return
+        elif lag is not None:
+            _metrics().db_read("primary_stale")
+        elif DATABASE_REPLICA_URL:
+            _metrics().db_read("primary_down")
+
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            yield conn
 
 else:
     # PostgreSQL is required - Supabase support removed
@@ -70,6 +188,10 @@ else:
     )
 
 
+# Лимит одновременных job'ов одного пользователя при выдаче из очереди (0 = без лимита)
+QUEUE_MAX_JOBS_PER_USER = int(os.getenv("QUEUE_MAX_JOBS_PER_USER", "3"))
+
+
 # ---------------- USERS ----------------
 
 async def get_or_create_user(tg_user_id: int, username: Optional[str] = None) -> Dict[str, Any]:
@@ -149,7 +271,7 @@ async def create_job_and_consume_credit(
     
     import logging
     logger = logging.getLogger(__name__)
-    logger.info(f"🔍 DEBUG create_job_and_consume_credit called with prompt_input: {prompt_input[:500]}")
+    logger.debug(f"🔍 create_job_and_consume_credit prompt_input: {prompt_input[:200]}")
     
     if DATABASE_TYPE == "postgres":
         pool = await get_pool()
@@ -189,13 +311,13 @@ async def create_job_and_consume_credit(
 
 
 async def get_job_by_id(job_id: int) -> Optional[Dict[str, Any]]:
-    """Получает задание по ID"""
+    """Получает задание по ID (включая архив, database/jobs_archive.sql)"""
     
     if DATABASE_TYPE == "postgres":
         pool = await get_pool()
         async with pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT * FROM jobs WHERE id = $1",
+                "SELECT * FROM jobs_all WHERE id = $1",
                 job_id
             )
             return dict(row) if row else None
@@ -264,14 +386,13 @@ async def update_job_status(
 
 
 async def get_user_jobs(tg_user_id: int, limit: int = 10) -> list[Dict[str, Any]]:
-    """Получает последние задания пользователя"""
+    """Получает последние задания пользователя (горячие и архивные)"""
     
     if DATABASE_TYPE == "postgres":
-        pool = await get_pool()
-        async with pool.acquire() as conn:
+        async with read_connection() as conn:
             rows = await conn.fetch(
                 """
-                SELECT * FROM jobs
+                SELECT * FROM jobs_all
                 WHERE tg_user_id = $1
                 ORDER BY created_at DESC
                 LIMIT $2
@@ -389,43 +510,294 @@ async def mark_job_failed_with_refund(
     Помечает job как failed + возвращает кредит пользователю
     Используется при критических ошибках (USER_VIOLATION, BILLING, превышен retry)
     """
-    # Обновляем статус job
-    await update_job_status(job_id, "failed", error_message=error_message)
-    
-    # Возвращаем кредит
-    await refund_credit(tg_user_id)
-    
-    logger.info(f"❌ Job {job_id} marked as failed, credit refunded to user {tg_user_id}")
+    result = await fail_job_and_refund(job_id, error_message)
+
+    logger.info(
+        f"❌ Job {job_id} marked as failed, credit refunded to user {tg_user_id}: {result.get('refunded')}"
+    )
+
+
+# ============ Атомарные переходы состояний (database/job_transitions.sql) ============
+# timeline — события этапов (worker/stage_timer.py), дописываются в jobs.timeline
+# тем же запросом, что и переход (database/job_timeline.sql)
+
+def _timeline_param(timeline: Optional[list]) -> Optional[list]:
+    """Параметр jsonb: список как есть (кодек пула, app/db_pool.py), пустой — NULL"""
+    return timeline or None
+
+
+async def fail_job_and_refund(
+    job_id: str,
+    error: Optional[str],
+    timeline: Optional[list] = None,
+) -> Dict[str, Any]:
+    """
+    Помечает job как failed и возвращает кредит в одной транзакции.
+    Идемпотентно: повторный вызов не вернёт кредит второй раз.
+
+    Returns:
+        {"job_id", "found", "status", "refunded", "new_credits"}
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        result = await conn.fetchval(
+            "SELECT fail_job_and_refund($1, $2), append_job_timeline($1, $3::jsonb)",
+            str(job_id), error, _timeline_param(timeline)
+        )
+
+    result = result or {}
+
+    if result.get("refunded"):
+        # refunded=True ровно один раз на job — счётчик не задваивается повторными вызовами
+        _metrics().job_finished("failed")
+        logger.info(f"💰 Job {job_id} failed, credit refunded, new balance: {result.get('new_credits')}")
+    else:
+        logger.info(f"❌ Job {job_id} failed (credit already refunded or job not found)")
+    return result
+
+
+async def complete_job(
+    job_id: str,
+    video_url: Optional[str],
+    file_id: Optional[str] = None,
+    stage_durations: Optional[Dict[str, float]] = None,
+    timeline: Optional[list] = None,
+) -> bool:
+    """
+    Помечает job как completed и сохраняет результат одним запросом.
+    stage_durations — длительности этапов в секундах (database/job_eta.sql).
+    Возвращает False если job уже был завершён ранее.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        completed = bool(await conn.fetchval(
+            "SELECT complete_job($1, $2, $3, $4::jsonb), append_job_timeline($1, $5::jsonb)",
+            str(job_id), video_url, file_id,
+            stage_durations or None,
+            _timeline_param(timeline)
+        ))
+    if completed:
+        _metrics().job_finished("completed")
+    return completed
+
+
+async def requeue_job(job_id: str, delay_seconds: int = 0, timeline: Optional[list] = None) -> bool:
+    """
+    Возвращает job в очередь. Job не будет выдан fetch_next_queued_job()
+    раньше чем через delay_seconds — воркеру не нужно спать.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        requeued = bool(await conn.fetchval(
+            "SELECT requeue_job($1, $2), append_job_timeline($1, $3::jsonb)",
+            str(job_id), int(delay_seconds), _timeline_param(timeline)
+        ))
+    if requeued:
+        _metrics().job_finished("requeued")
+    return requeued
+
+
+async def handoff_job(job_id: str, timeline: Optional[list] = None) -> bool:
+    """
+    Возвращает job, ожидающий KIE, в очередь при остановке воркера (database/job_handoff.sql).
+    kie_task_id сохраняется — следующий воркер продолжает poll без новой генерации.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        handed_off = bool(await conn.fetchval(
+            "SELECT handoff_job($1), append_job_timeline($1, $2::jsonb)",
+            str(job_id), _timeline_param(timeline)
+        ))
+    if handed_off:
+        _metrics().job_finished("handoff")
+    return handed_off
+
+
+async def claim_batch_delivery(
+    batch_id: Optional[str] = None, deadline_seconds: float = 900
+) -> list[Dict[str, Any]]:
+    """
+    Забирает готовые к доставке ролики батчей (database/job_batches.sql) и помечает
+    их доставленными. batch_id=None — все батчи, где все job'ы завершились или
+    с первого готового прошло deadline_seconds. Строки отсортированы по батчу.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT * FROM claim_batch_delivery($1, make_interval(secs => $2))",
+            batch_id, float(deadline_seconds)
+        )
+    return [dict(row) for row in rows]
+
+
+async def get_media_file_ids() -> Dict[str, str]:
+    """Реестр file_id файлов assets/ (database/media_registry.sql): sha256 -> file_id"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT sha256, file_id FROM media_files")
+    return {row["sha256"]: row["file_id"] for row in rows}
+
+
+async def save_media_file_id(sha256: str, path: str, kind: str, file_id: str) -> None:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO media_files (sha256, path, kind, file_id)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (sha256) DO UPDATE
+            SET path = EXCLUDED.path, kind = EXCLUDED.kind,
+                file_id = EXCLUDED.file_id, uploaded_at = NOW()
+            """,
+            sha256, path, kind, file_id
+        )
+
+
+# Ключ advisory lock заливки assets/: несколько процессов бота не льют одно и то же
+MEDIA_REGISTRY_LOCK_KEY = 4_501_045
+
+
+@asynccontextmanager
+async def media_registry_lock() -> AsyncIterator[None]:
+    """
+    Сериализует заливку assets/ между процессами бота: второй процесс ждёт
+    первого и потом находит file_id уже в реестре.
+    Session-level lock держится всю заливку, поэтому на отдельном подключении
+    напрямую к Postgres (DATABASE_DIRECT_URL), а не из пула: за PgBouncer в
+    transaction mode lock и unlock ушли бы на разные серверные сессии, и lock
+    остался бы висеть. Закрытие подключения снимает lock и при падении процесса.
+    """
+    conn = await asyncpg.connect(direct_database_url())
+    try:
+        await conn.execute("SELECT pg_advisory_lock($1)", MEDIA_REGISTRY_LOCK_KEY)
+        yield
+    finally:
+        await conn.close()
+
+
+async def record_kie_callback(task_id: str, state: str, payload: Dict[str, Any]) -> Optional[str]:
+    """
+    Записывает итог задачи KIE из callback'а в job и будит воркер NOTIFY kie_task_done
+    (database/kie_callback.sql). None — дубль callback'а или задача не наша.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT record_kie_callback($1, $2, $3::jsonb)",
+            task_id, state, payload
+        )
+
+
+# Пауза между попытками переподключить LISTEN, сек: удваивается до максимума
+LISTEN_RECONNECT_MIN = 1.0
+LISTEN_RECONNECT_MAX = 60.0
+
+
+class NotifyListener:
+    """
+    LISTEN с переподключением: рестарт Postgres или обрыв сети закрывает
+    подключение, termination listener запускает переподключение с backoff.
+    Пока is_closed(), NOTIFY не приходят — вызывающий должен опрашивать чаще.
+    on_reconnect() вызывается после восстановления: NOTIFY за время обрыва потеряны.
+    """
+
+    def __init__(self, channel: str, callback: Callable[[str], Any], on_reconnect: Optional[Callable[[], Any]] = None):
+        self.channel = channel
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self._conn = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    def is_closed(self) -> bool:
+        return self._conn is None or self._conn.is_closed()
+
+    async def connect(self) -> None:
+        conn = await asyncpg.connect(direct_database_url())
+        try:
+            await conn.add_listener(self.channel, self._on_notify)
+            conn.add_termination_listener(self._on_terminated)
+        except BaseException:
+            await conn.close()
+            raise
+        self._conn = conn
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        self.callback(payload)
+
+    def _on_terminated(self, _conn) -> None:
+        if self._stopped or self._reconnect_task is not None:
+            return
+        logger.warning(f"⚠️ LISTEN {self.channel} connection lost, reconnecting")
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = LISTEN_RECONNECT_MIN
+        try:
+            while not self._stopped:
+                await asyncio.sleep(delay)
+                try:
+                    await self.connect()
+                except Exception as e:
+                    logger.warning(f"⚠️ LISTEN {self.channel} reconnect failed, retry in {delay:g}s: {e}")
+                    delay = min(delay * 2, LISTEN_RECONNECT_MAX)
+                    continue
+                logger.info(f"✅ LISTEN {self.channel} reconnected")
+                if self.on_reconnect is not None:
+                    self.on_reconnect()
+                return
+        finally:
+            self._reconnect_task = None
+
+    async def close(self) -> None:
+        self._stopped = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+
+
+async def listen(
+    channel: str, callback: Callable[[str], Any], on_reconnect: Optional[Callable[[], Any]] = None
+) -> NotifyListener:
+    """
+    LISTEN на отдельном подключении (не из пула: оно занято всё время жизни слушателя).
+    За PgBouncer — напрямую к Postgres (DATABASE_DIRECT_URL), LISTEN держит сессию.
+    callback(payload) вызывается в event loop. Обрыв подключения переподключается
+    сам (NotifyListener). Возвращает слушателя — закрыть при остановке.
+    """
+    listener = NotifyListener(channel, callback, on_reconnect)
+    await listener.connect()
+    return listener
 
 
 # ---------------- WORKER FUNCTIONS ----------------
 
-async def fetch_next_queued_job() -> Optional[Dict[str, Any]]:
-    """Получает следующее задание из очереди (для worker'а)
+async def fetch_next_queued_job(max_per_user: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Забирает следующее задание из очереди (для worker'а)
     
-    ВАЖНО: Не обновляет статус! Worker сам вызовет update_job(status='processing')
-    Это предотвращает race condition если несколько worker'ов запущены.
+    Выдача справедливая (database/fair_queue.sql): по кругу между пользователями
+    с учётом их веса и лимита одновременных job'ов на пользователя.
+    Job атомарно переводится в processing (started_at, attempts + 1) —
+    worker получает уже закреплённый за ним job.
     """
-    import logging
-    logger = logging.getLogger(__name__)
+    if max_per_user is None:
+        max_per_user = QUEUE_MAX_JOBS_PER_USER
     
     if DATABASE_TYPE == "postgres":
         pool = await get_pool()
         async with pool.acquire() as conn:
-            # Получаем первый queued job БЕЗ UPDATE
-            # FOR UPDATE SKIP LOCKED предотвращает другим worker'ам брать этот job
             row = await conn.fetchrow(
-                """
-                SELECT * FROM jobs
-                WHERE status = 'queued'
-                ORDER BY created_at ASC
-                FOR UPDATE SKIP LOCKED
-                LIMIT 1
-                """
+                "SELECT * FROM claim_next_job($1)",
+                max_per_user
             )
             if row:
                 job_dict = dict(row)
-                logger.info(f"✅ Fetched job {job_dict.get('id', 'unknown')} from queue (status will be set by worker)")
+                logger.info(
+                    f"✅ Claimed job {job_dict.get('id', 'unknown')} "
+                    f"(user={job_dict.get('tg_user_id')}, attempt={job_dict.get('attempts')})"
+                )
                 return job_dict
             else:
                 logger.debug("⏳ No queued jobs found")
@@ -483,8 +855,7 @@ async def get_queue_position(job_id: int) -> int:
     """Возвращает позицию задания в очереди"""
     
     if DATABASE_TYPE == "postgres":
-        pool = await get_pool()
-        async with pool.acquire() as conn:
+        async with read_connection() as conn:
             # Получаем created_at задания
             job_row = await conn.fetchrow(
                 "SELECT created_at FROM jobs WHERE id = $1",
@@ -528,6 +899,73 @@ async def get_queue_position(job_id: int) -> int:
         return (len(r.data) if r.data else 0) + 1
 
 
+async def get_queue_snapshot(job_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Снимок очереди для оценки ETA (app/services/eta.py).
+
+    Returns:
+        {"queued", "in_flight", "ahead", "status", "elapsed", "template_id", "model"}
+        ahead/status/elapsed/template_id/model заполняются только для job_id.
+    """
+    # Только что созданного job'а на реплике может ещё не быть — с job_id читаем primary
+    if job_id is None:
+        connection = read_connection()
+    else:
+        connection = (await get_pool()).acquire()
+    async with connection as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE status = 'queued') AS queued,
+                COUNT(*) FILTER (WHERE status = 'processing') AS in_flight
+            FROM jobs
+            WHERE status IN ('queued', 'processing')
+            """
+        )
+        snapshot: Dict[str, Any] = {
+            "queued": int(row["queued"] or 0),
+            "in_flight": int(row["in_flight"] or 0),
+        }
+        if job_id is None:
+            return snapshot
+
+        job_row = await conn.fetchrow(
+            """
+            SELECT
+                j.status,
+                COALESCE(j.template_id, 'ugc') AS template_id,
+                j.model,
+                EXTRACT(EPOCH FROM (NOW() - j.started_at)) AS elapsed,
+                (
+                    SELECT COUNT(*) FROM jobs q
+                    WHERE q.status = 'queued' AND q.created_at < j.created_at
+                ) AS ahead
+            FROM jobs j
+            WHERE j.id = $1
+            """,
+            str(job_id)
+        )
+        if job_row:
+            snapshot.update({
+                "ahead": int(job_row["ahead"] or 0),
+                "status": job_row["status"],
+                "elapsed": float(job_row["elapsed"] or 0),
+                "template_id": job_row["template_id"],
+                "model": job_row["model"],
+            })
+        return snapshot
+
+
+async def get_stage_duration_quantiles(window_hours: int = 72) -> list[Dict[str, Any]]:
+    """p50/p90 длительностей этапов по шаблону и модели (database/job_eta.sql)"""
+    async with read_connection() as conn:
+        rows = await conn.fetch(
+            "SELECT * FROM stage_duration_quantiles(make_interval(hours => $1))",
+            int(window_hours)
+        )
+        return [dict(row) for row in rows]
+
+
 async def safe_get_balance(tg_user_id: int) -> int:
     """
     Безопасно получает баланс пользователя (с timeout и обработкой ошибок)
@@ -547,23 +985,29 @@ async def safe_get_balance(tg_user_id: int) -> int:
         return 0
 
 
-async def list_last_jobs(tg_user_id: int, limit: int = 5) -> list[Dict[str, Any]]:
-    """Возвращает последние задания пользователя"""
+async def list_last_jobs(
+    tg_user_id: int, limit: int = 5, offset: int = 0, completed_only: bool = False
+) -> list[Dict[str, Any]]:
+    """
+    Возвращает последние задания пользователя (горячие и архивные), постранично.
+    completed_only — только готовые видео (галерея "Мои видео", app/services/gallery.py).
+    """
     
     if DATABASE_TYPE == "postgres":
-        pool = await get_pool()
-        async with pool.acquire() as conn:
+        async with read_connection() as conn:
             rows = await conn.fetch(
                 """
-                SELECT id, template_type as kind, status, created_at, 
-                       result_video_path as output_url, error_message as error,
-                       template_type as template_id
-                FROM jobs
+                SELECT id, COALESCE(kind, 'reels') AS kind, status,
+                       created_at, finished_at, product_name,
+                       video_url AS output_url, video_file_id, error,
+                       COALESCE(template_id, 'ugc') AS template_id
+                FROM jobs_all
                 WHERE tg_user_id = $1
+                  AND (NOT $4 OR status = 'completed')
                 ORDER BY created_at DESC
-                LIMIT $2
+                LIMIT $2 OFFSET $3
                 """,
-                tg_user_id, limit
+                tg_user_id, limit, offset, completed_only
             )
             return [dict(row) for row in rows]
     
@@ -596,6 +1040,7 @@ async def update_job(job_id: str, updates: Dict[str, Any]):
     Используется worker.py с новой системой обработки ошибок
     
     ВАЖНО: Для timestamp полей передавайте строку "NOW()" чтобы использовать SQL NOW()
+    "timeline" — список событий этапов, дописывается к jobs.timeline (не перезаписывает)
     """
     if DATABASE_TYPE == "postgres":
         pool = await get_pool()
@@ -608,6 +1053,11 @@ async def update_job(job_id: str, updates: Dict[str, Any]):
                 # Для "NOW()" вставляем напрямую в SQL
                 if isinstance(value, str) and value == "NOW()":
                     set_parts.append(f"{key} = NOW()")
+                elif key == "timeline":
+                    if not value:
+                        continue
+                    set_parts.append(f"timeline = COALESCE(timeline, '[]'::jsonb) || ${len(params) + 1}::jsonb")
+                    params.append(_timeline_param(value))
                 else:
                     set_parts.append(f"{key} = ${len(params) + 1}")
                     params.append(value)
@@ -0,0 +1,165 @@
+"""
+Размер пула PostgreSQL из общего бюджета подключений
+
+- Бюджет DB_CONNECTION_BUDGET — сколько подключений весь кластер процессов
+  (боты, воркеры, скрипты) может держать к DATABASE_URL: max_connections
+  Postgres минус запас для Metabase/админов, либо default_pool_size PgBouncer
+- Воркер обрабатывает один job за раз и большую часть времени ждёт KIE —
+  ему хватает маленького пула (+1 подключение LISTEN для callback'ов KIE)
+- DB_RESERVED_CONNECTIONS — под скрипты, autoscaler и rollup'ы
+- Остаток делится между процессами бота (WEBHOOK_PROCESSES)
+- DB_PGBOUNCER=true — режим transaction pooling: без кэша prepared statements,
+  без состояния сессии; LISTEN идёт мимо PgBouncer по DATABASE_DIRECT_URL
+- MeteredPool замеряет ожидание свободного подключения (app/metrics.py)
+- json/jsonb декодируются в dict/list прямо драйвером (orjson), параметры
+  jsonb передаются Python-объектами, без json.dumps в вызывающем коде
+"""
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson есть в requirements.txt
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def json_dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, ensure_ascii=False)
+
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+async def init_connection(conn: Any) -> None:
+    """init= для create_pool: кодеки json/jsonb на каждом новом подключении"""
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name, encoder=json_dumps, decoder=json_loads, schema="pg_catalog", format="text"
+        )
+
+
+def _env_bool(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class BudgetConfig:
+    budget: int = int(os.getenv("DB_CONNECTION_BUDGET", "80"))
+    reserved: int = int(os.getenv("DB_RESERVED_CONNECTIONS", "10"))
+    bot_processes: int = int(os.getenv("WEBHOOK_PROCESSES", "1"))
+    # С autoscaler'ом воркеров может стать AUTOSCALE_MAX_WORKERS — бюджет считаем на потолок
+    worker_processes: int = int(
+        os.getenv("DB_WORKER_PROCESSES")
+        or os.getenv("AUTOSCALE_MAX_WORKERS")
+        or os.getenv("WORKER_INSTANCES")
+        or "1"
+    )
+    worker_pool_max: int = int(os.getenv("DB_WORKER_POOL_MAX", "2"))
+    # Отдельное подключение LISTEN kie_task_done у каждого воркера
+    worker_listens: bool = bool(os.getenv("KIE_CALLBACK_TOKEN", "").strip())
+    # Больше подключений, чем одновременных хендлеров, боту не нужно
+    bot_pool_cap: int = int(os.getenv("WEBHOOK_MAX_TASKS", "64"))
+    script_pool_max: int = 2
+
+
+def pool_size(role: str, cfg: Optional[BudgetConfig] = None) -> Tuple[int, int]:
+    """(min_size, max_size) пула процесса роли bot | worker | script"""
+    cfg = cfg or BudgetConfig()
+
+    if role == "worker":
+        return 1, max(cfg.worker_pool_max, 1)
+    if role != "bot":
+        return 1, max(cfg.script_pool_max, 1)
+
+    per_worker = cfg.worker_pool_max + (1 if cfg.worker_listens else 0)
+    left = cfg.budget - cfg.reserved - cfg.worker_processes * per_worker
+    max_size = min(left // max(cfg.bot_processes, 1), cfg.bot_pool_cap)
+    if max_size < 2:
+        logger.warning(
+            f"⚠️ DB connection budget {cfg.budget} is overcommitted: "
+            f"{cfg.worker_processes} workers × {per_worker} + {cfg.reserved} reserved, "
+            f"bot pool falls back to 2"
+        )
+        max_size = 2
+    return 2, max_size
+
+
+def pool_options(role: str) -> Dict[str, Any]:
+    """Аргументы asyncpg.create_pool для роли (DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE перекрывают бюджет)"""
+    min_size, max_size = pool_size(role)
+    max_size = int(os.getenv("DB_POOL_MAX_SIZE") or max_size)
+    min_size = min(int(os.getenv("DB_POOL_MIN_SIZE") or min_size), max_size)
+
+    options: Dict[str, Any] = {
+        "min_size": min_size,
+        "max_size": max_size,
+        "command_timeout": 60,
+        # Простаивающие подключения воркеров, ждущих KIE, закрываются и не держат слот
+        "max_inactive_connection_lifetime": float(os.getenv("DB_POOL_IDLE_LIFETIME", "60")),
+        "init": init_connection,
+    }
+    if pgbouncer_mode():
+        # Transaction pooling: следующий запрос может уйти в другой backend —
+        # именованные prepared statements там не существуют
+        options["statement_cache_size"] = 0
+    return options
+
+
+def pgbouncer_mode() -> bool:
+    return _env_bool("DB_PGBOUNCER")
+
+
+def direct_database_url() -> str:
+    """
+    DSN для подключений с состоянием сессии (LISTEN). За PgBouncer в transaction
+    режиме LISTEN не работает — нужен DATABASE_DIRECT_URL прямо к Postgres.
+    """
+    direct = os.getenv("DATABASE_DIRECT_URL", "").strip()
+    if direct:
+        return direct
+    if pgbouncer_mode():
+        raise RuntimeError("DB_PGBOUNCER=true requires DATABASE_DIRECT_URL for LISTEN")
+    return os.getenv("DATABASE_URL", "")
+
+
+class _MeteredAcquire:
+    def __init__(self, owner: "MeteredPool", timeout: Optional[float]):
+        self._owner = owner
+        self._ctx = owner.pool.acquire(timeout=timeout)
+
+    async def __aenter__(self):
+        from app.metrics import observe_db_pool_wait
+
+        self._owner.waiting += 1
+        started = time.perf_counter()
+        try:
+            return await self._ctx.__aenter__()
+        finally:
+            self._owner.waiting -= 1
+            observe_db_pool_wait(time.perf_counter() - started)
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+
+class MeteredPool:
+    """Обёртка asyncpg.Pool: acquire() считает ожидание и очередь за подключением"""
+
+    def __init__(self, pool: Any, role: str):
+        self.pool = pool
+        self.role = role
+        self.waiting = 0
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _MeteredAcquire:
+        return _MeteredAcquire(self, timeout)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.pool, name)
@@ -1,11 +1,12 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 
 from app.keyboards import kb_continue, kb_menu
 from app import texts
 from app.db_adapter import get_or_create_user
+from app.services.media_registry import media_input
 
 router = Router()
 
@@ -19,7 +20,7 @@ async def start_handler(message: Message):
 
     # 1) видео (если файла нет — закомментируй этот блок)
     try:
-        await message.answer_video(FSInputFile(WELCOME_VIDEO_PATH))
+        await message.answer_video(media_input(WELCOME_VIDEO_PATH))
     except Exception:
         pass
 
@@ -1,6 +1,6 @@
 import logging
 from aiogram import Router, F, Bot
-from aiogram.types import CallbackQuery, Message, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import CallbackQuery, Message, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 
 from app import texts
@@ -16,9 +16,13 @@ from app.keyboards import (
     kb_topup,     # ✅ ВАЖНО
     kb_video_count,  # ✅ Новая клавиатура
     kb_self_prompt_confirm,  # ✅ Подтверждение своего промта
+    kb_my_videos,
 )
 from app.db_adapter import get_or_create_user, safe_get_balance, get_user_jobs, add_credits
 from app.services.generation import start_generation
+from app.services.eta import get_new_jobs_eta, get_job_eta, format_eta
+from app.services.gallery import get_gallery_page, resend_video
+from app.services.media_registry import media_input
 from app.utils import ensure_dict
 
 logger = logging.getLogger(__name__)
@@ -33,7 +37,7 @@ MENU_TEXT = getattr(texts, "MENU", "Выберите действие 👇")
 async def show_menu(message, text, reply_markup):
     try:
         await message.answer_photo(
-            FSInputFile(MENU_PHOTO_PATH),
+            media_input(MENU_PHOTO_PATH),
             caption=text,
             reply_markup=reply_markup,
             parse_mode=PARSE_MODE,
@@ -107,6 +111,54 @@ async def cabinet(cb: CallbackQuery):
         )
 
 
+@router.callback_query(F.data == "my_videos")
+@router.callback_query(F.data.startswith("my_videos:"))
+async def my_videos(cb: CallbackQuery):
+    """Галерея готовых видео (app/services/gallery.py). my_videos:<page> — листание"""
+    await cb.answer()
+    paging = ":" in cb.data
+    try:
+        page = int(cb.data.split(":", 1)[1]) if paging else 0
+    except ValueError:
+        page = 0
+
+    try:
+        items, has_next = await get_gallery_page(cb.from_user.id, page)
+    except Exception as e:
+        logging.error(f"Error in my_videos: {e}", exc_info=True)
+        await cb.message.answer("⚠️ Ошибка, попробуй ещё раз", reply_markup=kb_back_to_menu())
+        return
+
+    if not items and page == 0:
+        await cb.message.answer(texts.MY_VIDEOS_EMPTY, reply_markup=kb_menu(), parse_mode=PARSE_MODE)
+        return
+
+    markup = kb_my_videos(items, page, has_next)
+    if paging:
+        # Листание правит то же сообщение, а не шлёт новое
+        try:
+            await cb.message.edit_reply_markup(reply_markup=markup)
+            return
+        except Exception as e:
+            logging.debug(f"Gallery page edit failed, sending new message: {e}")
+    await cb.message.answer(texts.MY_VIDEOS, reply_markup=markup, parse_mode=PARSE_MODE)
+
+
+@router.callback_query(F.data.startswith("video:"))
+async def send_my_video(cb: CallbackQuery):
+    """Повторная отправка готового видео по file_id"""
+    job_id = cb.data.split(":", 1)[1]
+    try:
+        sent = await resend_video(cb.bot, cb.from_user.id, job_id)
+    except Exception as e:
+        logging.error(f"Error resending video {job_id}: {e}", exc_info=True)
+        sent = False
+    if sent:
+        await cb.answer()
+    else:
+        await cb.answer("⚠️ Это видео больше недоступно", show_alert=True)
+
+
 @router.callback_query(F.data == "topup")
 async def topup(cb: CallbackQuery):
     await cb.answer()
@@ -503,12 +555,15 @@ async def on_video_count(cb: CallbackQuery, state: FSMContext):
         await state.clear()
         return
 
+    data = await state.get_data()
+    eta_text = format_eta(await get_new_jobs_eta(count, data.get("template_id")))
+
     confirm_tpl = (
         f"🎬 <b>Готовы запустить генерацию?</b>\n\n"
         f"Количество видео: <b>{count}</b>\n"
         f"Стоимость: <b>{count} {'кредит' if count == 1 else 'кредита' if count < 5 else 'кредитов'}</b>\n"
         f"Текущий баланс: <b>{credits}</b>\n\n"
-        f"⏱ Генерация займёт от <b>1 до 30 минут</b> в зависимости от загруженности нейросети Sora 2.\n\n"
+        f"⏱ С учётом текущей очереди генерация займёт {eta_text}.\n\n"
         f"Запускаем?"
     )
     
@@ -562,6 +617,9 @@ async def confirm_generation(cb: CallbackQuery, state: FSMContext):
         # Запускаем генерацию для каждого видео
         success_count = 0
         error_count = 0
+        last_job_id = None
+        # Несколько видео одного заказа приходят одной медиагруппой (worker/batch_delivery.py)
+        batch_id = cb.id if video_count > 1 else None
         
         for i in range(video_count):
             # Уникальный idempotency_key для каждого видео
@@ -577,9 +635,11 @@ async def confirm_generation(cb: CallbackQuery, state: FSMContext):
                 product_info={"text": product_text, "user_prompt": user_prompt},
                 extra_wishes=extra_wishes,
                 template_id=template_id,
+                batch_id=batch_id,
             )
             if job_id:
                 success_count += 1
+                last_job_id = job_id
                 logging.info(f"✅ Job created: {job_id}")
             else:
                 error_count += 1
@@ -588,12 +648,14 @@ async def confirm_generation(cb: CallbackQuery, state: FSMContext):
         # Подтверждаем запуск только если есть успешно созданные задачи
         if success_count > 0:
             logging.info(f"🎬 {success_count} jobs created successfully, {error_count} failed")
+            # Очередь уже содержит наши job'ы: оцениваем до готовности последнего
+            eta_text = format_eta(await get_job_eta(last_job_id))
             # Избегаем дублирующих уведомлений. Сообщение о старте отправляет worker при первой попытке.
             await cb.message.answer(
                 f"✅ <b>Принял!</b>\n\n"
                 f"🔄 <b>Прохожу модерацию Sora 2...</b>\n\n"
                 f"⏱ После одобрения — сразу пришлю результаты сюда.\n"
-                f"Обычно это занимает <b>5-10 минут</b> ⏳",
+                f"Ориентировочно это займёт {eta_text} ⏳",
                 parse_mode=PARSE_MODE,
             )
         else:
@@ -622,7 +684,7 @@ async def retry_same_product(cb: CallbackQuery, state: FSMContext):
     pool = await get_pool()
     async with pool.acquire() as conn:
         job = await conn.fetchrow(
-            "SELECT product_image_url, product_text, template_type, kind FROM jobs WHERE id::text = $1",
+            "SELECT product_image_url, product_text, template_id, kind FROM jobs_all WHERE id::text = $1",
             job_id
         )
     
@@ -637,10 +699,10 @@ async def retry_same_product(cb: CallbackQuery, state: FSMContext):
     # Восстанавливаем данные в state
     await state.clear()
     await state.update_data(
-        kind=job["kind"],
+        kind=job["kind"] or "reels",
         photo_file_id=job["product_image_url"],
         product_text=job["product_text"],
-        template_id=job.get("template_id") or job.get("template_type") or "ugc",
+        template_id=job["template_id"] or "ugc",
     )
     
     # Переходим сразу к выбору количества видео (уже есть photo, product_text, template)
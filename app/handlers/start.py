@@ -7,6 +7,7 @@ from app import texts
 from app.keyboards import kb_continue, kb_accept_terms
 from app.db_adapter import get_or_create_user
 from app.config import WELCOME_VIDEO_FILE_ID, WELCOME_VIDEO_FILE_IDS
+from app.services.media_registry import welcome_video_ids
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -53,6 +54,8 @@ async def on_accept_terms(cb: CallbackQuery):
     # После принятия условий отправляем демо-видео (поддержка до 10 file_id)
     try:
         ids = WELCOME_VIDEO_FILE_IDS or ([WELCOME_VIDEO_FILE_ID] if WELCOME_VIDEO_FILE_ID else [])
+        # Без ручных file_id в .env — из реестра assets/welcome*.mp4
+        ids = ids or welcome_video_ids()
         if ids:
             media = [InputMediaVideo(media=vid) for vid in ids[:10]]
             if len(media) == 1:
@@ -63,7 +66,7 @@ async def on_accept_terms(cb: CallbackQuery):
                 await cb.message.answer_media_group(media)
         else:
             # НЕТ fallback с диска — пропускаем отправку видео
-            logger.info("ℹ️ No welcome video IDs configured; skipping demo videos.")
+            logger.info("ℹ️ No welcome video file_ids (env or registry); skipping demo videos.")
     except Exception as e:
         logger.error(f"❌ Failed to send video: {e}")
 
@@ -93,12 +93,35 @@ def kb_topup():
 # ========== CABINET ==========
 def kb_cabinet(support_url: str = "https://t.me/fabricbothelper"):
     return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎬 Мои видео", callback_data="my_videos")],
         [InlineKeyboardButton(text="💳 Пополнить баланс", callback_data="topup")],
         [InlineKeyboardButton(text="🆘 Служба поддержки", url=support_url)],
         [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="back_to_menu")],
     ])
 
 
+def kb_my_videos(items, page: int, has_next: bool):
+    """Страница галереи: по кнопке на видео, листание, назад в кабинет"""
+    rows = []
+    for job in items:
+        finished = job.get("finished_at") or job.get("created_at")
+        when = finished.strftime("%d.%m %H:%M") if finished else ""
+        name = (job.get("product_name") or "").strip()[:24]
+        rows.append([InlineKeyboardButton(
+            text=f"🎬 {when} · {name}" if name else f"🎬 {when}",
+            callback_data=f"video:{job['id']}",
+        )])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"my_videos:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Дальше ▶️", callback_data=f"my_videos:{page + 1}"))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="👤 В кабинет", callback_data="cabinet")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def kb_no_credits():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="💳 Пополнить баланс", callback_data="topup")],
@@ -0,0 +1,88 @@
+"""
+Приём callback'ов KIE о завершении задачи генерации
+
+- KIE вызывает callBackUrl из createTask (app/config.py: kie_callback_url) — POST с тем же
+  телом, что отдаёт recordInfo: {"code": 200, "data": {"taskId": ..., "state": ...}}
+- Подлинность — секрет KIE_CALLBACK_TOKEN в query (?token=...), сравнение constant-time
+- Итог задачи пишется в job одной RPC (database/kie_callback.sql): дубль callback'а
+  ничего не меняет, воркер будится NOTIFY kie_task_done
+- Видео воркер всё равно берёт из recordInfo: callback только сигнал "пора проверить"
+- KIE получает 200 на всё, кроме неверного токена и битого тела, — иначе он повторяет доставку
+"""
+import hmac
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import web
+
+from app.config import KIE_CALLBACK_PATH, KIE_CALLBACK_TOKEN
+from app.db_adapter import record_kie_callback
+from app.metrics import KIE_CALLBACKS
+
+logger = logging.getLogger(__name__)
+
+# Состояния, после которых задача KIE больше не меняется
+TERMINAL_STATES = {
+    "success", "succeeded", "done", "completed", "finish", "finished",
+    "fail", "failed", "error", "canceled", "cancelled",
+}
+
+
+def parse_callback(payload: Any) -> Optional[Tuple[str, str]]:
+    """(task_id, state) из тела callback'а; None, если тело не похоже на callback KIE"""
+    if not isinstance(payload, dict):
+        return None
+    data = payload.get("data")
+    if not isinstance(data, dict):
+        return None
+    task_id = data.get("taskId") or data.get("task_id")
+    state = (data.get("state") or data.get("status") or "").lower()
+    if not task_id or not state:
+        return None
+    return str(task_id), state
+
+
+def is_authorized(request: web.Request, token: Optional[str] = None) -> bool:
+    token = KIE_CALLBACK_TOKEN if token is None else token
+    if not token:
+        return False
+    return hmac.compare_digest(request.query.get("token", ""), token)
+
+
+async def handle_kie_callback(request: web.Request) -> web.Response:
+    if not is_authorized(request):
+        KIE_CALLBACKS.labels(result="unauthorized").inc()
+        logger.warning(f"🚫 KIE callback with bad token from {request.remote}")
+        return web.Response(status=401, text="Unauthorized")
+
+    try:
+        payload: Dict[str, Any] = await request.json()
+    except Exception as e:
+        KIE_CALLBACKS.labels(result="invalid").inc()
+        logger.warning(f"⚠️ Bad KIE callback payload: {e}")
+        return web.Response(status=400, text="Bad request")
+
+    parsed = parse_callback(payload)
+    if parsed is None:
+        KIE_CALLBACKS.labels(result="invalid").inc()
+        logger.warning(f"⚠️ KIE callback without taskId/state: {str(payload)[:300]}")
+        return web.Response(status=400, text="Bad request")
+
+    task_id, state = parsed
+    if state not in TERMINAL_STATES:
+        KIE_CALLBACKS.labels(result="ignored").inc()
+        return web.json_response({"status": "ignored"})
+
+    job_id = await record_kie_callback(task_id, state, payload)
+    if job_id is None:
+        KIE_CALLBACKS.labels(result="duplicate").inc()
+        logger.info(f"🔁 KIE callback for task {task_id} already recorded or unknown")
+        return web.json_response({"status": "duplicate"})
+
+    KIE_CALLBACKS.labels(result="accepted").inc()
+    logger.info(f"📬 KIE callback: task {task_id} → {state}, job {job_id}")
+    return web.json_response({"status": "ok"})
+
+
+def register(app: web.Application, path: str = KIE_CALLBACK_PATH) -> None:
+    app.router.add_post(path, handle_kie_callback)
@@ -0,0 +1,192 @@
+"""
+Общая настройка логирования для бота, DB-polling воркера и RQ воркера
+
+- Логгеры пишут в QueueHandler (без I/O в event loop), запись в stdout
+  делает QueueListener в отдельном потоке
+- Формат: JSON lines (LOG_FORMAT=json, по умолчанию) или текст (LOG_FORMAT=text)
+- В каждую запись добавляются job_id и stage из контекста (log_context / set_log_context)
+- Уровни: LOG_LEVEL (по умолчанию INFO) и по модулям LOG_LEVELS="worker.kie_client=WARNING,aiogram=INFO"
+- Повторяющиеся логи (poll KIE) семплируются: extra={"sample": "<ключ>"} пропускает
+  одну запись на ключ раз в LOG_SAMPLE_SECONDS, остальные считаются и дописываются к следующей
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional
+
+_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_job_id", default=None)
+_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_stage", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+# ---------------- КОНТЕКСТ ----------------
+
+def set_log_context(**fields: Optional[str]) -> None:
+    """Устанавливает job_id / stage для всех последующих логов текущей задачи"""
+    if "job_id" in fields:
+        _job_id.set(str(fields["job_id"]) if fields["job_id"] is not None else None)
+    if "stage" in fields:
+        _stage.set(fields["stage"])
+
+
+@contextmanager
+def log_context(job_id: Optional[str] = None, stage: Optional[str] = None) -> Iterator[None]:
+    """Временный контекст логов (восстанавливает прежние значения на выходе)"""
+    tokens = []
+    if job_id is not None:
+        tokens.append((_job_id, _job_id.set(str(job_id))))
+    if stage is not None:
+        tokens.append((_stage, _stage.set(stage)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет job_id и stage в запись (в потоке, где она создана)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "job_id"):
+            record.job_id = _job_id.get()
+        if not hasattr(record, "stage"):
+            record.stage = _stage.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает одну запись с extra={"sample": key} раз в interval секунд"""
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if not key or self.interval <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, 0.0) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+# ---------------- ФОРМАТ ----------------
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in ("service", "job_id", "stage", "suppressed"):
+            value = getattr(record, field, None)
+            if value:
+                payload[field] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        prefix = " ".join(
+            f"{field}={getattr(record, field)}"
+            for field in ("job_id", "stage")
+            if getattr(record, field, None)
+        )
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line = f"{line} (+{suppressed} similar suppressed)"
+        return f"[{prefix}] {line}" if prefix else line
+
+
+class _ServiceFilter(logging.Filter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.service = self.service
+        return True
+
+
+# ---------------- SETUP ----------------
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(service: str) -> None:
+    """
+    Настраивает root логгер процесса (идемпотентно).
+    service — имя процесса в JSON логах: bot, worker, rq_worker.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        stream.setFormatter(TextFormatter(TEXT_FORMAT))
+    else:
+        stream.setFormatter(JsonFormatter())
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Фильтры работают в потоке логгера: контекст и семплинг видят правильные значения
+    queue_handler.addFilter(_ServiceFilter(service))
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(float(os.getenv("LOG_SAMPLE_SECONDS", "60"))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    # Шумные библиотеки по умолчанию не ниже WARNING, переопределяется через LOG_LEVELS
+    levels = {"httpx": "WARNING", "httpcore": "WARNING", "asyncio": "WARNING"}
+    levels.update(_parse_levels(os.getenv("LOG_LEVELS", "")))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает очередь логов и останавливает поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,33 +1,43 @@
 import os
 import asyncio
 import logging
-import sys
+import multiprocessing
+import signal
+import time
 from aiohttp import web
 
 from aiogram import Bot, Dispatcher
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiogram.fsm.storage.redis import RedisStorage
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Настройка логирования (JSON lines через QueueListener, см. app/logging_setup.py)
+from app.logging_setup import setup_logging
+setup_logging("bot")
 logger = logging.getLogger(__name__)
 
-from app.config import BOT_TOKEN, PUBLIC_BASE_URL, WEBHOOK_SECRET_TOKEN, REDIS_URL
+from app.config import BOT_TOKEN, PUBLIC_BASE_URL, WEBHOOK_SECRET_TOKEN, REDIS_URL, validate_config
+from app.config import (
+    WEBHOOK_MAX_TASKS, WEBHOOK_MAX_PENDING, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_DRAIN_SECONDS,
+    WEBHOOK_PROCESSES, WEBHOOK_REUSE_PORT, KIE_CALLBACK_TOKEN,
+    BOT_METRICS_PORT, DEFAULT_BOT_METRICS_PORT,
+)
 from app.handlers import start, menu_and_flow, fallback, tools
 from app.db_adapter import init_db_pool, close_db_pool
-from app import webhooks
+from app import webhooks, kie_callback
+from app.metrics import metrics_handler, setup_handler_metrics
+from app.webhook_intake import WebhookIntake
+from app.services.media_registry import start_sync_assets
 
 
 WEBHOOK_PATH = "/telegram/webhook"
 WEBHOOK_URL = f"{PUBLIC_BASE_URL.rstrip('/')}{WEBHOOK_PATH}"
 
 
+def process_index() -> int:
+    """Номер процесса бота (0 при одном процессе), задаёт супервизор run_webhook_processes"""
+    return int(os.getenv("WEBHOOK_PROCESS_INDEX", "0"))
+
+
 def create_bot() -> Bot:
     """
     Создать Bot инстанс (без прокси - прокси нужны только для OpenAI в worker'ах).
@@ -46,17 +56,25 @@ async def on_startup(bot: Bot):
     """
     try:
         # Инициализируем пул подключений к БД
-        await init_db_pool()
+        await init_db_pool("bot")
         logger.info("✅ Database pool initialized")
     except Exception as e:
         logger.error(f"❌ Failed to initialize database pool: {e}", exc_info=True)
         raise
+
+    # file_id для assets/ — в фоне, чтобы не задерживать приём апдейтов
+    start_sync_assets(bot)
     
+    # При нескольких процессах webhook ставит только первый
+    if process_index() != 0:
+        return
+
     try:
         await bot.set_webhook(
             WEBHOOK_URL,
             drop_pending_updates=True,
             secret_token=WEBHOOK_SECRET_TOKEN,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
         )
         logger.info(f"✅ Webhook set successfully: {WEBHOOK_URL}")
     except Exception as e:
@@ -71,11 +89,13 @@ async def on_shutdown(bot: Bot):
     - Закрываем пул БД
     - Закрываем сессию
     """
-    try:
-        await bot.delete_webhook()
-        logger.info("✅ Webhook deleted")
-    except Exception as e:
-        logger.error(f"⚠️ Error deleting webhook: {e}")
+    # При нескольких процессах webhook не снимаем: остальные продолжают принимать апдейты
+    if WEBHOOK_PROCESSES <= 1:
+        try:
+            await bot.delete_webhook()
+            logger.info("✅ Webhook deleted")
+        except Exception as e:
+            logger.error(f"⚠️ Error deleting webhook: {e}")
     
     try:
         await close_db_pool()
@@ -97,11 +117,10 @@ async def handle_healthz(request):
 async def handle_queue_stats(request):
     """Endpoint для мониторинга очереди заданий"""
     try:
-        from app.db_adapter import get_pool, DATABASE_TYPE
+        from app.db_adapter import read_connection, DATABASE_TYPE
         
         if DATABASE_TYPE == "postgres":
-            pool = await get_pool()
-            async with pool.acquire() as conn:
+            async with read_connection() as conn:
                 # Считаем задания по статусам
                 queued = await conn.fetchval("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")
                 processing = await conn.fetchval("SELECT COUNT(*) FROM jobs WHERE status = 'processing'")
@@ -112,20 +131,42 @@ async def handle_queue_stats(request):
                     FROM jobs WHERE status = 'queued'
                 """)
                 
-                # Количество активных воркеров (processing задачи + буфер)
-                # Каждый воркер берет задачу на ~5-10 минут
-                
-                return web.json_response({
-                    "status": "ok",
-                    "queue": {
-                        "queued": queued or 0,
-                        "processing": processing or 0,
-                        "total": (queued or 0) + (processing or 0)
-                    },
-                    "avg_wait_minutes": round(avg_wait or 0, 1),
-                    "workers_configured": int(os.getenv("WORKER_INSTANCES", "1")),
-                    "timestamp": asyncio.get_event_loop().time()
-                })
+            # ETA нового job'а и квантили этапов (database/job_eta.sql)
+            from app.services.eta import get_new_jobs_eta, get_quantiles, worker_capacity
+            from app.services.redis_queue import read_autoscaler_state
+            eta = await get_new_jobs_eta()
+            quantiles = await get_quantiles()
+            autoscaler = await asyncio.to_thread(read_autoscaler_state)
+            
+            return web.json_response({
+                "status": "ok",
+                "queue": {
+                    "queued": queued or 0,
+                    "processing": processing or 0,
+                    "total": (queued or 0) + (processing or 0)
+                },
+                "avg_wait_minutes": round(avg_wait or 0, 1),
+                "workers_configured": int(os.getenv("WORKER_INSTANCES", "1")),
+                "worker_capacity": await worker_capacity(),
+                # Фактическое число воркеров от worker/autoscaler.py (None, если он не запущен)
+                "autoscaler": autoscaler,
+                "eta_new_job_seconds": {
+                    "low": round(eta[0]) if eta else None,
+                    "high": round(eta[1]) if eta else None,
+                },
+                "stage_quantiles": [
+                    {
+                        "template_id": q["template_id"],
+                        "model": q["model"],
+                        "stage": q["stage"],
+                        "p50": round(q["p50"], 1),
+                        "p90": round(q["p90"], 1),
+                        "samples": q["samples"],
+                    }
+                    for q in quantiles
+                ],
+                "timestamp": asyncio.get_event_loop().time()
+            })
         else:
             # Supabase fallback
             from app.db_adapter import supabase
@@ -157,11 +198,8 @@ async def handle_queue_stats(request):
 
 async def main():
     try:
-        # Проверка обязательных переменных окружения
-        if not BOT_TOKEN:
-            raise ValueError("BOT_TOKEN is not set")
-        if not PUBLIC_BASE_URL:
-            raise ValueError("PUBLIC_BASE_URL is not set")
+        # Проверка обязательных переменных окружения — все проблемы разом
+        validate_config("bot", webhook=True)
         
         logger.info("Starting bot initialization...")
         
@@ -180,6 +218,7 @@ async def main():
         dp.include_router(menu_and_flow.router)
         dp.include_router(tools.router)
         dp.include_router(fallback.router)  # ВСЕГДА ПОСЛЕДНИМ
+        setup_handler_metrics(dp)
 
         # 🌐 Web app
         app = web.Application()
@@ -244,31 +283,127 @@ async def main():
         app.router.add_post("/api/webhook/yookassa", yookassa_webhook_handler)
         logger.info("✅ Registered Yookassa webhook at /api/webhook/yookassa")
 
-        # Webhook endpoint
-        SimpleRequestHandler(
+        # KIE сообщает о готовности задачи — воркер просыпается без частого poll
+        if KIE_CALLBACK_TOKEN:
+            kie_callback.register(app)
+            logger.info(f"✅ Registered KIE callback at {kie_callback.KIE_CALLBACK_PATH}")
+
+        # Webhook endpoint: сразу 200, хендлеры в ограниченном фоновом пуле
+        intake = WebhookIntake(
             dispatcher=dp,
             bot=bot,
-        ).register(app, path=WEBHOOK_PATH)
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            max_tasks=WEBHOOK_MAX_TASKS,
+            max_pending=WEBHOOK_MAX_PENDING,
+        )
+        intake.register(app, path=WEBHOOK_PATH)
 
         # aiogram v3 — передаем всё, что нужно в хэндлеры, через kwargs
         setup_application(app, dp, bot=bot)
 
         # 🚀 Запуск сервера
+        # Несколько процессов: общий PORT через SO_REUSEPORT или PORT+i за nginx upstream
         port = int(os.getenv("PORT", "10000"))
+        reuse_port = WEBHOOK_PROCESSES > 1 and WEBHOOK_REUSE_PORT
+        if WEBHOOK_PROCESSES > 1 and not WEBHOOK_REUSE_PORT:
+            port += process_index()
+
+        # /metrics — счётчики этого процесса. На общем порту (SO_REUSEPORT) scrape
+        # попадал бы в случайный процесс, поэтому там отдельный порт на процесс.
+        # Глубину очереди считает только процесс 0
+        handle_metrics = metrics_handler(queue_depth=process_index() == 0)
+        metrics_base = BOT_METRICS_PORT or (DEFAULT_BOT_METRICS_PORT if reuse_port else 0)
+        metrics_runner = None
+        if metrics_base:
+            metrics_app = web.Application()
+            metrics_app.router.add_get("/metrics", handle_metrics)
+            metrics_runner = web.AppRunner(metrics_app)
+            await metrics_runner.setup()
+            metrics_port = metrics_base + process_index()
+            await web.TCPSite(metrics_runner, host="0.0.0.0", port=metrics_port).start()
+            logger.info(f"📈 Metrics of bot #{process_index()} on port {metrics_port}")
+        else:
+            app.router.add_get("/metrics", handle_metrics)
+
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, host="0.0.0.0", port=port)
+        site = web.TCPSite(runner, host="0.0.0.0", port=port, reuse_port=reuse_port or None)
         await site.start()
 
-        logger.info(f"🚀 Webhook bot started on port {port}")
+        logger.info(f"🚀 Webhook bot #{process_index()} started on port {port}")
         logger.info(f"📍 Webhook URL: {WEBHOOK_URL}")
 
-        # держим процесс живым
-        await asyncio.Event().wait()
+        # держим процесс живым до SIGTERM/SIGINT
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+
+        # Graceful: перестаём слушать порт, дожидаемся принятых апдейтов, потом on_shutdown
+        logger.info("🛑 Shutting down webhook bot...")
+        await site.stop()
+        await intake.drain(WEBHOOK_DRAIN_SECONDS)
+        await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
     except Exception as e:
         logger.critical(f"💥 Critical error in main: {e}", exc_info=True)
         raise
 
 
-if __name__ == "__main__":
+def _serve_process(index: int):
+    os.environ["WEBHOOK_PROCESS_INDEX"] = str(index)
     asyncio.run(main())
+
+
+def run_webhook_processes():
+    """
+    Супервизор WEBHOOK_PROCESSES процессов бота (общий Redis FSM и пул БД у каждого свой).
+    Упавший процесс перезапускается, SIGTERM/SIGINT пересылается всем и ждёт их drain.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def spawn(index: int):
+        proc = ctx.Process(target=_serve_process, args=(index,), name=f"neurocards-bot-{index}")
+        proc.start()
+        logger.info(f"🚀 Started bot process #{index} (pid {proc.pid})")
+        return proc
+
+    procs = {i: spawn(i) for i in range(WEBHOOK_PROCESSES)}
+
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in procs.values():
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    while True:
+        alive = False
+        for index, proc in list(procs.items()):
+            if proc.is_alive():
+                alive = True
+            elif not stopping:
+                logger.error(f"💥 Bot process #{index} exited with code {proc.exitcode}, restarting in 5s")
+                time.sleep(5)
+                if not stopping:
+                    procs[index] = spawn(index)
+                    alive = True
+        if stopping and not alive:
+            break
+        time.sleep(1)
+    logger.info("✅ All bot processes stopped")
+
+
+if __name__ == "__main__":
+    if WEBHOOK_PROCESSES > 1 and "WEBHOOK_PROCESS_INDEX" not in os.environ:
+        # Супервизор не перезапускает процессы в цикле из-за неполного .env
+        validate_config("bot", webhook=True)
+        run_webhook_processes()
+    else:
+        asyncio.run(main())
@@ -4,7 +4,6 @@ Telegram bot в режиме polling (без webhook).
 """
 import asyncio
 import logging
-import sys
 import os
 
 from aiogram import Bot, Dispatcher
@@ -13,19 +12,18 @@ from aiohttp_socks import ProxyConnector
 from aiogram.fsm.storage.redis import RedisStorage
 from aiohttp import web
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Настройка логирования (JSON lines через QueueListener, см. app/logging_setup.py)
+from app.logging_setup import setup_logging
+setup_logging("bot")
 logger = logging.getLogger(__name__)
 
-from app.config import BOT_TOKEN, REDIS_URL
+from app.config import BOT_TOKEN, REDIS_URL, KIE_CALLBACK_TOKEN, validate_config
 from app.config import load_proxies_from_file, PROXY_FILE, PROXY_COOLDOWN
 from app.proxy_rotator import init_proxy_rotator, get_proxy_rotator
 from app.handlers import start, menu_and_flow, fallback, tools
 from app.db_adapter import init_db_pool, close_db_pool
+from app.metrics import handle_metrics, setup_handler_metrics
+from app.services.media_registry import start_sync_assets
 
 
 async def start_health_server(port: int):
@@ -65,8 +63,12 @@ async def start_health_server(port: int):
         app = web.Application()
         app.router.add_get("/", handle_healthz)
         app.router.add_get("/healthz", handle_healthz)
+        app.router.add_get("/metrics", handle_metrics)
         # Support nested paths under bucket (e.g., inputs/5235703016/uuid.jpg)
         app.router.add_get("/storage/{bucket}/{tail:.*}", handle_storage)
+        if KIE_CALLBACK_TOKEN:
+            from app import kie_callback
+            kie_callback.register(app)
 
         runner = web.AppRunner(app)
         await runner.setup()
@@ -119,10 +121,11 @@ async def main():
     Основная функция - запуск бота в polling режиме
     """
     logger.info("🚀 Starting bot in POLLING mode (WITHOUT PROXY)...")
+    validate_config("bot")
     
     # Инициализация пула БД
     try:
-        await init_db_pool()
+        await init_db_pool("bot")
         logger.info("✅ Database pool initialized")
     except Exception as e:
         logger.error(f"❌ Failed to initialize database pool: {e}", exc_info=True)
@@ -143,6 +146,9 @@ async def main():
     )
     logger.info("✅ Bot initialized WITHOUT proxy (request_timeout=180s)")
 
+    # file_id для assets/ — в фоне, пока бот уже отвечает
+    start_sync_assets(bot)
+
     # Запускаем легковесный HTTP health сервер, чтобы healthcheck в Docker работал
     port = int(os.getenv("PORT", "8080"))
     asyncio.create_task(start_health_server(port))
@@ -155,6 +161,7 @@ async def main():
     dp.include_router(menu_and_flow.router)
     dp.include_router(tools.router)
     dp.include_router(fallback.router)
+    setup_handler_metrics(dp)
 
     try:
         # Удаляем webhook если был установлен
@@ -0,0 +1,314 @@
+"""
+Prometheus метрики бота и воркеров
+
+Бот отдаёт /metrics со своего aiohttp сервера (app/main.py, app/main_polling.py),
+воркеры поднимают маленький HTTP сервер через start_metrics_server(). Метрики
+у каждого процесса свои: несколько процессов бота (WEBHOOK_PROCESSES) отдают их
+каждый на своём порту BOT_METRICS_PORT + номер процесса, как воркеры.
+
+Что есть:
+- длительности этапов job'а (queue_wait, gpt, kie, download, transcode, upload)
+- исходы job'ов, job'ы в обработке у процесса
+- глубина очереди по статусам (одним GROUP BY, только у бота)
+- здоровье KIE ключей и прокси, использование пула БД и ожидание подключения
+- чтения с read-реплики и её отставание
+- объём и скорость скачивания/загрузки видео
+- латентность хендлеров бота, заполнение фонового пула webhook
+- callback'и KIE (принятые, дубли, отклонённые)
+- классификация ошибок KIE: тип и чем решён (код или текст)
+"""
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+
+logger = logging.getLogger(__name__)
+
+# Генерация Sora идёт минутами — бакеты до 30 минут
+STAGE_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 180, 300, 450, 600, 900, 1200, 1800)
+HANDLER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+THROUGHPUT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+JOB_STAGE_SECONDS = Histogram(
+    "neurocards_job_stage_seconds",
+    "Длительность этапа обработки job'а",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+JOBS_TOTAL = Counter(
+    "neurocards_jobs_total",
+    "Завершённые попытки обработки job'ов по исходу",
+    ["outcome"],
+)
+JOBS_IN_FLIGHT = Gauge(
+    "neurocards_jobs_in_flight",
+    "Job'ы, которые сейчас обрабатывает этот процесс",
+)
+QUEUE_JOBS = Gauge(
+    "neurocards_queue_jobs",
+    "Job'ы в очереди по статусу",
+    ["status"],
+)
+KIE_KEYS = Gauge(
+    "neurocards_kie_keys",
+    "KIE API ключи по состоянию",
+    ["state"],
+)
+PROXIES = Gauge(
+    "neurocards_proxies",
+    "Прокси по состоянию",
+    ["state"],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "neurocards_db_pool_connections",
+    "Подключения пула PostgreSQL",
+    ["state"],
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "neurocards_db_pool_wait_seconds",
+    "Ожидание свободного подключения пула PostgreSQL",
+    buckets=POOL_WAIT_BUCKETS,
+)
+DB_READS = Counter(
+    "neurocards_db_reads_total",
+    "Read-only запросы с репликой по месту выполнения",
+    ["target"],
+)
+DB_REPLICA_LAG_SECONDS = Gauge(
+    "neurocards_db_replica_lag_seconds",
+    "Отставание read-реплики PostgreSQL при последней проверке",
+)
+VIDEO_BYTES = Counter(
+    "neurocards_video_bytes_total",
+    "Объём скачанных/загруженных видео",
+    ["direction"],
+)
+VIDEO_THROUGHPUT = Histogram(
+    "neurocards_video_throughput_mbps",
+    "Скорость скачивания/загрузки видео, МБ/с",
+    ["direction"],
+    buckets=THROUGHPUT_BUCKETS,
+)
+WEBHOOK_UPDATES = Gauge(
+    "neurocards_webhook_updates",
+    "Webhook апдейты в фоновом пуле процесса",
+    ["state"],
+)
+WEBHOOK_BACKPRESSURE = Counter(
+    "neurocards_webhook_backpressure_total",
+    "Ответы Telegram, отложенные из-за заполненного пула",
+)
+KIE_CALLBACKS = Counter(
+    "neurocards_kie_callbacks_total",
+    "Callback'и KIE по результату обработки",
+    ["result"],
+)
+KIE_ERRORS = Counter(
+    "neurocards_kie_errors_total",
+    "Классифицированные ошибки KIE по типу и источнику решения",
+    ["type", "source"],
+)
+HANDLER_SECONDS = Histogram(
+    "neurocards_handler_seconds",
+    "Латентность хендлеров бота",
+    ["handler"],
+    buckets=HANDLER_BUCKETS,
+)
+
+
+# ---------------- ЗАПИСЬ ----------------
+
+def observe_stage(stage: str, seconds: float) -> None:
+    JOB_STAGE_SECONDS.labels(stage=stage).observe(max(seconds, 0.0))
+
+
+def observe_transfer(direction: str, size_bytes: int, seconds: float) -> None:
+    """direction: download | upload"""
+    VIDEO_BYTES.labels(direction=direction).inc(size_bytes)
+    if seconds > 0:
+        VIDEO_THROUGHPUT.labels(direction=direction).observe(size_bytes / 1024 / 1024 / seconds)
+
+
+def observe_db_pool_wait(seconds: float) -> None:
+    DB_POOL_WAIT_SECONDS.observe(max(seconds, 0.0))
+
+
+def db_read(target: str) -> None:
+    """target: replica | primary_stale | primary_down"""
+    DB_READS.labels(target=target).inc()
+
+
+def observe_replica_lag(seconds: float) -> None:
+    DB_REPLICA_LAG_SECONDS.set(seconds)
+
+
+def kie_error_classified(error_type: str, source: str) -> None:
+    """source: fail_code | code | http | message_code | pattern | ambiguous_code | none"""
+    KIE_ERRORS.labels(type=error_type, source=source).inc()
+
+
+def job_finished(outcome: str) -> None:
+    """outcome: completed | failed | requeued | handoff"""
+    JOBS_TOTAL.labels(outcome=outcome).inc()
+
+
+# ---------------- СНИМКИ ПЕРЕД SCRAPE ----------------
+
+def _collect_kie_keys() -> None:
+    try:
+        from worker import kie_key_rotator
+        # Ротатор есть только в процессах воркера — у бота не создаём
+        rotator = kie_key_rotator._rotator
+        if rotator is None:
+            return
+        stats = rotator.get_stats()
+        KIE_KEYS.labels(state="healthy").set(stats["healthy_keys"])
+        KIE_KEYS.labels(state="blocked").set(stats["blocked_keys"])
+    except Exception as e:
+        logger.debug(f"KIE key stats unavailable: {e}")
+
+
+def _collect_proxies() -> None:
+    try:
+        from app.proxy_rotator import get_proxy_rotator
+        rotator = get_proxy_rotator()
+        if rotator is None:
+            return
+        status = rotator.get_status()
+        PROXIES.labels(state="available").set(status["available"])
+        PROXIES.labels(state="blocked").set(status["blocked"])
+    except Exception as e:
+        logger.debug(f"Proxy stats unavailable: {e}")
+
+
+def _collect_db_pool() -> None:
+    try:
+        from app import db_adapter
+        pool = getattr(db_adapter, "_pool", None)
+        if pool is None:
+            return
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        DB_POOL_CONNECTIONS.labels(state="max").set(pool.get_max_size())
+        DB_POOL_CONNECTIONS.labels(state="open").set(size)
+        DB_POOL_CONNECTIONS.labels(state="idle").set(idle)
+        DB_POOL_CONNECTIONS.labels(state="in_use").set(size - idle)
+        # Корутины, ждущие подключение: > 0 — пул насыщен
+        DB_POOL_CONNECTIONS.labels(state="waiting").set(getattr(pool, "waiting", 0))
+    except Exception as e:
+        logger.debug(f"DB pool stats unavailable: {e}")
+
+
+def collect_process_stats() -> None:
+    """Синхронные снимки: KIE ключи, прокси, пул БД текущего процесса"""
+    _collect_kie_keys()
+    _collect_proxies()
+    _collect_db_pool()
+
+
+async def collect_queue_depth() -> None:
+    """Глубина очереди одним запросом (только у бота, чтобы N воркеров не дублировали)"""
+    try:
+        from app.db_adapter import get_pool
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT status, COUNT(*) AS n FROM jobs
+                WHERE status IN ('queued', 'processing')
+                GROUP BY status
+                """
+            )
+        counts = {row["status"]: row["n"] for row in rows}
+        for status in ("queued", "processing"):
+            QUEUE_JOBS.labels(status=status).set(counts.get(status, 0))
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to collect queue depth: {e}")
+
+
+# ---------------- HTTP ----------------
+
+def metrics_handler(queue_depth: bool = True):
+    """
+    aiohttp хендлер /metrics для бота. queue_depth=False — без запроса глубины
+    очереди (при нескольких процессах бота её считает только процесс 0)
+    """
+    from aiohttp import web
+
+    async def handle(request):
+        if queue_depth:
+            await collect_queue_depth()
+        collect_process_stats()
+        resp = web.Response(body=generate_latest())
+        resp.content_type = CONTENT_TYPE_LATEST.split(";")[0]
+        resp.charset = "utf-8"
+        return resp
+
+    return handle
+
+
+async def handle_metrics(request):
+    """aiohttp хендлер /metrics для бота с одним процессом"""
+    return await metrics_handler()(request)
+
+
+class _RefreshingRegistry:
+    """Реестр для сервера воркера: перед каждым scrape обновляет снимки процесса"""
+
+    def collect(self):
+        collect_process_stats()
+        return REGISTRY.collect()
+
+    def restricted_registry(self, names):
+        collect_process_stats()
+        return REGISTRY.restricted_registry(names)
+
+
+def start_metrics_server() -> None:
+    """
+    HTTP сервер /metrics для воркера (в отдельном потоке).
+    Порт: WORKER_METRICS_PORT (+ WORKER_INSTANCE для нескольких воркеров на хосте), 0 = выключено.
+    """
+    base_port = int(os.getenv("WORKER_METRICS_PORT", "0") or 0)
+    if not base_port:
+        return
+    port = base_port + int(os.getenv("WORKER_INSTANCE", "0") or 0)
+    try:
+        start_http_server(port, registry=_RefreshingRegistry())
+        logger.info(f"📈 Metrics server started on port {port}")
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to start metrics server on port {port}: {e}")
+
+
+# ---------------- AIOGRAM ----------------
+
+async def _handler_latency_middleware(
+    handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+    event: Any,
+    data: Dict[str, Any],
+) -> Any:
+    handler_obj = data.get("handler")
+    name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        HANDLER_SECONDS.labels(handler=name).observe(time.perf_counter() - started)
+
+
+def setup_handler_metrics(dp) -> None:
+    """Вешает замер латентности на message/callback_query всех роутеров (после include_router)"""
+    for router in dp.chain_tail:
+        router.message.middleware(_handler_latency_middleware)
+        router.callback_query.middleware(_handler_latency_middleware)
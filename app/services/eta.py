@@ -0,0 +1,169 @@
+"""
+Оценка времени ожидания генерации (ETA)
+
+Длительности этапов пишет воркер (jobs.stage_durations), квантили по шаблону
+и модели считает БД (stage_duration_quantiles в database/job_eta.sql).
+ETA = ожидание свободного воркера + время обработки; нижняя граница по p50,
+верхняя по p90.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.db_adapter import get_queue_snapshot, get_stage_duration_quantiles
+
+logger = logging.getLogger(__name__)
+
+# Сколько job'ов обрабатывается параллельно, если автоскейлер не запущен
+# (по умолчанию = числу воркеров); с автоскейлером — его текущее running
+WORKER_CAPACITY = int(os.getenv("WORKER_CAPACITY") or os.getenv("WORKER_INSTANCES") or "1")
+CAPACITY_TTL_SECONDS = 15
+
+# Время обработки одного job'а (p50, p90), пока истории недостаточно
+DEFAULT_SERVICE_SECONDS: Tuple[float, float] = (300.0, 900.0)
+
+# Минимум завершённых job'ов, чтобы доверять квантилям шаблона/модели
+MIN_SAMPLES = 5
+
+QUANTILES_TTL_SECONDS = 300
+
+# Старый текст на случай, если БД недоступна
+DEFAULT_ETA_TEXT = "от <b>1 до 30 минут</b>"
+
+_quantiles_cache: Dict[str, Any] = {"ts": 0.0, "rows": []}
+_capacity_cache: Dict[str, Any] = {"ts": float("-inf"), "value": WORKER_CAPACITY}
+
+
+def _autoscaler_running() -> Optional[int]:
+    from app.services.redis_queue import read_autoscaler_state
+
+    state = read_autoscaler_state()
+    running = state.get("running") if isinstance(state, dict) else None
+    return int(running) if isinstance(running, (int, float)) else None
+
+
+async def worker_capacity() -> int:
+    """
+    Воркеры сейчас: running из состояния автоскейлера (кеш CAPACITY_TTL_SECONDS),
+    без автоскейлера — WORKER_CAPACITY
+    """
+    now = time.monotonic()
+    if now - _capacity_cache["ts"] > CAPACITY_TTL_SECONDS:
+        try:
+            running = await asyncio.to_thread(_autoscaler_running)
+        except Exception as e:
+            logger.debug(f"Autoscaler capacity unavailable: {e}")
+            running = None
+        _capacity_cache["value"] = max(running, 1) if running is not None else WORKER_CAPACITY
+        _capacity_cache["ts"] = now
+    return _capacity_cache["value"]
+
+
+async def get_quantiles(force: bool = False) -> list[Dict[str, Any]]:
+    """Квантили длительностей из БД, кешируются на QUANTILES_TTL_SECONDS"""
+    now = time.monotonic()
+    if force or not _quantiles_cache["rows"] or now - _quantiles_cache["ts"] > QUANTILES_TTL_SECONDS:
+        _quantiles_cache["rows"] = await get_stage_duration_quantiles()
+        _quantiles_cache["ts"] = now
+    return _quantiles_cache["rows"]
+
+
+def service_seconds(
+    quantiles: list[Dict[str, Any]],
+    template_id: Optional[str] = None,
+    model: Optional[str] = None,
+) -> Tuple[float, float]:
+    """
+    (p50, p90) полного времени обработки job'а.
+    Порядок: шаблон + модель → шаблон → все job'ы → DEFAULT_SERVICE_SECONDS.
+    """
+    totals = [
+        q for q in quantiles
+        if q.get("stage") == "total" and int(q.get("samples") or 0) >= MIN_SAMPLES
+    ]
+
+    candidates = [
+        [q for q in totals if q.get("template_id") == template_id and (q.get("model") or "") == (model or "")],
+        [q for q in totals if q.get("template_id") == template_id],
+        totals,
+    ]
+    for rows in candidates:
+        if rows:
+            # Берём группу с самой большой выборкой
+            best = max(rows, key=lambda q: int(q.get("samples") or 0))
+            return float(best["p50"]), float(best["p90"])
+    return DEFAULT_SERVICE_SECONDS
+
+
+def estimate_wait_seconds(ahead: int, in_flight: int, capacity: int, service: float) -> float:
+    """
+    Ожидание свободного воркера.
+    Перед нами должны стартовать ahead job'ов, in_flight уже занимают воркеры;
+    в среднем один слот освобождается раз в service / capacity секунд.
+    """
+    capacity = max(int(capacity), 1)
+    backlog = int(ahead) + int(in_flight) - capacity + 1
+    if backlog <= 0:
+        return 0.0
+    return backlog * service / capacity
+
+
+def estimate_eta(
+    ahead: int,
+    in_flight: int,
+    capacity: int,
+    service: Tuple[float, float],
+    elapsed: float = 0.0,
+) -> Tuple[float, float]:
+    """(нижняя, верхняя) оценка в секундах. elapsed — сколько job уже обрабатывается"""
+    p50, p90 = service
+    low = estimate_wait_seconds(ahead, in_flight, capacity, p50) + max(p50 - elapsed, 0.0)
+    high = estimate_wait_seconds(ahead, in_flight, capacity, p90) + max(p90 - elapsed, 0.0)
+    # Пока job не готов, меньше минуты не обещаем
+    return max(low, 60.0), max(high, low, 60.0)
+
+
+def _minutes_word(n: int) -> str:
+    """Родительный падеж после «до N» / «около N»: 1, 21 минуты; 2, 5, 11 минут"""
+    return "минуты" if n % 10 == 1 and n % 100 != 11 else "минут"
+
+
+def format_eta(eta: Optional[Tuple[float, float]]) -> str:
+    """ETA для сообщения пользователю (HTML)"""
+    if not eta:
+        return DEFAULT_ETA_TEXT
+    low = max(1, math.floor(eta[0] / 60))
+    high = max(low, math.ceil(eta[1] / 60))
+    if low == high:
+        return f"около <b>{high} {_minutes_word(high)}</b>"
+    return f"от <b>{low} до {high} {_minutes_word(high)}</b>"
+
+
+async def get_job_eta(job_id: str) -> Optional[Tuple[float, float]]:
+    """ETA уже созданного job'а (в очереди или в обработке). None при ошибке"""
+    try:
+        snapshot = await get_queue_snapshot(job_id)
+        if "status" not in snapshot:
+            return None
+        service = service_seconds(await get_quantiles(), snapshot.get("template_id"), snapshot.get("model"))
+        if snapshot["status"] == "processing":
+            return estimate_eta(0, 0, 1, service, elapsed=snapshot.get("elapsed") or 0.0)
+        return estimate_eta(snapshot["ahead"], snapshot["in_flight"], await worker_capacity(), service)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to estimate ETA for job {job_id}: {e}")
+        return None
+
+
+async def get_new_jobs_eta(count: int = 1, template_id: Optional[str] = None) -> Optional[Tuple[float, float]]:
+    """ETA для count новых job'ов: до готовности последнего из них. None при ошибке"""
+    try:
+        snapshot = await get_queue_snapshot()
+        service = service_seconds(await get_quantiles(), template_id)
+        ahead = snapshot["queued"] + max(int(count), 1) - 1
+        return estimate_eta(ahead, snapshot["in_flight"], await worker_capacity(), service)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to estimate ETA for new jobs: {e}")
+        return None
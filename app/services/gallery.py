@@ -0,0 +1,90 @@
+"""
+Галерея "Мои видео" в личном кабинете
+
+Страницы готовых видео — list_last_jobs(completed_only=True), с реплики,
+кешируются на GALLERY_TTL_SECONDS. Повторная отправка идёт по сохранённому
+воркером video_file_id: без скачивания и загрузки. Только если file_id нет —
+по video_url (Telegram скачивает сам) или из локального outputs/{job_id}.mp4;
+полученный file_id сохраняется в job, следующая отправка уже мгновенная.
+"""
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from app.config import STORAGE_BASE_PATH
+from app.db_adapter import get_job_by_id, list_last_jobs, update_job
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 5
+GALLERY_TTL_SECONDS = 60
+# Кеш страниц на процесс: (tg_user_id, page) -> (ts, items, has_next)
+_MAX_CACHED_PAGES = 1000
+
+_pages_cache: Dict[Tuple[int, int], Tuple[float, List[Dict[str, Any]], bool]] = {}
+
+
+async def get_gallery_page(tg_user_id: int, page: int = 0) -> Tuple[List[Dict[str, Any]], bool]:
+    """(видео страницы, есть ли следующая)"""
+    page = max(page, 0)
+    key = (tg_user_id, page)
+    now = time.monotonic()
+    cached = _pages_cache.get(key)
+    if cached and now - cached[0] <= GALLERY_TTL_SECONDS:
+        return cached[1], cached[2]
+
+    # Лишняя строка говорит, есть ли следующая страница, без COUNT(*)
+    rows = await list_last_jobs(tg_user_id, PAGE_SIZE + 1, page * PAGE_SIZE, completed_only=True)
+    items, has_next = rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+
+    if len(_pages_cache) >= _MAX_CACHED_PAGES:
+        _pages_cache.clear()
+    _pages_cache[key] = (now, items, has_next)
+    return items, has_next
+
+
+def invalidate_gallery(tg_user_id: int) -> None:
+    for key in [key for key in _pages_cache if key[0] == tg_user_id]:
+        _pages_cache.pop(key, None)
+
+
+def local_video_path(job_id: str) -> str:
+    return os.path.join(STORAGE_BASE_PATH, "outputs", f"{job_id}.mp4")
+
+
+async def resend_video(bot: Bot, tg_user_id: int, job_id: str, **kwargs: Any) -> bool:
+    """
+    Отправляет готовое видео job'а пользователю повторно. False — job не его,
+    не готов или видео взять неоткуда. kwargs уходят в send_video (caption, reply_markup).
+    """
+    job: Optional[Dict[str, Any]] = await get_job_by_id(job_id)
+    if not job or int(job["tg_user_id"]) != tg_user_id or job.get("status") != "completed":
+        return False
+
+    file_id = job.get("video_file_id")
+    if file_id:
+        await bot.send_video(tg_user_id, video=file_id, request_timeout=30, **kwargs)
+        return True
+
+    sources = []
+    if job.get("video_url"):
+        sources.append(job["video_url"])
+    path = local_video_path(job_id)
+    if os.path.exists(path):
+        sources.append(FSInputFile(path))
+
+    for video in sources:
+        try:
+            msg = await bot.send_video(tg_user_id, video=video, request_timeout=180, **kwargs)
+        except Exception as e:
+            logger.warning(f"⚠️ Resend of job {job_id} failed from {type(video).__name__}: {e}")
+            continue
+        if msg.video:
+            await update_job(job_id, {"video_file_id": msg.video.file_id})
+            invalidate_gallery(tg_user_id)
+        return True
+    return False
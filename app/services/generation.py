@@ -7,7 +7,6 @@ from app.keyboards import kb_no_credits, kb_started
 from app.services.tg_files import download_photo_bytes
 from app.services.storage_factory import get_storage
 from app.db_adapter import get_job_by_idempotency_key, create_job_and_consume_credit, safe_get_balance, update_job
-from app.utils import ensure_json_string
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +20,7 @@ async def start_generation(
     product_info: dict,
     extra_wishes: str | None,
     template_id: str,
+    batch_id: str | None = None,
 ):
     """
     Атомарное создание job'а с проверкой идемпотентности.
@@ -34,6 +34,9 @@ async def start_generation(
     6. Вернуть job_id и новый баланс
     
     Если ошибка - отправить сообщение пользователю и вернуть (None, None)
+
+    batch_id — общий для job'ов одного заказа из нескольких видео: воркер
+    доставит их одной медиагруппой (worker/batch_delivery.py)
     """
     
     logger.info(f"📦 START generate: user={tg_user_id}, template={template_id}, kind={kind}")
@@ -59,12 +62,7 @@ async def start_generation(
     logger.info(f"✅ Uploaded to storage")
 
     # 4) создать job и списать кредит атомарно
-    # Конвертируем product_info в JSON string для PostgreSQL JSONB
-    prompt_input_str = ensure_json_string(product_info)
-    
-    # 🔍 DEBUG: Логируем что передаём
-    logger.info(f"🔍 DEBUG product_info dict: {product_info}")
-    logger.info(f"🔍 DEBUG prompt_input_str (JSON): {prompt_input_str[:500]}")
+    product_text = product_info.get("text", "")
     
     try:
         logger.info(f"📝 RPC call: create_job_and_consume_credit for user {tg_user_id}, template={template_id}")
@@ -73,7 +71,7 @@ async def start_generation(
             template_type=kind,
             idempotency_key=idempotency_key,
             photo_path=input_path,
-            prompt_input=prompt_input_str,
+            prompt_input=product_text,
         )
         logger.info(f"✅ RPC result: job_id={result['job_id']}, credits={result['new_credits']}")
         job_id = result["job_id"]
@@ -82,21 +80,18 @@ async def start_generation(
         # 5) Обновляем job с дополнительными полями для worker
         logger.info(f"📝 Updating job {job_id} with metadata...")
         
-        # Строим JSON для error_details с метаданными
-        import json
-        metadata = {
-            "template_id": template_id,
-            "kind": kind,
-            "user_prompt": product_info.get("user_prompt", "")
-        }
-        
+        # Параметры генерации — колонками (database/job_metadata.sql),
+        # product_info — JSONB: драйвер кодирует dict сам, воркер получает dict
         await update_job(str(job_id), {
             "product_image_url": input_path,
-            "product_name": product_info.get("text", "")[:200],  # используем product_name
-            # ВАЖНО: сохраняем полный JSON product_info, чтобы worker получил user_prompt
-            "product_text": prompt_input_str,
+            "product_name": product_text[:200],  # используем product_name
+            "product_text": product_text,
+            "product_info": product_info,
+            "template_id": template_id,
+            "kind": kind,
+            "user_prompt": product_info.get("user_prompt") or None,
             "extra_wishes": extra_wishes,
-            "error_details": json.dumps(metadata),  # преобразуем dict в JSON string
+            "batch_id": batch_id,
             "status": "queued"
         })
         
@@ -0,0 +1,143 @@
+"""
+Реестр file_id статичных файлов assets/
+
+При старте бота каждый файл assets/ один раз заливается в служебный канал
+(SERVICE_CHANNEL_ID), file_id сохраняется в media_files по sha256 содержимого
+(database/media_registry.sql). Дальше меню и приветственные видео отправляются
+по file_id: новый деплой или изменённый файл не требуют ручного сбора file_id,
+и с диска на каждого пользователя ничего не льётся.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, List, Optional, Set, Union
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from app.config import ASSETS_DIR, SERVICE_CHANNEL_ID
+from app.db_adapter import get_media_file_ids, media_registry_lock, save_media_file_id
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {".mp4", ".mov"}
+PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+# Приветственные видео: assets/welcome*.mp4 по имени (welcome_1.mp4, welcome_2.mp4, ...)
+WELCOME_PREFIX = "welcome"
+
+# Процессный кеш: абсолютный путь -> file_id
+_file_ids: Dict[str, str] = {}
+# Ссылки на фоновые sync_assets, чтобы задачу не собрал GC
+_sync_tasks: Set[asyncio.Task] = set()
+
+
+def media_kind(path: str) -> Optional[str]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in VIDEO_EXTENSIONS:
+        return "video"
+    if ext in PHOTO_EXTENSIONS:
+        return "photo"
+    return None
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_assets(assets_dir: Optional[str] = None) -> List[str]:
+    """Файлы assets/, которые умеем отправить (видео и картинки), по имени"""
+    assets_dir = assets_dir or ASSETS_DIR
+    if not os.path.isdir(assets_dir):
+        return []
+    return [
+        os.path.join(assets_dir, name)
+        for name in sorted(os.listdir(assets_dir))
+        if media_kind(name) and os.path.isfile(os.path.join(assets_dir, name))
+    ]
+
+
+async def _upload(bot: Bot, path: str, kind: str) -> str:
+    if kind == "video":
+        msg = await bot.send_video(SERVICE_CHANNEL_ID, video=FSInputFile(path), request_timeout=180)
+        return msg.video.file_id
+    msg = await bot.send_photo(SERVICE_CHANNEL_ID, photo=FSInputFile(path), request_timeout=60)
+    return msg.photo[-1].file_id
+
+
+async def sync_assets(bot: Bot, assets_dir: Optional[str] = None) -> int:
+    """
+    Заливает в служебный канал файлы assets/, которых ещё нет в реестре, и
+    заполняет процессный кеш. Возвращает число залитых файлов. Ошибки по
+    отдельным файлам не пробрасывает: такой файл уйдёт с диска, как раньше.
+    """
+    paths = list_assets(assets_dir)
+    if not paths:
+        return 0
+    hashes = {path: file_sha256(path) for path in paths}
+
+    uploaded = 0
+    async with media_registry_lock():
+        registry = await get_media_file_ids()
+        for path, sha256 in hashes.items():
+            file_id = registry.get(sha256)
+            if not file_id and SERVICE_CHANNEL_ID:
+                kind = media_kind(path)
+                try:
+                    file_id = await _upload(bot, path, kind)
+                    await save_media_file_id(sha256, os.path.basename(path), kind, file_id)
+                    uploaded += 1
+                    logger.info(f"📤 Asset {os.path.basename(path)} uploaded to registry")
+                except Exception as e:
+                    logger.warning(f"⚠️ Failed to upload asset {path}: {e}")
+                    continue
+            if file_id:
+                _file_ids[os.path.abspath(path)] = file_id
+
+    missing = len(paths) - len([p for p in paths if os.path.abspath(p) in _file_ids])
+    if missing and not SERVICE_CHANNEL_ID:
+        logger.warning(f"⚠️ SERVICE_CHANNEL_ID not set: {missing} assets will be sent from disk")
+    logger.info(f"✅ Media registry ready: {len(paths) - missing}/{len(paths)} assets by file_id")
+    return uploaded
+
+
+def _on_sync_done(task: asyncio.Task) -> None:
+    _sync_tasks.discard(task)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logger.error(
+            f"❌ Media registry sync failed, assets will be sent from disk: {task.exception()!r}",
+            exc_info=task.exception(),
+        )
+
+
+def start_sync_assets(bot: Bot) -> asyncio.Task:
+    """sync_assets в фоне: апдейты принимаются сразу, ошибка синка попадает в лог"""
+    task = asyncio.create_task(sync_assets(bot))
+    _sync_tasks.add(task)
+    task.add_done_callback(_on_sync_done)
+    return task
+
+
+def get_file_id(path: str) -> Optional[str]:
+    return _file_ids.get(os.path.abspath(path))
+
+
+def media_input(path: str) -> Union[str, FSInputFile]:
+    """file_id из реестра, а если его нет — файл с диска"""
+    return get_file_id(path) or FSInputFile(path)
+
+
+def welcome_video_ids(assets_dir: Optional[str] = None) -> List[str]:
+    """file_id приветственных видео assets/welcome*.mp4 (до 10 — лимит медиагруппы)"""
+    return [
+        file_id
+        for path in list_assets(assets_dir)
+        if os.path.basename(path).startswith(WELCOME_PREFIX) and media_kind(path) == "video"
+        and (file_id := get_file_id(path))
+    ][:10]
@@ -12,6 +12,9 @@ from rq.job import Job
 
 logger = logging.getLogger(__name__)
 
+# Состояние автоскейлера воркеров (worker/autoscaler.py пишет, /queue_stats читает)
+AUTOSCALER_STATE_KEY = "neurocards:autoscaler:state"
+
 
 def get_redis_connection() -> Redis:
     """Получить подключение к Redis с увеличенными таймаутами"""
@@ -27,6 +30,19 @@ def get_redis_connection() -> Redis:
     )
 
 
+def read_autoscaler_state() -> Optional[dict]:
+    """
+    Состояние автоскейлера (worker/autoscaler.py публикует его каждый тик с TTL).
+    None — автоскейлер не запущен или Redis недоступен. Блокирующий вызов.
+    """
+    try:
+        raw = get_redis_connection().get(AUTOSCALER_STATE_KEY)
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.debug(f"Autoscaler state unavailable: {e}")
+        return None
+
+
 def get_queue(name: str = "neurocards") -> Queue:
     """Получить очередь задач"""
     redis_conn = get_redis_connection()
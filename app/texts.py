@@ -108,6 +108,17 @@ CABINET = (
 )
 
 
+MY_VIDEOS = (
+    "🎬 <b>Мои видео</b>\n\n"
+    "Нажми на видео — пришлю его сюда ещё раз 👇🏻"
+)
+
+MY_VIDEOS_EMPTY = (
+    "🎬 <b>Мои видео</b>\n\n"
+    "Здесь появятся готовые видео. Пока их нет — самое время создать первое 🚀"
+)
+
+
 TOPUP_TEXT = (
     "💳 <b>Пополнение баланса</b>\n\n"
     "1 кредит = 1 видео 🎬\n\n"
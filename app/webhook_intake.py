@@ -0,0 +1,157 @@
+"""
+Приём webhook апдейтов Telegram с обработкой в фоне
+
+- Telegram получает 200 сразу после разбора апдейта — медленный хендлер
+  (скачивание фото, загрузка в storage) не задерживает доставку следующих апдейтов
+- Хендлеры выполняются в ограниченном пуле: не больше WEBHOOK_MAX_TASKS одновременно,
+  ещё до WEBHOOK_MAX_PENDING ждут слота
+- Если пул и очередь заполнены, ответ Telegram откладывается до освобождения места
+  (backpressure: Telegram не шлёт больше max_connections запросов одновременно)
+- Апдейты одного пользователя обрабатываются по порядку (FSM не перескакивает шаги)
+- При остановке drain() дожидается уже принятых апдейтов
+"""
+import asyncio
+import hmac
+import logging
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from app.metrics import WEBHOOK_BACKPRESSURE, WEBHOOK_UPDATES
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Поля апдейта, у которых есть from — по ним определяется пользователь
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "pre_checkout_query", "shipping_query", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """id отправителя апдейта (None для апдейтов без пользователя)"""
+    for field in _USER_FIELDS:
+        payload = update.get(field)
+        if isinstance(payload, dict):
+            sender = payload.get("from") or {}
+            return sender.get("id")
+    return None
+
+
+class WebhookIntake:
+    """Ограниченный пул фоновой обработки webhook апдейтов"""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: Optional[str] = None,
+        max_tasks: int = 64,
+        max_pending: int = 256,
+        **data: Any,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.data = data
+        self._admitted = asyncio.Semaphore(max_tasks + max_pending)
+        self._running = asyncio.Semaphore(max_tasks)
+        self._user_locks: Dict[int, list] = {}  # user_id -> [Lock, апдейтов в работе]
+        self._tasks: "set[asyncio.Task]" = set()
+        self._closing = False
+
+    # ---------------- HTTP ----------------
+
+    def register(self, app: web.Application, path: str) -> None:
+        app.router.add_post(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            return web.Response(status=401, text="Unauthorized")
+        if self._closing:
+            # Telegram повторит доставку — апдейт подхватит другой процесс или этот после рестарта
+            return web.Response(status=503, text="Shutting down")
+        try:
+            update = await request.json(loads=self.bot.session.json_loads)
+        except Exception as e:
+            logger.warning(f"⚠️ Bad webhook payload: {e}")
+            return web.Response(status=400, text="Bad request")
+
+        await self.submit(update)
+        return web.json_response({})
+
+    # ---------------- ПУЛ ----------------
+
+    async def submit(self, update: Dict[str, Any]) -> None:
+        """Ставит апдейт в фон; ждёт, если пул и очередь заполнены"""
+        if self._admitted.locked():
+            WEBHOOK_BACKPRESSURE.inc()
+            logger.warning("⏳ Webhook pool is full, delaying ack", extra={"sample": "webhook_backpressure"})
+        await self._admitted.acquire()
+        WEBHOOK_UPDATES.labels(state="pending").inc()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, update: Dict[str, Any]) -> None:
+        user_id = update_user_id(update)
+        lock = self._user_lock(user_id)
+        started = False
+        try:
+            async with lock, self._running:
+                started = True
+                WEBHOOK_UPDATES.labels(state="pending").dec()
+                WEBHOOK_UPDATES.labels(state="running").inc()
+                try:
+                    result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+                    if isinstance(result, TelegramMethod):
+                        await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+                except Exception as e:
+                    logger.error(f"❌ Update {update.get('update_id')} failed: {e}", exc_info=True)
+                finally:
+                    WEBHOOK_UPDATES.labels(state="running").dec()
+        finally:
+            if not started:
+                WEBHOOK_UPDATES.labels(state="pending").dec()
+            self._admitted.release()
+            self._release_user_lock(user_id, lock)
+
+    def _user_lock(self, user_id: Optional[int]) -> asyncio.Lock:
+        if user_id is None:
+            return asyncio.Lock()
+        entry = self._user_locks.get(user_id)
+        if entry is None:
+            entry = self._user_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_user_lock(self, user_id: Optional[int], lock: asyncio.Lock) -> None:
+        # Последний апдейт пользователя — убираем лок, чтобы словарь не рос
+        entry = self._user_locks.get(user_id) if user_id is not None else None
+        if entry is not None and entry[0] is lock:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._user_locks[user_id]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def drain(self, timeout: float) -> None:
+        """Перестаёт принимать апдейты и ждёт уже принятые (не дольше timeout)"""
+        self._closing = True
+        if not self._tasks:
+            return
+        logger.info(f"⏳ Draining {len(self._tasks)} webhook updates (timeout {timeout}s)")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"⚠️ {len(pending)} webhook updates still running after {timeout}s, cancelling")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,373 @@
+"""
+Локальные stub сервера внешних API для бенчмарков воркера
+
+- KIE: createTask / recordInfo с настраиваемой длительностью генерации и долей ошибок,
+  готовое видео отдаётся с /files/video.mp4 (размер задаётся); при kie_callbacks
+  по готовности задачи POST'ит на callBackUrl из createTask (с дублями и потерями)
+- OpenAI: /v1/chat/completions с настраиваемой задержкой
+- Telegram Bot API: /bot<token>/<method> — sendMessage / sendVideo / прочие методы,
+  тело запроса (видео) вычитывается целиком, как это сделал бы настоящий сервер
+- StubBotSession — сессия aiogram без сети для бенчмарка хендлеров бота
+
+Воркер направляется на stub'ы через KIE_API_BASE, OPENAI_BASE_URL и TELEGRAM_API_BASE.
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+from aiogram.client.session.base import BaseSession
+from aiohttp import web
+
+# Заглушка JPEG: KIE stub картинку не декодирует, но URL должен отдавать файл
+_STUB_JPEG = b"\xff\xd8\xff\xe0" + bytes(256) + b"\xff\xd9"
+
+
+@dataclass
+class StubConfig:
+    kie_latency: float = 5.0          # длительность "генерации", с
+    kie_jitter: float = 0.2           # ± доля от kie_latency
+    kie_create_latency: float = 0.1
+    kie_fail_rate: float = 0.0        # доля задач, завершающихся ошибкой
+    kie_fail_code: int = 500          # 5xx — воркер переставит job в очередь, 4xx — fail
+    kie_callbacks: bool = False       # слать callback на callBackUrl из createTask
+    kie_callback_repeat: int = 1      # доставок одного callback'а (>1 — проверка дедупликации)
+    kie_callback_loss: float = 0.0    # доля потерянных callback'ов (спасает страховочный poll)
+    openai_latency: float = 0.5
+    telegram_latency: float = 0.1
+    video_bytes: int = 5 * 1024 * 1024
+
+
+@dataclass
+class StubStats:
+    kie_created: int = 0
+    kie_polls: int = 0
+    kie_failed: int = 0
+    kie_callbacks_sent: int = 0
+    kie_callbacks_lost: int = 0
+    kie_callback_errors: int = 0
+    video_downloads: int = 0
+    openai_calls: int = 0
+    telegram_calls: Dict[str, int] = field(default_factory=dict)
+    telegram_upload_bytes: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "kie_created": self.kie_created,
+            "kie_polls": self.kie_polls,
+            "kie_failed": self.kie_failed,
+            "kie_callbacks_sent": self.kie_callbacks_sent,
+            "kie_callbacks_lost": self.kie_callbacks_lost,
+            "kie_callback_errors": self.kie_callback_errors,
+            "video_downloads": self.video_downloads,
+            "openai_calls": self.openai_calls,
+            "telegram_calls": dict(self.telegram_calls),
+            "telegram_upload_mb": round(self.telegram_upload_bytes / 1024 / 1024, 1),
+        }
+
+
+class StubServers:
+    """Все stub'ы на одном aiohttp сервере (127.0.0.1, свободный порт)"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.stats = StubStats()
+        self.base_url = ""
+        self._tasks: Dict[str, dict] = {}
+        self._video = b"\x00\x00\x00\x18ftypmp42" + bytes(max(config.video_bytes - 12, 0))
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+        self._client: Optional[aiohttp.ClientSession] = None
+        self._callbacks: Set[asyncio.Task] = set()
+
+    # ---------------- LIFECYCLE ----------------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/api/v1/jobs/createTask", self.kie_create_task)
+        app.router.add_get("/api/v1/jobs/recordInfo", self.kie_record_info)
+        app.router.add_get("/files/video.mp4", self.video_file)
+        app.router.add_get("/files/input.jpg", self.input_image)
+        app.router.add_post("/v1/chat/completions", self.openai_chat)
+        app.router.add_post("/bot{token}/{method}", self.telegram_method)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets  # порт, выбранный ОС при port=0
+        self.base_url = f"http://{host}:{sockets[0].getsockname()[1]}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        for task in list(self._callbacks):
+            task.cancel()
+        await asyncio.gather(*self._callbacks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def worker_env(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие воркер на stub'ы"""
+        return {
+            "KIE_API_BASE": self.base_url,
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "TELEGRAM_API_BASE": self.base_url,
+        }
+
+    @property
+    def input_image_url(self) -> str:
+        return f"{self.base_url}/files/input.jpg"
+
+    # ---------------- KIE ----------------
+
+    async def kie_create_task(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except Exception:
+            body = {}
+        await asyncio.sleep(self.config.kie_create_latency)
+        cfg = self.config
+        task_id = uuid.uuid4().hex
+        jitter = cfg.kie_latency * cfg.kie_jitter
+        task = self._tasks[task_id] = {
+            "ready_at": time.time() + max(cfg.kie_latency + random.uniform(-jitter, jitter), 0.0),
+            "fail": random.random() < cfg.kie_fail_rate,
+        }
+        self.stats.kie_created += 1
+
+        callback_url = body.get("callBackUrl") if isinstance(body, dict) else None
+        if cfg.kie_callbacks and callback_url:
+            callback = asyncio.create_task(self._fire_callback(task_id, task, callback_url))
+            self._callbacks.add(callback)
+            callback.add_done_callback(self._callbacks.discard)
+        return web.json_response({"code": 200, "msg": "success", "data": {"taskId": task_id}})
+
+    async def kie_record_info(self, request: web.Request) -> web.Response:
+        self.stats.kie_polls += 1
+        task_id = request.query.get("taskId", "")
+        task = self._tasks.get(task_id)
+        if task is None:
+            return web.json_response({"code": 404, "msg": "task not found", "data": None})
+        return web.json_response({"code": 200, "msg": "success", "data": self._task_data(task_id, task)})
+
+    async def _fire_callback(self, task_id: str, task: dict, url: str) -> None:
+        """Как KIE: POST на callBackUrl, когда задача завершилась"""
+        # +10 мс: таймер loop'а может сработать чуть раньше wall clock ready_at
+        await asyncio.sleep(max(task["ready_at"] - time.time(), 0.0) + 0.01)
+        if random.random() < self.config.kie_callback_loss:
+            self.stats.kie_callbacks_lost += 1
+            return
+        if self._client is None:
+            self._client = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        payload = {"code": 200, "msg": "success", "data": self._task_data(task_id, task)}
+        for _ in range(max(self.config.kie_callback_repeat, 1)):
+            try:
+                async with self._client.post(url, json=payload) as resp:
+                    await resp.read()
+                    if resp.status >= 400:
+                        self.stats.kie_callback_errors += 1
+                self.stats.kie_callbacks_sent += 1
+            except aiohttp.ClientError:
+                self.stats.kie_callback_errors += 1
+
+    def _task_data(self, task_id: str, task: dict) -> dict:
+        data = {"taskId": task_id, "model": "sora-2-image-to-video"}
+        if time.time() < task["ready_at"]:
+            data["state"] = "generating"
+        elif task["fail"]:
+            if not task.get("counted"):
+                task["counted"] = True
+                self.stats.kie_failed += 1
+            data.update({
+                "state": "fail",
+                "failCode": self.config.kie_fail_code,
+                "failMsg": "stub failure",
+            })
+        else:
+            data.update({
+                "state": "success",
+                "resultJson": json.dumps({"resultUrls": [f"{self.base_url}/files/video.mp4"]}),
+            })
+        return data
+
+    async def video_file(self, request: web.Request) -> web.Response:
+        self.stats.video_downloads += 1
+        return web.Response(body=self._video, content_type="video/mp4")
+
+    async def input_image(self, request: web.Request) -> web.Response:
+        return web.Response(body=_STUB_JPEG, content_type="image/jpeg")
+
+    # ---------------- OPENAI ----------------
+
+    async def openai_chat(self, request: web.Request) -> web.Response:
+        await request.read()
+        await asyncio.sleep(self.config.openai_latency)
+        self.stats.openai_calls += 1
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": "Close-up UGC shot: a person holds the product, turns it to the light "
+                               "and smiles at the camera. Vertical 9:16, natural lighting.",
+                },
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 40, "total_tokens": 140},
+        })
+
+    # ---------------- TELEGRAM ----------------
+
+    async def telegram_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await self._read_form(request)
+        await asyncio.sleep(self.config.telegram_latency)
+        self.stats.telegram_calls[method] = self.stats.telegram_calls.get(method, 0) + 1
+
+        if method in ("sendMessage", "sendVideo", "sendPhoto", "editMessageText"):
+            return web.json_response({"ok": True, "result": self._message(method, form)})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _read_form(self, request: web.Request) -> Dict[str, str]:
+        """Поля запроса aiogram (multipart или urlencoded); файлы только считаются"""
+        form: Dict[str, str] = {}
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    size = 0
+                    while chunk := await part.read_chunk(256 * 1024):
+                        size += len(chunk)
+                    self.stats.telegram_upload_bytes += size
+                    form[part.name] = f"<file {size} bytes>"
+                else:
+                    form[part.name] = await part.text()
+        else:
+            form.update({k: str(v) for k, v in (await request.post()).items()})
+        return form
+
+    def _message(self, method: str, form: Dict[str, str]) -> dict:
+        self._message_id += 1
+        chat_id = form.get("chat_id", "0")
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "private"},
+        }
+        if method == "sendVideo":
+            message["video"] = {
+                "file_id": f"bench-video-{self._message_id}",
+                "file_unique_id": f"bench-{self._message_id}",
+                "width": 720,
+                "height": 1280,
+                "duration": 15,
+            }
+            if form.get("caption"):
+                message["caption"] = form["caption"]
+        elif method == "sendPhoto":
+            message["photo"] = [{
+                "file_id": f"bench-photo-{self._message_id}",
+                "file_unique_id": f"bench-p{self._message_id}",
+                "width": 1,
+                "height": 1,
+            }]
+        else:
+            message["text"] = form.get("text", "")
+        return message
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """p50 / p90 / p99 / max списка значений (для отчётов бенчмарков)"""
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pct(q: float) -> float:
+        idx = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[idx]
+
+    return {"p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99), "max": ordered[-1]}
+
+
+# ---------------- AIOGRAM SESSION ----------------
+
+class StubBotSession(BaseSession):
+    """
+    Сессия aiogram без сети: отвечает на методы Bot API валидными объектами.
+    Используется бенчмарком хендлеров (Dispatcher.feed_update), latency — имитация RTT до Telegram.
+    """
+
+    def __init__(self, latency: float = 0.0, photo_bytes: int = 200 * 1024):
+        super().__init__()
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._photo = _STUB_JPEG[:4] + bytes(max(photo_bytes - 6, 0)) + _STUB_JPEG[-2:]
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = getattr(method, "chat_id", None)
+        if name == "GetFile":
+            result = {
+                "file_id": method.file_id,
+                "file_unique_id": f"u-{method.file_id[:16]}",
+                "file_size": len(self._photo),
+                "file_path": f"photos/{method.file_id[:16]}.jpg",
+            }
+        elif name == "SendMediaGroup":
+            result = [self._message(chat_id) for _ in method.media]
+        elif name.startswith("Send") or name.startswith("Edit"):
+            result = self._message(chat_id, video=name == "SendVideo")
+        else:
+            result = True
+
+        response = self.check_response(
+            bot=bot, method=method, status_code=200,
+            content=json.dumps({"ok": True, "result": result}),
+        )
+        return response.result
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for offset in range(0, len(self._photo), chunk_size):
+            yield self._photo[offset:offset + chunk_size]
+
+    async def close(self) -> None:
+        pass
+
+    def _message(self, chat_id, video: bool = False) -> dict:
+        self._message_id += 1
+        chat = int(chat_id) if isinstance(chat_id, int) or str(chat_id).lstrip("-").isdigit() else 0
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat, "type": "private"},
+            "text": "stub",
+        }
+        if video:
+            message["video"] = {
+                "file_id": f"bench-video-{self._message_id}",
+                "file_unique_id": f"bench-{self._message_id}",
+                "width": 720, "height": 1280, "duration": 15,
+            }
+        return message
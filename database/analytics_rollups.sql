@@ -0,0 +1,260 @@
+-- ===================================
+-- ROLLUP'Ы ДЛЯ АНАЛИТИКИ И METABASE
+-- ===================================
+-- Дашборды читают только rollup_* таблицы: сырые jobs / payments / credits_history
+-- остаются воркерам и боту. refresh_rollups() пересчитывает лишь затронутые
+-- с прошлого запуска часы/дни (по jobs.updated_at, finished_at, created_at),
+-- запускается по расписанию: scripts/refresh_rollups.py (systemd/neurocards-rollups.timer).
+-- Все бакеты в UTC.
+
+CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON public.jobs(updated_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON public.jobs(finished_at);
+
+-- Job'ы по часу создания, статусу, шаблону, модели и классу ошибки
+CREATE TABLE IF NOT EXISTS public.rollup_jobs_hourly (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    template_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    status TEXT NOT NULL,
+    failure_class TEXT NOT NULL DEFAULT '',   -- только для failed
+    jobs INT NOT NULL,
+    refunded INT NOT NULL,
+    credits_spent INT NOT NULL,
+    PRIMARY KEY (bucket, template_id, model, status, failure_class)
+);
+
+-- Медианы длительностей этапов завершённых job'ов по дню завершения
+CREATE TABLE IF NOT EXISTS public.rollup_durations_daily (
+    day DATE NOT NULL,
+    template_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    stage TEXT NOT NULL,                      -- этапы stage_durations + queue_wait + total (как в job_eta.sql)
+    samples INT NOT NULL,
+    p50 DOUBLE PRECISION,
+    p90 DOUBLE PRECISION,
+    PRIMARY KEY (day, template_id, model, stage)
+);
+
+-- Деньги, кредиты и новые пользователи по дням
+CREATE TABLE IF NOT EXISTS public.rollup_money_daily (
+    day DATE PRIMARY KEY,
+    new_users INT NOT NULL,
+    payments INT NOT NULL,
+    paying_users INT NOT NULL,
+    revenue_rub NUMERIC(12, 2) NOT NULL,
+    credits_purchased INT NOT NULL,
+    credits_bonus INT NOT NULL,
+    credits_refunded INT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS public.rollup_state (
+    name TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Дневные счётчики — сумма часовых (таблица маленькая, view дешёвый)
+CREATE OR REPLACE VIEW public.rollup_jobs_daily AS
+SELECT
+    (bucket AT TIME ZONE 'UTC')::DATE AS day,
+    template_id,
+    model,
+    status,
+    failure_class,
+    SUM(jobs)::INT AS jobs,
+    SUM(refunded)::INT AS refunded,
+    SUM(credits_spent)::INT AS credits_spent
+FROM public.rollup_jobs_hourly
+GROUP BY 1, 2, 3, 4, 5;
+
+-- ===================================
+-- FUNCTION: job_failure_class
+-- ===================================
+-- Класс ошибки по jobs.error — те же группы, что KieErrorType
+-- (worker/kie_error_classifier.py), плюс ошибки самого воркера. Как и там,
+-- совпадения только по целым словам (\y): "content", "human" или "403"
+-- внутри временной ошибки не делают её user_violation.
+-- После изменения — SELECT refresh_rollups(TRUE) для пересчёта истории.
+CREATE OR REPLACE FUNCTION public.job_failure_class(p_error TEXT) RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN p_error IS NULL OR p_error = '' THEN 'unknown'
+        WHEN p_error = 'no_video_url' THEN 'no_video_url'
+        WHEN p_error ~* '^(fail_code=|code=|HTTP )(5[0-9][0-9]|408|409|425|455)$' THEN 'temporary'
+        WHEN p_error ~* '\y(http|status|code|error)\s*[:=]?\s*(5[0-9][0-9]|408|455)\y' THEN 'temporary'
+        WHEN p_error ~* '\y(http|status|code|error)\s*[:=]?\s*429\y' THEN 'rate_limit'
+        WHEN p_error ~* '\y((content|safety|usage) polic(y|ies)|violat(e|es|ed|ing|ion|ions)|guidelines?|guardrails?|moderation|flagged|prohibited|nsfw|explicit|photorealistic|real(istic)? (people|persons?|humans?|faces?)|sexual(ly)?|nud(e|ity)|sensitive (words?|content))\y'
+            THEN 'user_violation'
+        WHEN p_error ~* '\y(billing|payment|subscription|insufficient (funds|credits?|balance)|not enough (credits?|balance)|quota exceeded)\y'
+            THEN 'billing'
+        WHEN p_error ~* '\y(rate[ -]?limit(ed)?|too many requests|throttl(e|ed|ing))\y' THEN 'rate_limit'
+        WHEN p_error ~* '\y(time[ -]?out|timed out|unavailable|temporar(y|ily)|connection|network|overloaded)\y'
+            THEN 'temporary'
+        ELSE 'unknown'
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- ===================================
+-- FUNCTION: refresh_rollups
+-- ===================================
+-- p_full = TRUE — пересчитать всё (первый запуск, смена классификации).
+-- Перекрытие 10 минут с прошлым запуском ловит транзакции, закоммиченные
+-- после его снимка; повторный пересчёт бакета идемпотентен.
+-- Затронутые бакеты ищутся в горячей jobs (архивные job'ы не меняются),
+-- а считаются по jobs_all (database/jobs_archive.sql) — перенос в архив
+-- не теряет строки при пересчёте старого бакета. При полном пересчёте
+-- бакеты берутся из jobs_all: иначе часы и дни, все job'ы которых уже в
+-- архиве, не пересчитались бы после смены классификации.
+CREATE OR REPLACE FUNCTION public.refresh_rollups(p_full BOOLEAN DEFAULT FALSE) RETURNS JSON AS $$
+DECLARE
+    v_now TIMESTAMP WITH TIME ZONE := NOW();
+    v_since TIMESTAMP WITH TIME ZONE;
+    v_from_day DATE;
+    v_hours INT;
+    v_days INT;
+    v_money_days INT;
+BEGIN
+    -- Один refresh за раз: параллельный запуск просто выходит
+    IF NOT pg_try_advisory_xact_lock(hashtext('refresh_rollups')) THEN
+        RETURN json_build_object('skipped', TRUE);
+    END IF;
+
+    SELECT refreshed_at - INTERVAL '10 minutes' INTO v_since
+    FROM public.rollup_state WHERE name = 'rollups';
+    IF p_full OR v_since IS NULL THEN
+        v_since := '-infinity';
+    END IF;
+
+    -- 1) Часы, в которых создавались изменившиеся job'ы
+    IF v_since = '-infinity' THEN
+        CREATE TEMP TABLE _rollup_hours ON COMMIT DROP AS
+        SELECT DISTINCT date_trunc('hour', created_at) AS bucket
+        FROM public.jobs_all;
+    ELSE
+        CREATE TEMP TABLE _rollup_hours ON COMMIT DROP AS
+        SELECT DISTINCT date_trunc('hour', created_at) AS bucket
+        FROM public.jobs
+        WHERE updated_at >= v_since OR created_at >= v_since;
+    END IF;
+    GET DIAGNOSTICS v_hours = ROW_COUNT;
+
+    DELETE FROM public.rollup_jobs_hourly r USING _rollup_hours h WHERE r.bucket = h.bucket;
+
+    INSERT INTO public.rollup_jobs_hourly
+    SELECT
+        h.bucket,
+        COALESCE(j.template_id, 'ugc'),
+        COALESCE(j.model, ''),
+        j.status,
+        CASE WHEN j.status = 'failed' THEN public.job_failure_class(j.error) ELSE '' END,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE COALESCE(j.credit_refunded, FALSE)),
+        COALESCE(SUM(j.credits_deducted), 0)
+    FROM _rollup_hours h
+    JOIN public.jobs_all j ON j.created_at >= h.bucket AND j.created_at < h.bucket + INTERVAL '1 hour'
+    GROUP BY 1, 2, 3, 4, 5;
+
+    -- 2) Дни, в которые завершались job'ы
+    IF v_since = '-infinity' THEN
+        CREATE TEMP TABLE _rollup_days ON COMMIT DROP AS
+        SELECT DISTINCT (finished_at AT TIME ZONE 'UTC')::DATE AS day
+        FROM public.jobs_all
+        WHERE status = 'completed' AND finished_at IS NOT NULL;
+    ELSE
+        CREATE TEMP TABLE _rollup_days ON COMMIT DROP AS
+        SELECT DISTINCT (finished_at AT TIME ZONE 'UTC')::DATE AS day
+        FROM public.jobs
+        WHERE status = 'completed' AND finished_at >= v_since;
+    END IF;
+    GET DIAGNOSTICS v_days = ROW_COUNT;
+
+    DELETE FROM public.rollup_durations_daily r USING _rollup_days d WHERE r.day = d.day;
+
+    INSERT INTO public.rollup_durations_daily
+    WITH finished AS (
+        SELECT
+            d.day,
+            COALESCE(j.template_id, 'ugc') AS template_id,
+            COALESCE(j.model, '') AS model,
+            j.stage_durations,
+            EXTRACT(EPOCH FROM (j.started_at - j.created_at)) AS queue_wait,
+            EXTRACT(EPOCH FROM (j.finished_at - j.started_at)) AS total
+        FROM _rollup_days d
+        JOIN public.jobs_all j
+          ON j.finished_at >= d.day::TIMESTAMP AT TIME ZONE 'UTC'
+         AND j.finished_at < (d.day + 1)::TIMESTAMP AT TIME ZONE 'UTC'
+        WHERE j.status = 'completed'
+    ),
+    samples AS (
+        SELECT f.day, f.template_id, f.model, s.key AS stage, s.value::TEXT::DOUBLE PRECISION AS seconds
+        FROM finished f, jsonb_each(COALESCE(f.stage_durations, '{}'::JSONB)) s
+        UNION ALL
+        SELECT f.day, f.template_id, f.model, 'queue_wait', f.queue_wait FROM finished f
+        UNION ALL
+        SELECT f.day, f.template_id, f.model, 'total', f.total FROM finished f
+    )
+    SELECT
+        day, template_id, model, stage,
+        COUNT(*),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds),
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY seconds)
+    FROM samples
+    WHERE seconds IS NOT NULL AND seconds >= 0
+    GROUP BY day, template_id, model, stage;
+
+    -- 3) Деньги и кредиты: дни начиная с прошлого запуска (строк на день — одна)
+    IF v_since = '-infinity' THEN
+        SELECT (LEAST(
+            (SELECT MIN(created_at) FROM public.users),
+            (SELECT MIN(created_at) FROM public.credits_history),
+            (SELECT MIN(created_at) FROM public.payments)
+        ) AT TIME ZONE 'UTC')::DATE INTO v_from_day;
+    ELSE
+        v_from_day := (v_since AT TIME ZONE 'UTC')::DATE;
+    END IF;
+    v_from_day := COALESCE(v_from_day, (v_now AT TIME ZONE 'UTC')::DATE);
+
+    DELETE FROM public.rollup_money_daily WHERE day >= v_from_day;
+
+    INSERT INTO public.rollup_money_daily
+    SELECT
+        (d.day AT TIME ZONE 'UTC')::DATE,
+        (SELECT COUNT(*) FROM public.users u
+          WHERE u.created_at >= d.day AND u.created_at < d.day + INTERVAL '1 day'),
+        COALESCE(p.payments, 0),
+        COALESCE(p.paying_users, 0),
+        COALESCE(p.revenue_rub, 0),
+        COALESCE(c.purchased, 0),
+        COALESCE(c.bonus, 0),
+        COALESCE(c.refunded, 0)
+    FROM generate_series(
+        v_from_day::TIMESTAMP AT TIME ZONE 'UTC',
+        v_now,
+        INTERVAL '1 day'
+    ) AS d(day)
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*) AS payments, COUNT(DISTINCT tg_user_id) AS paying_users, SUM(amount_rub) AS revenue_rub
+        FROM public.payments
+        WHERE status = 'completed'
+          AND completed_at >= d.day AND completed_at < d.day + INTERVAL '1 day'
+    ) p ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT
+            SUM(amount) FILTER (WHERE operation_type = 'purchase') AS purchased,
+            SUM(amount) FILTER (WHERE operation_type NOT IN ('purchase', 'refund', 'usage', 'expired')) AS bonus,
+            SUM(amount) FILTER (WHERE operation_type = 'refund') AS refunded
+        FROM public.credits_history
+        WHERE created_at >= d.day AND created_at < d.day + INTERVAL '1 day'
+    ) c ON TRUE;
+    GET DIAGNOSTICS v_money_days = ROW_COUNT;
+
+    INSERT INTO public.rollup_state (name, refreshed_at) VALUES ('rollups', v_now)
+    ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN json_build_object(
+        'skipped', FALSE,
+        'full', v_since = '-infinity',
+        'hours', v_hours,
+        'duration_days', v_days,
+        'money_days', v_money_days
+    );
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,106 @@
+-- ===================================
+-- СПРАВЕДЛИВАЯ ВЫДАЧА JOB'ОВ ИЗ ОЧЕРЕДИ
+-- ===================================
+-- Вместо строгого ORDER BY created_at очередь выдаётся по кругу между
+-- пользователями: первым идёт тот, у кого меньше job'ов в обработке
+-- (с учётом веса), затем тот, кого обслуживали давнее всех.
+-- Один пользователь со 100 задачами больше не блокирует остальных.
+
+-- Вес пользователя в очереди. NULL = по умолчанию:
+-- 2 для пользователей с оплаченным платежом, 1 для остальных.
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS queue_weight NUMERIC;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS last_claimed_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status_tg_user_id ON public.jobs(status, tg_user_id);
+
+-- ===================================
+-- FUNCTION: claim_next_job
+-- ===================================
+-- Атомарно выбирает следующий job и переводит его в processing.
+-- p_max_per_user > 0 — лимит одновременных job'ов одного пользователя.
+CREATE OR REPLACE FUNCTION public.claim_next_job(
+    p_max_per_user INT DEFAULT 0,
+    p_candidates INT DEFAULT 20
+) RETURNS SETOF public.jobs AS $$
+DECLARE
+    v_candidate RECORD;
+    v_in_flight INT;
+    v_job public.jobs%ROWTYPE;
+BEGIN
+    FOR v_candidate IN
+        WITH heads AS (
+            -- Самый старый готовый к запуску job каждого пользователя
+            SELECT DISTINCT ON (j.tg_user_id) j.id, j.tg_user_id, j.created_at
+            FROM public.jobs j
+            WHERE j.status = 'queued'
+              AND (j.run_after IS NULL OR j.run_after <= NOW())
+            ORDER BY j.tg_user_id, j.created_at
+        ),
+        in_flight AS (
+            SELECT tg_user_id, COUNT(*) AS n
+            FROM public.jobs
+            WHERE status = 'processing'
+            GROUP BY tg_user_id
+        )
+        SELECT h.id, h.tg_user_id
+        FROM heads h
+        JOIN public.users u ON u.tg_user_id = h.tg_user_id
+        LEFT JOIN in_flight f ON f.tg_user_id = h.tg_user_id
+        WHERE p_max_per_user <= 0 OR COALESCE(f.n, 0) < p_max_per_user
+        ORDER BY
+            COALESCE(f.n, 0)::NUMERIC / GREATEST(
+                COALESCE(
+                    u.queue_weight,
+                    CASE WHEN EXISTS (
+                        SELECT 1 FROM public.payments p
+                        WHERE p.tg_user_id = u.tg_user_id AND p.status = 'completed'
+                    ) THEN 2 ELSE 1 END
+                ),
+                0.01
+            ),
+            u.last_claimed_at NULLS FIRST,
+            h.created_at
+        LIMIT p_candidates
+    LOOP
+        -- Сериализуем выдачу по пользователю: лимит не обойти параллельными воркерами
+        PERFORM 1 FROM public.users
+        WHERE tg_user_id = v_candidate.tg_user_id
+        FOR UPDATE SKIP LOCKED;
+
+        IF NOT FOUND THEN
+            CONTINUE;
+        END IF;
+
+        IF p_max_per_user > 0 THEN
+            SELECT COUNT(*) INTO v_in_flight
+            FROM public.jobs
+            WHERE tg_user_id = v_candidate.tg_user_id AND status = 'processing';
+
+            IF v_in_flight >= p_max_per_user THEN
+                CONTINUE;
+            END IF;
+        END IF;
+
+        UPDATE public.jobs
+        SET status = 'processing',
+            started_at = NOW(),
+            attempts = COALESCE(attempts, 0) + 1,
+            run_after = NULL,
+            updated_at = NOW()
+        WHERE id = v_candidate.id
+          AND status = 'queued'
+        RETURNING * INTO v_job;
+
+        IF FOUND THEN
+            UPDATE public.users
+            SET last_claimed_at = NOW()
+            WHERE tg_user_id = v_candidate.tg_user_id;
+
+            RETURN NEXT v_job;
+            RETURN;
+        END IF;
+    END LOOP;
+
+    RETURN;
+END;
+$$ LANGUAGE plpgsql;
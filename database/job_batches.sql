@@ -0,0 +1,77 @@
+-- ===================================
+-- ЗАКАЗ ИЗ НЕСКОЛЬКИХ ВИДЕО: ОДНА ДОСТАВКА
+-- ===================================
+-- Job'ы одного confirm_generation делят batch_id. Готовое видео батча воркер
+-- не шлёт сразу: claim_batch_delivery() отдаёт ролики батча одной пачкой
+-- (один send_media_group + одно итоговое сообщение), когда все job'ы батча
+-- завершились (completed/failed) или с первого готового прошло p_deadline.
+-- Опоздавший после дедлайна ролик уходит следующей пачкой.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS batch_id TEXT;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS batch_delivered_at TIMESTAMP WITH TIME ZONE;
+
+-- Готовые, но не доставленные ролики батчей — маленький набор для частого опроса
+CREATE INDEX IF NOT EXISTS idx_jobs_batch_pending ON public.jobs(batch_id)
+    WHERE batch_id IS NOT NULL AND batch_delivered_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_jobs_batch_id ON public.jobs(batch_id) WHERE batch_id IS NOT NULL;
+
+-- ===================================
+-- FUNCTION: claim_batch_delivery
+-- ===================================
+-- p_batch_id = NULL — все готовые к доставке батчи (периодический опрос воркера).
+-- Строки помечаются доставленными тем же UPDATE: параллельный вызов на тех же
+-- строках после блокировки видит batch_delivered_at и ничего не получает.
+-- completed / failed / total — по всему батчу, для итогового сообщения.
+CREATE OR REPLACE FUNCTION public.claim_batch_delivery(
+    p_batch_id TEXT DEFAULT NULL,
+    p_deadline INTERVAL DEFAULT INTERVAL '15 minutes'
+) RETURNS TABLE (
+    batch_id TEXT,
+    job_id TEXT,
+    tg_user_id BIGINT,
+    kind TEXT,
+    video_url TEXT,
+    video_file_id TEXT,
+    completed INT,
+    failed INT,
+    total INT
+) AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH pending AS (
+        SELECT DISTINCT j.batch_id
+        FROM public.jobs j
+        WHERE j.batch_id IS NOT NULL
+          AND j.batch_delivered_at IS NULL
+          AND j.status = 'completed'
+          AND (p_batch_id IS NULL OR j.batch_id = p_batch_id)
+    ),
+    ready AS (
+        SELECT
+            j.batch_id,
+            COUNT(*) FILTER (WHERE j.status = 'completed')::INT AS completed,
+            COUNT(*) FILTER (WHERE j.status = 'failed')::INT AS failed,
+            COUNT(*)::INT AS total
+        FROM public.jobs j
+        JOIN pending p ON p.batch_id = j.batch_id
+        GROUP BY j.batch_id
+        HAVING bool_and(j.status IN ('completed', 'failed'))
+            OR MIN(j.finished_at) FILTER (WHERE j.status = 'completed') < NOW() - p_deadline
+    ),
+    claimed AS (
+        UPDATE public.jobs j
+        SET batch_delivered_at = NOW()
+        FROM ready r
+        WHERE j.batch_id = r.batch_id
+          AND j.status = 'completed'
+          AND j.batch_delivered_at IS NULL
+        RETURNING j.batch_id, j.id, j.tg_user_id,
+            COALESCE(j.kind, 'reels') AS kind, j.video_url, j.video_file_id, j.created_at
+    )
+    SELECT c.batch_id, c.id, c.tg_user_id, c.kind, c.video_url, c.video_file_id, r.completed, r.failed, r.total
+    FROM claimed c
+    JOIN ready r ON r.batch_id = c.batch_id
+    ORDER BY c.batch_id, c.created_at;
+END;
+$$ LANGUAGE plpgsql;
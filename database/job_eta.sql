@@ -0,0 +1,89 @@
+-- ===================================
+-- ДЛИТЕЛЬНОСТИ ЭТАПОВ И ОЦЕНКА ETA
+-- ===================================
+-- Воркер записывает длительность каждого этапа job'а (gpt, kie, download,
+-- upload) одним JSONB вместе с complete_job. Ожидание в очереди считается
+-- из started_at - created_at. Квантили по шаблону и модели берутся
+-- из stage_duration_quantiles() и кешируются ботом.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS stage_durations JSONB;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS model TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_completed_finished_at
+    ON public.jobs(finished_at DESC)
+    WHERE status = 'completed';
+
+-- ===================================
+-- FUNCTION: complete_job (+ stage_durations)
+-- ===================================
+DROP FUNCTION IF EXISTS public.complete_job(TEXT, TEXT, TEXT);
+
+CREATE OR REPLACE FUNCTION public.complete_job(
+    p_job_id TEXT,
+    p_video_url TEXT,
+    p_file_id TEXT DEFAULT NULL,
+    p_stage_durations JSONB DEFAULT NULL
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE public.jobs
+    SET status = 'completed',
+        video_url = COALESCE(p_video_url, video_url),
+        video_file_id = COALESCE(NULLIF(p_file_id, ''), video_file_id),
+        stage_durations = COALESCE(p_stage_durations, stage_durations),
+        run_after = NULL,
+        finished_at = NOW(),
+        updated_at = NOW()
+    WHERE id = p_job_id
+      AND status <> 'completed'
+      AND NOT COALESCE(credit_refunded, FALSE);
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===================================
+-- FUNCTION: stage_duration_quantiles
+-- ===================================
+-- Скользящие p50/p90 длительностей этапов (в секундах) по шаблону и модели
+-- за последние p_window. stage = 'total' — полное время обработки.
+CREATE OR REPLACE FUNCTION public.stage_duration_quantiles(
+    p_window INTERVAL DEFAULT INTERVAL '3 days'
+) RETURNS TABLE (
+    template_id TEXT,
+    model TEXT,
+    stage TEXT,
+    p50 DOUBLE PRECISION,
+    p90 DOUBLE PRECISION,
+    samples BIGINT
+) AS $$
+    WITH recent AS (
+        SELECT
+            COALESCE(j.template_id, 'ugc') AS template_id,
+            COALESCE(j.model, '') AS model,
+            j.stage_durations,
+            EXTRACT(EPOCH FROM (j.started_at - j.created_at)) AS queue_wait,
+            EXTRACT(EPOCH FROM (j.finished_at - j.started_at)) AS total
+        FROM public.jobs j
+        WHERE j.status = 'completed'
+          AND j.finished_at > NOW() - p_window
+          AND j.started_at IS NOT NULL
+    ),
+    samples AS (
+        SELECT r.template_id, r.model, s.key AS stage, s.value::TEXT::DOUBLE PRECISION AS seconds
+        FROM recent r, jsonb_each(COALESCE(r.stage_durations, '{}'::JSONB)) s
+        UNION ALL
+        SELECT r.template_id, r.model, 'queue_wait', r.queue_wait FROM recent r
+        UNION ALL
+        SELECT r.template_id, r.model, 'total', r.total FROM recent r
+    )
+    SELECT
+        template_id,
+        model,
+        stage,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds),
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY seconds),
+        COUNT(*)
+    FROM samples
+    WHERE seconds IS NOT NULL AND seconds >= 0
+    GROUP BY template_id, model, stage;
+$$ LANGUAGE sql STABLE;
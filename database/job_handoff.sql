@@ -0,0 +1,31 @@
+-- ===================================
+-- ПЕРЕДАЧА JOB'А ДРУГОМУ ВОРКЕРУ ПРИ ОСТАНОВКЕ
+-- ===================================
+-- Воркер, получивший SIGTERM во время ожидания KIE, не ждёт генерацию до конца:
+-- job возвращается в очередь с kie_handoff = TRUE и сохранённым kie_task_id.
+-- Следующий воркер сразу продолжает poll той же задачи KIE — без новой генерации
+-- и без списания попытки.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS kie_handoff BOOLEAN DEFAULT FALSE;
+
+-- ===================================
+-- FUNCTION: handoff_job
+-- ===================================
+CREATE OR REPLACE FUNCTION public.handoff_job(
+    p_job_id TEXT
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE public.jobs
+    SET status = 'queued',
+        kie_handoff = TRUE,
+        run_after = NOW(),
+        -- claim_next_job снова увеличит attempts: передача не считается попыткой
+        attempts = GREATEST(COALESCE(attempts, 1) - 1, 0),
+        updated_at = NOW()
+    WHERE id = p_job_id
+      AND status = 'processing'
+      AND kie_task_id IS NOT NULL;
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
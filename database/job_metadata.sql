@@ -0,0 +1,58 @@
+-- ===================================
+-- ПАРАМЕТРЫ ГЕНЕРАЦИИ В КОЛОНКАХ JOBS
+-- ===================================
+-- template_id, kind и user_prompt раньше лежали JSON-строкой в error_details,
+-- product_info — JSON-строкой в product_text и prompt, и воркер разбирал их
+-- json.loads на каждой попытке. Теперь это колонки: product_info — JSONB
+-- (asyncpg отдаёт его dict'ом, кодек в app/db_pool.py), product_text —
+-- просто текст товара, error_details — снова только детали ошибок.
+--
+-- На существующей базе: применить этот файл, затем заново job_eta.sql,
+-- analytics_rollups.sql и job_batches.sql (функции читают новые колонки).
+-- В свежей базе колонки создаёт supabase/schema.sql, здесь — no-op.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS template_id TEXT;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS kind TEXT;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS user_prompt TEXT;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS product_info JSONB;
+
+-- jobs_archive и view jobs_all получают те же колонки
+SELECT public.sync_jobs_archive();
+
+-- ===================================
+-- ПЕРЕНОС СТАРЫХ JOB'ОВ (горячих и архивных)
+-- ===================================
+CREATE OR REPLACE FUNCTION public.try_jsonb(p_value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN p_value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+DO $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['jobs', 'jobs_archive'] LOOP
+        EXECUTE format($sql$
+            UPDATE public.%I
+            SET template_id = COALESCE(template_id, error_details->>'template_id'),
+                kind = COALESCE(kind, error_details->>'kind'),
+                user_prompt = COALESCE(user_prompt, NULLIF(error_details->>'user_prompt', '')),
+                error_details = NULLIF(error_details - 'template_id' - 'kind' - 'user_prompt', '{}'::jsonb)
+            WHERE jsonb_typeof(error_details) = 'object'
+              AND error_details ?| ARRAY['template_id', 'kind', 'user_prompt']
+        $sql$, v_table);
+
+        EXECUTE format($sql$
+            UPDATE public.%I
+            SET product_info = public.try_jsonb(product_text),
+                product_text = public.try_jsonb(product_text)->>'text'
+            WHERE product_info IS NULL
+              AND product_text LIKE '{%%'
+              AND jsonb_typeof(public.try_jsonb(product_text)) = 'object'
+        $sql$, v_table);
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,63 @@
+-- ===================================
+-- ТАЙМЛАЙН ЭТАПОВ JOB'А
+-- ===================================
+-- jobs.timeline — компактный JSONB массив событий:
+--   {"stage": "kie", "at": <unix ts начала>, "dur": <секунды>, "attempt": 1}
+-- Воркер копит события в памяти и дописывает их тем же запросом,
+-- что и переход состояния (update_job / complete_job / fail_job_and_refund /
+-- requeue_job) — лишних round trip'ов нет.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS timeline JSONB;
+
+-- ===================================
+-- FUNCTION: append_job_timeline
+-- ===================================
+CREATE OR REPLACE FUNCTION public.append_job_timeline(
+    p_job_id TEXT,
+    p_events JSONB
+) RETURNS VOID AS $$
+BEGIN
+    IF p_events IS NULL OR jsonb_typeof(p_events) <> 'array' OR jsonb_array_length(p_events) = 0 THEN
+        RETURN;
+    END IF;
+
+    UPDATE public.jobs
+    SET timeline = COALESCE(timeline, '[]'::JSONB) || p_events
+    WHERE id = p_job_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===================================
+-- FUNCTION: job_stage_percentiles
+-- ===================================
+-- Перцентили длительностей этапов (секунды) по job'ам, созданным в окне.
+-- Используется scripts/stage_report.py.
+CREATE OR REPLACE FUNCTION public.job_stage_percentiles(
+    p_since TIMESTAMPTZ,
+    p_until TIMESTAMPTZ DEFAULT NOW()
+) RETURNS TABLE (
+    stage TEXT,
+    events BIGINT,
+    jobs BIGINT,
+    p50 DOUBLE PRECISION,
+    p90 DOUBLE PRECISION,
+    p99 DOUBLE PRECISION,
+    max DOUBLE PRECISION
+) AS $$
+    SELECT
+        e->>'stage' AS stage,
+        COUNT(*) AS events,
+        COUNT(DISTINCT j.id) AS jobs,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY (e->>'dur')::DOUBLE PRECISION),
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY (e->>'dur')::DOUBLE PRECISION),
+        percentile_cont(0.99) WITHIN GROUP (ORDER BY (e->>'dur')::DOUBLE PRECISION),
+        MAX((e->>'dur')::DOUBLE PRECISION)
+    FROM public.jobs j,
+         jsonb_array_elements(j.timeline) e
+    WHERE j.created_at >= p_since
+      AND j.created_at < p_until
+      AND j.timeline IS NOT NULL
+      AND e ? 'dur'
+    GROUP BY e->>'stage'
+    ORDER BY MIN((e->>'at')::DOUBLE PRECISION);
+$$ LANGUAGE sql STABLE;
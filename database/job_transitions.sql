@@ -0,0 +1,120 @@
+-- ===================================
+-- АТОМАРНЫЕ ПЕРЕХОДЫ СОСТОЯНИЙ JOB'ОВ
+-- ===================================
+-- Каждый исход обработки (fail + refund, complete, requeue) — одна RPC,
+-- один round trip и одна транзакция. Повторный вызов безопасен:
+-- кредит за job возвращается не более одного раза.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS credit_refunded BOOLEAN DEFAULT FALSE;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS run_after TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_queued_created_at
+    ON public.jobs(created_at)
+    WHERE status = 'queued';
+
+-- ===================================
+-- FUNCTION: fail_job_and_refund
+-- ===================================
+CREATE OR REPLACE FUNCTION public.fail_job_and_refund(
+    p_job_id TEXT,
+    p_error TEXT
+) RETURNS JSON AS $$
+DECLARE
+    v_job RECORD;
+    v_new_credits INT;
+    v_refunded BOOLEAN := FALSE;
+BEGIN
+    -- 1) Блокируем строку job'а
+    SELECT id, tg_user_id, user_id, status, credit_refunded, credits_deducted
+    INTO v_job
+    FROM public.jobs
+    WHERE id = p_job_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN json_build_object('job_id', p_job_id, 'found', FALSE, 'refunded', FALSE);
+    END IF;
+
+    -- 2) Завершённый job не трогаем
+    IF v_job.status = 'completed' THEN
+        RETURN json_build_object('job_id', p_job_id, 'found', TRUE, 'status', v_job.status, 'refunded', FALSE);
+    END IF;
+
+    -- 3) Возвращаем кредит ровно один раз
+    IF NOT COALESCE(v_job.credit_refunded, FALSE) THEN
+        UPDATE public.users
+        SET credits = credits + COALESCE(v_job.credits_deducted, 1), updated_at = NOW()
+        WHERE tg_user_id = v_job.tg_user_id
+        RETURNING credits INTO v_new_credits;
+
+        INSERT INTO public.credits_history (tg_user_id, user_id, amount, operation_type, job_id, description)
+        VALUES (v_job.tg_user_id, v_job.user_id, COALESCE(v_job.credits_deducted, 1), 'refund', p_job_id,
+                'Job failed - credit refunded');
+
+        v_refunded := TRUE;
+    END IF;
+
+    -- 4) Помечаем job как failed
+    UPDATE public.jobs
+    SET status = 'failed',
+        error = COALESCE(p_error, error),
+        credit_refunded = TRUE,
+        run_after = NULL,
+        finished_at = COALESCE(finished_at, NOW()),
+        updated_at = NOW()
+    WHERE id = p_job_id;
+
+    RETURN json_build_object(
+        'job_id', p_job_id,
+        'found', TRUE,
+        'status', 'failed',
+        'refunded', v_refunded,
+        'new_credits', v_new_credits
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===================================
+-- FUNCTION: complete_job
+-- ===================================
+CREATE OR REPLACE FUNCTION public.complete_job(
+    p_job_id TEXT,
+    p_video_url TEXT,
+    p_file_id TEXT DEFAULT NULL
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE public.jobs
+    SET status = 'completed',
+        video_url = COALESCE(p_video_url, video_url),
+        video_file_id = COALESCE(NULLIF(p_file_id, ''), video_file_id),
+        run_after = NULL,
+        finished_at = NOW(),
+        updated_at = NOW()
+    WHERE id = p_job_id
+      AND status <> 'completed'
+      AND NOT COALESCE(credit_refunded, FALSE);
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===================================
+-- FUNCTION: requeue_job
+-- ===================================
+-- Возвращает job в очередь с задержкой: вместо sleep в воркере
+-- job просто не выдаётся fetch'ем до run_after.
+CREATE OR REPLACE FUNCTION public.requeue_job(
+    p_job_id TEXT,
+    p_delay_seconds INT DEFAULT 0
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE public.jobs
+    SET status = 'queued',
+        run_after = NOW() + make_interval(secs => GREATEST(p_delay_seconds, 0)),
+        updated_at = NOW()
+    WHERE id = p_job_id
+      AND status NOT IN ('completed', 'failed');
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,120 @@
+-- ===================================
+-- HOT / COLD: АРХИВ ЗАВЕРШЁННЫХ JOB'ОВ
+-- ===================================
+-- jobs — горячий набор: очередь, обработка и свежая история. Завершённые job'ы
+-- старше N дней archive_finished_jobs() переносит в jobs_archive пачками,
+-- так что claim_next_job, индексы по статусу и created_at остаются маленькими.
+-- История пользователя и rollup'ы читают view jobs_all (jobs + jobs_archive).
+-- Запуск по расписанию: scripts/archive_jobs.py (systemd/neurocards-archive.timer).
+--
+-- Колонки jobs_archive догоняет sync_jobs_archive(): миграция, добавившая
+-- колонку в jobs (например job_metadata.sql), вызывает её сразу после ALTER.
+-- Перенос её не вызывает: пересоздание jobs_all берёт ACCESS EXCLUSIVE на view,
+-- которую читают горячие пути бота и реплика.
+
+CREATE TABLE IF NOT EXISTS public.jobs_archive (LIKE public.jobs INCLUDING DEFAULTS);
+
+ALTER TABLE public.jobs_archive DROP CONSTRAINT IF EXISTS jobs_archive_pkey;
+ALTER TABLE public.jobs_archive ADD CONSTRAINT jobs_archive_pkey PRIMARY KEY (id);
+CREATE INDEX IF NOT EXISTS idx_jobs_archive_user_created
+    ON public.jobs_archive(tg_user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_jobs_archive_created_at ON public.jobs_archive(created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_archive_finished_at ON public.jobs_archive(finished_at);
+
+-- История пользователя по горячей таблице
+CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON public.jobs(tg_user_id, created_at DESC);
+
+-- credits_history.job_id может ссылаться на архивный job: FK на jobs
+-- при переносе обнулил бы ссылку (ON DELETE SET NULL)
+ALTER TABLE public.credits_history DROP CONSTRAINT IF EXISTS credits_history_job_id_fkey;
+
+-- ===================================
+-- FUNCTION: sync_jobs_archive
+-- ===================================
+-- Добавляет в jobs_archive колонки, появившиеся в jobs, и только тогда (или
+-- если view ещё нет) пересоздаёт jobs_all с явным списком колонок jobs
+-- (порядок колонок двух таблиц может различаться). Возвращает число
+-- добавленных колонок. Вызывать из миграций, не из регулярных задач.
+-- Раньше возвращала TEXT (список колонок) — смена типа результата
+DROP FUNCTION IF EXISTS public.sync_jobs_archive();
+CREATE OR REPLACE FUNCTION public.sync_jobs_archive() RETURNS INT AS $$
+DECLARE
+    v_col RECORD;
+    v_cols TEXT;
+    v_added INT := 0;
+BEGIN
+    FOR v_col IN
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod) AS coltype
+        FROM pg_attribute a
+        WHERE a.attrelid = 'public.jobs'::regclass AND a.attnum > 0 AND NOT a.attisdropped
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_attribute b
+              WHERE b.attrelid = 'public.jobs_archive'::regclass
+                AND b.attname = a.attname AND NOT b.attisdropped
+          )
+    LOOP
+        EXECUTE format('ALTER TABLE public.jobs_archive ADD COLUMN %I %s', v_col.attname, v_col.coltype);
+        v_added := v_added + 1;
+    END LOOP;
+
+    IF v_added = 0 AND to_regclass('public.jobs_all') IS NOT NULL THEN
+        RETURN 0;
+    END IF;
+
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_cols
+    FROM pg_attribute
+    WHERE attrelid = 'public.jobs'::regclass AND attnum > 0 AND NOT attisdropped;
+
+    EXECUTE 'DROP VIEW IF EXISTS public.jobs_all';
+    EXECUTE format(
+        'CREATE VIEW public.jobs_all AS '
+        'SELECT %1$s, FALSE AS archived FROM public.jobs '
+        'UNION ALL SELECT %1$s, TRUE AS archived FROM public.jobs_archive',
+        v_cols
+    );
+    RETURN v_added;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT public.sync_jobs_archive();
+
+-- ===================================
+-- FUNCTION: archive_finished_jobs
+-- ===================================
+-- Переносит до p_batch завершённых job'ов, закончившихся раньше p_older_than назад.
+-- Возвращает число удалённых из jobs; вызывать в цикле, пока не вернёт 0.
+-- Конфликт id с jobs_archive или колонка, которой нет в архиве (миграция
+-- не вызвала sync_jobs_archive), валит пачку целиком: job не теряется.
+CREATE OR REPLACE FUNCTION public.archive_finished_jobs(
+    p_older_than INTERVAL DEFAULT INTERVAL '30 days',
+    p_batch INT DEFAULT 1000
+) RETURNS INT AS $$
+DECLARE
+    v_cols TEXT;
+    v_moved INT;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_cols
+    FROM pg_attribute
+    WHERE attrelid = 'public.jobs'::regclass AND attnum > 0 AND NOT attisdropped;
+
+    EXECUTE format(
+        'WITH moved AS ('
+        '    DELETE FROM public.jobs WHERE id IN ('
+        '        SELECT id FROM public.jobs'
+        '        WHERE status IN (''completed'', ''failed'')'
+        '          AND finished_at < NOW() - $1'
+        '        ORDER BY finished_at'
+        '        LIMIT $2'
+        '        FOR UPDATE SKIP LOCKED'
+        '    ) RETURNING %1$s'
+        '), '
+        'inserted AS ('
+        '    INSERT INTO public.jobs_archive (%1$s) SELECT %1$s FROM moved'
+        ') '
+        'SELECT COUNT(*) FROM moved',
+        v_cols
+    ) INTO v_moved USING p_older_than, p_batch;
+
+    RETURN v_moved;
+END;
+$$ LANGUAGE plpgsql;
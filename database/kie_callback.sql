@@ -0,0 +1,42 @@
+-- ===================================
+-- CALLBACK ГОТОВНОСТИ ЗАДАЧИ KIE
+-- ===================================
+-- KIE вызывает callBackUrl бота (app/kie_callback.py), когда задача завершилась.
+-- Бот одной RPC записывает итог в строку job'а и будит воркер через NOTIFY
+-- в той же транзакции. Повторный callback той же задачи ничего не меняет.
+-- Poll recordInfo у воркера остаётся редкой страховкой на случай потерянного callback.
+
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS kie_state TEXT;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS kie_result JSONB;
+ALTER TABLE public.jobs ADD COLUMN IF NOT EXISTS kie_callback_at TIMESTAMP WITH TIME ZONE;
+
+-- ===================================
+-- FUNCTION: record_kie_callback
+-- ===================================
+-- Возвращает id job'а, если callback принят впервые; NULL — дубль или неизвестная задача.
+CREATE OR REPLACE FUNCTION public.record_kie_callback(
+    p_task_id TEXT,
+    p_state TEXT,
+    p_payload JSONB
+) RETURNS TEXT AS $$
+DECLARE
+    v_job_id TEXT;
+BEGIN
+    UPDATE public.jobs
+    SET kie_state = p_state,
+        kie_result = p_payload,
+        kie_callback_at = NOW(),
+        updated_at = NOW()
+    WHERE kie_task_id = p_task_id
+      AND kie_callback_at IS NULL
+      AND status IN ('queued', 'processing')
+    RETURNING id INTO v_job_id;
+
+    IF v_job_id IS NOT NULL THEN
+        -- Доставляется после COMMIT: воркер увидит уже записанный итог
+        PERFORM pg_notify('kie_task_done', p_task_id);
+    END IF;
+
+    RETURN v_job_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,15 @@
+-- ===================================
+-- РЕЕСТР FILE_ID СТАТИЧНЫХ ФАЙЛОВ (assets/)
+-- ===================================
+-- Бот при старте один раз заливает каждый файл assets/ в служебный канал
+-- (app/services/media_registry.py) и запоминает file_id по sha256 содержимого.
+-- Дальше приветственные видео и картинка меню уходят по file_id, без загрузки
+-- с диска на каждого пользователя. Изменённый файл — новый sha256, новая заливка.
+
+CREATE TABLE IF NOT EXISTS public.media_files (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
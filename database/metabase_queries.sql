@@ -0,0 +1,180 @@
+-- ===================================
+-- ЗАПРОСЫ КАРТОЧЕК METABASE
+-- ===================================
+-- Только rollup таблицы (database/analytics_rollups.sql) — сырые jobs / payments /
+-- credits_history дашборд не читает и не конкурирует с claim'ом воркеров.
+-- Данные свежие с точностью до запуска scripts/refresh_rollups.py (раз в 10 минут).
+-- Дни и часы в UTC.
+
+-- -----------------------------------
+-- Карточка 0: Главная сводка
+-- -----------------------------------
+WITH jobs AS (
+    SELECT
+        SUM(jobs) AS total,
+        SUM(jobs) FILTER (WHERE status = 'completed') AS completed,
+        SUM(jobs) FILTER (WHERE status = 'failed') AS failed,
+        SUM(jobs) FILTER (WHERE day >= CURRENT_DATE - 1) AS last_24h
+    FROM rollup_jobs_daily
+),
+money AS (
+    SELECT
+        SUM(new_users) AS users,
+        SUM(new_users) FILTER (WHERE day >= CURRENT_DATE - 30) AS new_users_30d,
+        SUM(revenue_rub) FILTER (WHERE day >= CURRENT_DATE - 30) AS revenue_30d
+    FROM rollup_money_daily
+),
+speed AS (
+    SELECT
+        SUM(p50 * samples) / NULLIF(SUM(samples), 0) AS p50_total
+    FROM rollup_durations_daily
+    WHERE stage = 'total' AND day >= CURRENT_DATE - 7
+)
+SELECT
+    money.users AS "👥 Всего users",
+    money.new_users_30d AS "👤 Новых 30д",
+    jobs.total AS "📹 Всего jobs",
+    jobs.completed AS "✅ Успех jobs",
+    ROUND(100.0 * jobs.completed / NULLIF(jobs.completed + jobs.failed, 0), 1) AS "✅ Success Rate, %",
+    ROUND(100.0 * jobs.failed / NULLIF(jobs.completed + jobs.failed, 0), 1) AS "❌ Failed Rate, %",
+    ROUND((speed.p50_total / 60)::NUMERIC, 1) AS "⚡ p50 время, мин (7д)",
+    ROUND(jobs.last_24h / 24.0, 1) AS "📊 Jobs/ч (24ч)",
+    money.revenue_30d AS "💰 Выручка 30д, ₽"
+FROM jobs, money, speed;
+
+-- -----------------------------------
+-- Карточка 1: Пользователи
+-- -----------------------------------
+SELECT
+    SUM(new_users) FILTER (WHERE day = CURRENT_DATE) AS "Сегодня",
+    SUM(new_users) FILTER (WHERE day >= CURRENT_DATE - 7) AS "7д",
+    SUM(new_users) FILTER (WHERE day >= CURRENT_DATE - 30) AS "30д",
+    SUM(new_users) AS "Всего"
+FROM rollup_money_daily;
+
+-- -----------------------------------
+-- Карточка 2: Генерации по шаблонам
+-- -----------------------------------
+SELECT
+    template_id AS "Шаблон",
+    SUM(jobs) FILTER (WHERE day >= CURRENT_DATE - 1) AS "24ч",
+    SUM(jobs) FILTER (WHERE day >= CURRENT_DATE - 7) AS "7д",
+    SUM(jobs) FILTER (WHERE day >= CURRENT_DATE - 30) AS "30д"
+FROM rollup_jobs_daily
+GROUP BY template_id
+ORDER BY "30д" DESC NULLS LAST;
+
+-- -----------------------------------
+-- Карточка 3: Качество (success rate по шаблону и модели, 7д)
+-- -----------------------------------
+SELECT
+    template_id AS "Шаблон",
+    model AS "Модель",
+    SUM(jobs) FILTER (WHERE status = 'completed') AS "Успех",
+    SUM(jobs) FILTER (WHERE status = 'failed') AS "Ошибки",
+    ROUND(100.0 * SUM(jobs) FILTER (WHERE status = 'completed')
+        / NULLIF(SUM(jobs) FILTER (WHERE status IN ('completed', 'failed')), 0), 1) AS "Success Rate, %",
+    SUM(refunded) AS "Возвратов"
+FROM rollup_jobs_daily
+WHERE day >= CURRENT_DATE - 7
+GROUP BY template_id, model
+ORDER BY "Успех" DESC NULLS LAST;
+
+-- -----------------------------------
+-- Карточка 4: Финансы и кредиты
+-- -----------------------------------
+SELECT
+    period AS "Период",
+    SUM(revenue_rub) AS "Выручка, ₽",
+    SUM(payments) AS "Платежей",
+    SUM(credits_purchased) AS "Куплено кредитов",
+    SUM(credits_bonus) AS "Бонусных кредитов",
+    SUM(credits_refunded) AS "Возвращено кредитов"
+FROM rollup_money_daily m
+JOIN (VALUES ('7д', 7), ('30д', 30)) AS p(period, days) ON m.day >= CURRENT_DATE - p.days
+GROUP BY period, days
+ORDER BY days;
+
+-- -----------------------------------
+-- Карточка 5: Воронка (30д)
+-- -----------------------------------
+SELECT
+    (SELECT SUM(new_users) FROM rollup_money_daily WHERE day >= CURRENT_DATE - 30) AS "Регистрации",
+    (SELECT SUM(jobs) FROM rollup_jobs_daily WHERE day >= CURRENT_DATE - 30) AS "Генерации",
+    (SELECT SUM(jobs) FROM rollup_jobs_daily WHERE day >= CURRENT_DATE - 30 AND status = 'completed') AS "Готовые видео",
+    (SELECT SUM(paying_users) FROM rollup_money_daily WHERE day >= CURRENT_DATE - 30) AS "Оплаты (пользователи по дням)";
+
+-- -----------------------------------
+-- Карточка 6: Скорость этапов (7д, медиана и p90, взвешенные по дням)
+-- -----------------------------------
+SELECT
+    stage AS "Этап",
+    SUM(samples) AS "Job'ов",
+    ROUND((SUM(p50 * samples) / NULLIF(SUM(samples), 0))::NUMERIC, 1) AS "p50, с",
+    ROUND(MAX(p90)::NUMERIC, 1) AS "p90 (худший день), с"
+FROM rollup_durations_daily
+WHERE day >= CURRENT_DATE - 7
+GROUP BY stage
+ORDER BY stage;
+
+-- -----------------------------------
+-- Карточка 7: Нагрузка по часам (48ч)
+-- -----------------------------------
+SELECT
+    bucket AS "Час",
+    SUM(jobs) AS "Создано",
+    SUM(jobs) FILTER (WHERE status = 'completed') AS "Успех",
+    SUM(jobs) FILTER (WHERE status = 'failed') AS "Ошибки"
+FROM rollup_jobs_hourly
+WHERE bucket >= NOW() - INTERVAL '48 hours'
+GROUP BY bucket
+ORDER BY bucket;
+
+-- -----------------------------------
+-- Карточка 8: Ошибки по классам (7д, доля от завершённых)
+-- -----------------------------------
+WITH week AS (
+    SELECT * FROM rollup_jobs_daily WHERE day >= CURRENT_DATE - 7
+)
+SELECT
+    failure_class AS "Класс ошибки",
+    SUM(jobs) AS "Ошибок",
+    ROUND(100.0 * SUM(jobs) / NULLIF(
+        (SELECT SUM(jobs) FROM week WHERE status IN ('completed', 'failed')), 0), 2) AS "% от завершённых"
+FROM week
+WHERE status = 'failed'
+GROUP BY failure_class
+ORDER BY "Ошибок" DESC;
+
+-- -----------------------------------
+-- График 1: Генерации по дням
+-- -----------------------------------
+SELECT
+    day AS "День",
+    SUM(jobs) AS "Всего",
+    SUM(jobs) FILTER (WHERE status = 'completed') AS "Успех",
+    SUM(jobs) FILTER (WHERE status = 'failed') AS "Ошибки"
+FROM rollup_jobs_daily
+WHERE day >= CURRENT_DATE - 30
+GROUP BY day
+ORDER BY day;
+
+-- -----------------------------------
+-- График 2: Регистрации по дням
+-- -----------------------------------
+SELECT day AS "День", new_users AS "Регистрации"
+FROM rollup_money_daily
+WHERE day >= CURRENT_DATE - 30
+ORDER BY day;
+
+-- -----------------------------------
+-- График 3: Success Rate по дням
+-- -----------------------------------
+SELECT
+    day AS "День",
+    ROUND(100.0 * SUM(jobs) FILTER (WHERE status = 'completed')
+        / NULLIF(SUM(jobs) FILTER (WHERE status IN ('completed', 'failed')), 0), 1) AS "Success Rate, %"
+FROM rollup_jobs_daily
+WHERE day >= CURRENT_DATE - 30
+GROUP BY day
+ORDER BY day;
@@ -0,0 +1,5 @@
+#!/bin/sh
+# Разрешает streaming репликацию для read-реплики (docker compose --profile replica).
+# wal_level=replica и max_wal_senders в Postgres 15 уже по умолчанию.
+set -e
+echo "host replication ${POSTGRES_USER} all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Перенос завершённых job'ов в jobs_archive (database/jobs_archive.sql)
+
+jobs остаётся маленьким горячим набором для claim'а воркеров; история
+пользователя и rollup'ы читают jobs_all. Запускается по расписанию
+(systemd/neurocards-archive.timer, раз в сутки), переносит пачками —
+каждая пачка отдельной транзакцией, блокировки короткие.
+
+Использование:
+    python scripts/archive_jobs.py               # старше JOBS_ARCHIVE_DAYS (30) дней
+    python scripts/archive_jobs.py --days 7 --batch 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.db_adapter import get_pool, close_db_pool
+
+
+async def archive(days: float, batch: int) -> int:
+    pool = await get_pool()
+    total = 0
+    while True:
+        async with pool.acquire() as conn:
+            moved = await conn.fetchval(
+                "SELECT archive_finished_jobs($1, $2)",
+                timedelta(days=days), batch, timeout=600
+            )
+        total += moved
+        if moved:
+            print(f"📦 Archived {moved} jobs (total {total})")
+        if moved < batch:
+            return total
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Перенос завершённых job'ов в архив")
+    parser.add_argument(
+        "--days", type=float, default=float(os.getenv("JOBS_ARCHIVE_DAYS", "30")),
+        help="Архивировать завершённые раньше N дней назад"
+    )
+    parser.add_argument(
+        "--batch", type=int, default=int(os.getenv("JOBS_ARCHIVE_BATCH", "1000")),
+        help="Job'ов за одну транзакцию"
+    )
+    args = parser.parse_args()
+
+    try:
+        started = time.monotonic()
+        total = await archive(args.days, args.batch)
+        print(f"✅ Archive done in {time.monotonic() - started:.1f}s: {total} jobs older than {args.days:g} days")
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
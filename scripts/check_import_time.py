@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бюджет времени импорта точек входа (python -X importtime)
+
+Холодный старт воркера и бота важен для автоскейлера и перезапусков systemd:
+тяжёлые зависимости (aiogram, httpx, asyncpg, prometheus_client) импортируются
+в main() или при первом использовании, а не при импорте модуля. Боту aiogram,
+aiohttp и prometheus_client (/metrics) нужны сразу, но rq/httpx и код воркера
+тянуть он не должен; адаптер БД берёт app.metrics только при первой метрике. Скрипт
+импортирует каждый модуль в чистом процессе без BOT_TOKEN/DATABASE_URL
+(импорт не должен падать без env — проверка конфига в validate_config) и
+падает с кодом 1, если превышен бюджет или подтянулся запрещённый модуль.
+
+Использование:
+    python scripts/check_import_time.py                       # бюджеты по умолчанию
+    python scripts/check_import_time.py --module worker.worker --budget-ms 200
+    python scripts/check_import_time.py --top 20              # самые тяжёлые импорты
+    IMPORT_BUDGET_SCALE=2 python scripts/check_import_time.py # медленная машина CI
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+ROOT = Path(__file__).parent.parent
+
+# Бюджет кумулятивного времени импорта, мс
+BUDGETS_MS: Dict[str, float] = {
+    "worker.worker": 250,
+    "app.config": 150,
+    "app.db_adapter": 200,
+    "app.main": 600,
+}
+
+# Что не должно импортироваться вместе с модулем (только внутри main()/функций)
+FORBIDDEN: Dict[str, Tuple[str, ...]] = {
+    "worker.worker": ("aiogram", "httpx", "asyncpg", "prometheus_client", "app.db_adapter"),
+    "app.config": ("aiogram", "httpx", "asyncpg", "prometheus_client"),
+    "app.db_adapter": ("aiogram", "httpx", "prometheus_client", "app.metrics"),
+    "app.main": ("rq", "httpx", "worker"),
+}
+
+# Без них импорт обязан проходить: проверка — только в validate_config()
+STRIPPED_ENV = ("BOT_TOKEN", "DATABASE_URL", "DATABASE_DIRECT_URL", "KIE_API_KEY", "KIE_API_KEY_1")
+
+
+class ImportEntry(NamedTuple):
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportEntry]:
+    """Строки вида 'import time:   self [us] | cumulative | imported package'"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # заголовок таблицы
+        raw_name = parts[2].rstrip()
+        name = raw_name.lstrip()
+        depth = (len(raw_name) - len(name) - 1) // 2
+        entries.append(ImportEntry(name, int(parts[0]), int(parts[1]), depth))
+    return entries
+
+
+def cumulative_ms(entries: List[ImportEntry], module: str) -> float:
+    for entry in reversed(entries):
+        if entry.name == module:
+            return entry.cumulative_us / 1000
+    return 0.0
+
+
+def forbidden_imports(entries: List[ImportEntry], forbidden: Tuple[str, ...]) -> List[str]:
+    return sorted({
+        e.name for e in entries
+        if any(e.name == f or e.name.startswith(f + ".") for f in forbidden)
+    })
+
+
+def measure(module: str) -> List[ImportEntry]:
+    env = {k: v for k, v in os.environ.items() if k not in STRIPPED_ENV}
+    env["PYTHONPATH"] = str(ROOT) + os.pathsep + env.get("PYTHONPATH", "")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(ROOT), env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {module} failed:\n" + "\n".join(tail[-15:]))
+    return parse_importtime(proc.stderr)
+
+
+def check(module: str, budget_ms: float, top: int) -> bool:
+    try:
+        entries = measure(module)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return False
+
+    total = cumulative_ms(entries, module)
+    bad = forbidden_imports(entries, FORBIDDEN.get(module, ()))
+    ok = total <= budget_ms and not bad
+    print(f"{'✅' if ok else '❌'} {module}: {total:.1f} ms (budget {budget_ms:.0f} ms)")
+    for name in bad:
+        print(f"   ⛔ eager import: {name}")
+    if not ok or top:
+        heaviest = sorted(entries, key=lambda e: e.self_us, reverse=True)[:top or 10]
+        for e in heaviest:
+            print(f"   {e.self_us / 1000:8.1f} ms self {e.cumulative_us / 1000:8.1f} ms cum  {e.name}")
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", action="append", help="модуль (можно несколько), по умолчанию все из BUDGETS_MS")
+    parser.add_argument("--budget-ms", type=float, help="бюджет для всех --module")
+    parser.add_argument("--top", type=int, default=0, help="показать N самых тяжёлых импортов")
+    args = parser.parse_args()
+
+    scale = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+    modules = args.module or list(BUDGETS_MS)
+    results = [
+        check(m, (args.budget_ms or BUDGETS_MS.get(m, 250)) * scale, args.top)
+        for m in modules
+    ]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
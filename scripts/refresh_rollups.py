@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Инкрементальный пересчёт rollup таблиц аналитики (database/analytics_rollups.sql)
+
+Metabase читает только rollup_*; этот скрипт запускается по расписанию
+(systemd/neurocards-rollups.timer, раз в 10 минут) и пересчитывает
+только часы/дни, затронутые с прошлого запуска.
+
+Использование:
+    python scripts/refresh_rollups.py            # инкрементально
+    python scripts/refresh_rollups.py --full     # пересчитать всё
+    python scripts/refresh_rollups.py --loop 600 # без systemd: в цикле раз в N секунд
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.db_adapter import get_pool, close_db_pool
+
+
+async def refresh(full: bool) -> dict:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        # Полный пересчёт на большой базе дольше command_timeout пула
+        result = await conn.fetchval("SELECT refresh_rollups($1)", full, timeout=1800)
+    return json.loads(result) if isinstance(result, str) else result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пересчёт rollup таблиц для Metabase")
+    parser.add_argument("--full", action="store_true", help="Пересчитать все часы и дни")
+    parser.add_argument("--loop", type=float, default=0, help="Повторять каждые N секунд")
+    args = parser.parse_args()
+
+    try:
+        full = args.full
+        while True:
+            started = time.monotonic()
+            stats = await refresh(full)
+            elapsed = time.monotonic() - started
+            if stats.get("skipped"):
+                print("⏭️ Another refresh is running, skipped")
+            else:
+                print(
+                    f"✅ Rollups refreshed in {elapsed:.1f}s: "
+                    f"{stats['hours']} hours, {stats['duration_days']} duration days, "
+                    f"{stats['money_days']} money days{' (full)' if stats['full'] else ''}"
+                )
+            if not args.loop:
+                break
+            full = False
+            await asyncio.sleep(args.loop)
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
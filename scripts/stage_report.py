@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Перцентили длительностей этапов job'ов из jobs.timeline (database/job_timeline.sql)
+
+Использование:
+    python scripts/stage_report.py                 # последние 24 часа
+    python scripts/stage_report.py --hours 6
+    python scripts/stage_report.py --since 2026-10-01 --until 2026-10-08
+    python scripts/stage_report.py --job <job_id>  # таймлайн одного job'а
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.db_adapter import get_pool, close_db_pool
+
+
+def parse_ts(value: str) -> datetime:
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+async def print_percentiles(since: datetime, until: datetime):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM job_stage_percentiles($1, $2)", since, until)
+
+    print(f"📊 Stage percentiles, jobs created {since.isoformat()} — {until.isoformat()}\n")
+    if not rows:
+        print("Нет данных (jobs.timeline пуст в этом окне)")
+        return
+
+    header = f"{'stage':<12}{'events':>8}{'jobs':>8}{'p50, s':>10}{'p90, s':>10}{'p99, s':>10}{'max, s':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['stage']:<12}{r['events']:>8}{r['jobs']:>8}"
+            f"{r['p50']:>10.1f}{r['p90']:>10.1f}{r['p99']:>10.1f}{r['max']:>10.1f}"
+        )
+
+
+async def print_job_timeline(job_id: str):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT status, created_at, started_at, finished_at, timeline FROM jobs_all WHERE id = $1",
+            job_id
+        )
+
+    if not row:
+        print(f"❌ Job {job_id} not found")
+        return
+
+    print(f"📋 Job {job_id}: {row['status']}")
+    print(f"   created:  {row['created_at']}")
+    print(f"   started:  {row['started_at']}")
+    print(f"   finished: {row['finished_at']}\n")
+
+    timeline = row["timeline"] or []
+    if isinstance(timeline, str):
+        timeline = json.loads(timeline)
+    for event in sorted(timeline, key=lambda e: e.get("at", 0)):
+        at = datetime.fromtimestamp(event.get("at", 0), tz=timezone.utc).strftime("%H:%M:%S")
+        print(f"   {at}  #{event.get('attempt', 1)}  {event.get('stage', '?'):<12}{event.get('dur', 0):>9.1f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Перцентили этапов обработки job'ов")
+    parser.add_argument("--hours", type=float, default=24, help="Окно в часах (по умолчанию 24)")
+    parser.add_argument("--since", help="Начало окна, ISO (перекрывает --hours)")
+    parser.add_argument("--until", help="Конец окна, ISO (по умолчанию сейчас)")
+    parser.add_argument("--job", help="Показать таймлайн одного job'а")
+    args = parser.parse_args()
+
+    try:
+        if args.job:
+            await print_job_timeline(args.job)
+        else:
+            until = parse_ts(args.until) if args.until else datetime.now(timezone.utc)
+            since = parse_ts(args.since) if args.since else until - timedelta(hours=args.hours)
+            await print_percentiles(since, until)
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
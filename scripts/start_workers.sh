@@ -8,7 +8,8 @@ echo "🚀 Starting $WORKER_COUNT RQ workers..."
 
 # Запускаем воркеры в фоне
 for i in $(seq 1 $WORKER_COUNT); do
-    rq worker neurocards --url "$REDIS_URL" --burst --name "worker-$i" &
+    # RuntimeWorker: один event loop / пул БД / сессия Bot на процесс
+    rq worker neurocards -w worker.rq_worker.RuntimeWorker --url "$REDIS_URL" --burst --name "worker-$i" &
     echo "✅ Worker $i started (PID: $!)"
 done
 
@@ -36,6 +36,12 @@ CREATE TABLE IF NOT EXISTS public.jobs (
     product_image_url TEXT,
     product_text TEXT,
     extra_wishes TEXT,
+    -- Параметры генерации (database/job_metadata.sql): шаблон, тип, свой промпт,
+    -- полный product_info от бота
+    template_id TEXT,
+    kind TEXT,
+    user_prompt TEXT,
+    product_info JSONB,
 
     -- Idempotency key to avoid duplicate jobs
     idempotency_key TEXT UNIQUE,
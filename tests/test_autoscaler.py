@@ -0,0 +1,46 @@
+from worker.autoscaler import QueueSnapshot, ScaleConfig, desired_workers, plan_change
+
+
+def config(**overrides) -> ScaleConfig:
+    values = dict(
+        min_workers=1, max_workers=20, queue_per_worker=2, max_wait_seconds=300,
+        up_step=4, down_step=1, up_cooldown=60, down_cooldown=600, jobs_per_kie_key=0,
+    )
+    values.update(overrides)
+    return ScaleConfig(**values)
+
+
+def test_desired_follows_queue_depth():
+    snap = QueueSnapshot(queued=5, processing=3, oldest_wait=10)
+    assert desired_workers(snap, current=3, cfg=config()) == 3 + 3
+
+
+def test_desired_respects_bounds():
+    idle = QueueSnapshot(queued=0, processing=0, oldest_wait=0)
+    assert desired_workers(idle, current=5, cfg=config(min_workers=2)) == 2
+
+    flood = QueueSnapshot(queued=500, processing=20, oldest_wait=10)
+    assert desired_workers(flood, current=20, cfg=config()) == 20
+
+
+def test_old_job_forces_step_up():
+    snap = QueueSnapshot(queued=1, processing=4, oldest_wait=600)
+    assert desired_workers(snap, current=4, cfg=config()) == 8
+
+
+def test_kie_capacity_caps_workers():
+    flood = QueueSnapshot(queued=100, processing=0, oldest_wait=0)
+    assert desired_workers(flood, current=1, cfg=config(jobs_per_kie_key=3), kie_keys=2) == 6
+    # Все ключи заблокированы — только min_workers; ключи неизвестны — без лимита
+    assert desired_workers(flood, current=6, cfg=config(jobs_per_kie_key=3, min_workers=1), kie_keys=0) == 1
+    assert desired_workers(flood, current=1, cfg=config(jobs_per_kie_key=3), kie_keys=None) == 20
+
+
+def test_plan_change_cooldowns():
+    cfg = config()
+    # Рост ограничен шагом и cool-down
+    assert plan_change(10, 2, now=100, last_up=0, last_change=0, cfg=cfg) == 4
+    assert plan_change(10, 6, now=100, last_up=90, last_change=90, cfg=cfg) == 0
+    # Сокращение — по одному и только после down_cooldown с последнего изменения
+    assert plan_change(2, 6, now=1000, last_up=0, last_change=500, cfg=cfg) == 0
+    assert plan_change(2, 6, now=1200, last_up=0, last_change=500, cfg=cfg) == -1
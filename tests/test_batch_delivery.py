@@ -0,0 +1,53 @@
+import pytest
+
+from worker.batch_delivery import send_batch, summary_text
+
+
+def rows(count, completed=None, failed=0, total=None, file_id=True):
+    completed = count if completed is None else completed
+    total = completed + failed if total is None else total
+    return [
+        {
+            "batch_id": "b1", "job_id": f"job-{i}", "tg_user_id": 42, "kind": "reels",
+            "video_url": f"https://kie/{i}.mp4", "video_file_id": f"file-{i}" if file_id else None,
+            "completed": completed, "failed": failed, "total": total,
+        }
+        for i in range(count)
+    ]
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.calls.append(("media_group", chat_id, [m.media for m in media]))
+
+    async def send_video(self, chat_id, video, **kwargs):
+        self.calls.append(("video", chat_id, video))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(("message", chat_id, kwargs["reply_markup"].inline_keyboard[0][0].callback_data))
+
+
+def test_summary_reports_failed_and_pending():
+    text = summary_text(rows(2, failed=1, total=5))
+    assert "2 из 5" in text
+    assert "Не получилось: 1" in text
+    assert "Ещё в работе: 2" in text
+
+
+def test_summary_links_videos_without_file_id():
+    text = summary_text(rows(1, file_id=False))
+    assert "https://kie/0.mp4" in text
+    assert "альбоме" not in text
+
+
+@pytest.mark.asyncio
+async def test_batch_goes_out_as_one_album_and_one_message():
+    bot = FakeBot()
+    await send_batch(bot, rows(3))
+    assert bot.calls == [
+        ("media_group", 42, ["file-0", "file-1", "file-2"]),
+        ("message", 42, "retry:job-0"),
+    ]
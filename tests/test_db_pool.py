@@ -0,0 +1,137 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app import db_adapter
+from app.db_pool import BudgetConfig, MeteredPool, direct_database_url, init_connection, pool_options, pool_size
+
+
+def budget(**overrides) -> BudgetConfig:
+    values = dict(
+        budget=80, reserved=10, bot_processes=2, worker_processes=20,
+        worker_pool_max=2, worker_listens=True, bot_pool_cap=64, script_pool_max=2,
+    )
+    values.update(overrides)
+    return BudgetConfig(**values)
+
+
+def test_bot_gets_what_workers_leave():
+    # 80 - 10 - 20 × (2 + LISTEN) = 10 на два процесса бота
+    assert pool_size("bot", budget()) == (2, 5)
+    assert pool_size("bot", budget(worker_listens=False)) == (2, 15)
+    assert pool_size("bot", budget(worker_processes=1, bot_pool_cap=16)) == (2, 16)
+
+
+def test_overcommitted_budget_keeps_minimal_pool():
+    assert pool_size("bot", budget(worker_processes=40)) == (2, 2)
+
+
+def test_worker_and_script_pools_are_small():
+    assert pool_size("worker", budget()) == (1, 2)
+    assert pool_size("script", budget()) == (1, 2)
+
+
+def test_listen_bypasses_pgbouncer(monkeypatch):
+    monkeypatch.setenv("DB_PGBOUNCER", "true")
+    monkeypatch.setenv("DATABASE_DIRECT_URL", "")
+    with pytest.raises(RuntimeError):
+        direct_database_url()
+    monkeypatch.setenv("DATABASE_DIRECT_URL", "postgresql://db:5432/neurocards")
+    assert direct_database_url() == "postgresql://db:5432/neurocards"
+
+
+class FakePool:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+
+    def acquire(self, timeout=None):
+        @asynccontextmanager
+        async def ctx():
+            async with self.lock:
+                yield "conn"
+        return ctx()
+
+
+@pytest.mark.asyncio
+async def test_metered_pool_counts_waiters():
+    pool = MeteredPool(FakePool(), "bot")
+    async with pool.acquire() as conn:
+        assert conn == "conn"
+        waiter = asyncio.create_task(pool.acquire().__aenter__())
+        await asyncio.sleep(0.01)
+        assert pool.waiting == 1
+    await waiter
+    assert pool.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_json_codecs_registered_on_every_connection():
+    codecs = {}
+
+    class FakeConnection:
+        async def set_type_codec(self, name, *, encoder, decoder, schema, format):
+            codecs[name] = (encoder, decoder, schema, format)
+
+    assert pool_options("worker")["init"] is init_connection
+    await init_connection(FakeConnection())
+
+    assert set(codecs) == {"json", "jsonb"}
+    encoder, decoder, schema, fmt = codecs["jsonb"]
+    assert (schema, fmt) == ("pg_catalog", "text")
+    value = {"text": "Кружка", "user_prompt": None, "sizes": [1, 2]}
+    assert decoder(encoder(value)) == value
+
+
+class FakeListenConn:
+    def __init__(self):
+        self.closed = False
+        self.listeners = {}
+        self.on_terminate = None
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback):
+        self.on_terminate = callback
+
+    def is_closed(self):
+        return self.closed
+
+    def terminate(self):
+        self.closed = True
+        self.on_terminate(self)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_after_connection_loss(monkeypatch):
+    conns = []
+    failures = [OSError("connection refused")]
+
+    async def connect(dsn):
+        if len(conns) == 1 and failures:
+            raise failures.pop()
+        conns.append(FakeListenConn())
+        return conns[-1]
+
+    monkeypatch.setattr(db_adapter.asyncpg, "connect", connect, raising=False)
+    monkeypatch.setattr(db_adapter, "direct_database_url", lambda: "postgresql://db/neurocards")
+    monkeypatch.setattr(db_adapter, "LISTEN_RECONNECT_MIN", 0.0)
+    payloads, reconnects = [], []
+
+    listener = await db_adapter.listen("kie_task_done", payloads.append, on_reconnect=lambda: reconnects.append(1))
+    assert not listener.is_closed()
+
+    conns[0].terminate()
+    assert listener.is_closed()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert not listener.is_closed() and len(conns) == 2 and reconnects == [1]
+
+    conns[1].listeners["kie_task_done"](conns[1], 1, "kie_task_done", "task-1")
+    assert payloads == ["task-1"]
+    await listener.close()
+    assert conns[1].closed
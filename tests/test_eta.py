@@ -0,0 +1,59 @@
+
+import pytest
+from app.services.eta import (
+    estimate_wait_seconds,
+    estimate_eta,
+    format_eta,
+    service_seconds,
+    DEFAULT_SERVICE_SECONDS,
+    DEFAULT_ETA_TEXT,
+)
+
+
+def test_no_wait_when_free_worker():
+    assert estimate_wait_seconds(ahead=0, in_flight=1, capacity=3, service=300) == 0
+
+
+def test_wait_grows_with_queue():
+    # 4 воркера заняты, перед нами 3 job'а: нужно 4 освобождения слота
+    assert estimate_wait_seconds(ahead=3, in_flight=4, capacity=4, service=400) == pytest.approx(400)
+
+
+def test_eta_subtracts_elapsed_for_processing_job():
+    low, high = estimate_eta(0, 0, 1, (300.0, 600.0), elapsed=240.0)
+    assert low == pytest.approx(60.0)
+    assert high == pytest.approx(360.0)
+
+
+def test_service_seconds_fallbacks():
+    quantiles = [
+        {"template_id": "ugc", "model": "sora", "stage": "total", "p50": 200.0, "p90": 500.0, "samples": 10},
+        {"template_id": "ad", "model": "sora", "stage": "total", "p50": 100.0, "p90": 300.0, "samples": 2},
+    ]
+    assert service_seconds(quantiles, "ugc", "sora") == (200.0, 500.0)
+    # Мало данных по шаблону "ad" — берём общую статистику
+    assert service_seconds(quantiles, "ad", "sora") == (200.0, 500.0)
+    assert service_seconds([], "ugc") == DEFAULT_SERVICE_SECONDS
+
+
+def test_format_eta():
+    assert format_eta(None) == DEFAULT_ETA_TEXT
+    assert format_eta((300.0, 720.0)) == "от <b>5 до 12 минут</b>"
+    assert format_eta((1200.0, 1260.0)) == "от <b>20 до 21 минуты</b>"
+    assert format_eta((420.0, 420.0)) == "около <b>7 минут</b>"
+
+
+@pytest.mark.asyncio
+async def test_worker_capacity_follows_autoscaler(monkeypatch):
+    from app.services import eta
+
+    running = [6]
+    monkeypatch.setattr(eta, "_autoscaler_running", lambda: running[0])
+    monkeypatch.setattr(eta, "_capacity_cache", {"ts": float("-inf"), "value": eta.WORKER_CAPACITY})
+    monkeypatch.setattr(eta, "CAPACITY_TTL_SECONDS", 0)
+    assert await eta.worker_capacity() == 6
+
+    # Автоскейлер не запущен — статическая WORKER_CAPACITY
+    running[0] = None
+    monkeypatch.setattr(eta, "WORKER_CAPACITY", 2)
+    assert await eta.worker_capacity() == 2
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import gallery
+
+
+class FakeBot:
+    def __init__(self, fail_urls=False):
+        self.sent = []
+        self.fail_urls = fail_urls
+
+    async def send_video(self, chat_id, video, **kwargs):
+        if self.fail_urls and isinstance(video, str) and video.startswith("http"):
+            raise RuntimeError("wrong file identifier/HTTP URL specified")
+        self.sent.append(video)
+        return SimpleNamespace(video=SimpleNamespace(file_id="new-file-id"))
+
+
+@pytest.fixture
+def job_store(monkeypatch):
+    jobs = {}
+    updates = []
+
+    async def get_job_by_id(job_id):
+        return jobs.get(job_id)
+
+    async def update_job(job_id, values):
+        updates.append((job_id, values))
+
+    monkeypatch.setattr(gallery, "get_job_by_id", get_job_by_id)
+    monkeypatch.setattr(gallery, "update_job", update_job)
+    return jobs, updates
+
+
+def completed(tg_user_id=1, **fields):
+    return {"tg_user_id": tg_user_id, "status": "completed", "video_file_id": None, "video_url": None, **fields}
+
+
+@pytest.mark.asyncio
+async def test_resend_uses_stored_file_id(job_store):
+    jobs, updates = job_store
+    jobs["j1"] = completed(video_file_id="cached", video_url="https://kie/1.mp4")
+    bot = FakeBot()
+
+    assert await gallery.resend_video(bot, 1, "j1")
+    assert bot.sent == ["cached"]
+    assert updates == []
+
+
+@pytest.mark.asyncio
+async def test_resend_falls_back_to_url_then_local_file(job_store, tmp_path, monkeypatch):
+    jobs, updates = job_store
+    jobs["j2"] = completed(video_url="https://kie/expired.mp4")
+    (tmp_path / "outputs").mkdir()
+    (tmp_path / "outputs" / "j2.mp4").write_bytes(b"mp4")
+    monkeypatch.setattr(gallery, "STORAGE_BASE_PATH", str(tmp_path))
+    bot = FakeBot(fail_urls=True)
+
+    assert await gallery.resend_video(bot, 1, "j2")
+    assert len(bot.sent) == 1 and not isinstance(bot.sent[0], str)
+    assert updates == [("j2", {"video_file_id": "new-file-id"})]
+
+
+@pytest.mark.asyncio
+async def test_resend_refuses_foreign_or_unfinished_jobs(job_store):
+    jobs, _ = job_store
+    jobs["mine"] = completed(tg_user_id=2, video_file_id="f")
+    jobs["running"] = {**completed(video_file_id="f"), "status": "processing"}
+    bot = FakeBot()
+
+    assert not await gallery.resend_video(bot, 1, "mine")
+    assert not await gallery.resend_video(bot, 1, "running")
+    assert not await gallery.resend_video(bot, 1, "missing")
+    assert bot.sent == []
+
+
+@pytest.mark.asyncio
+async def test_gallery_pages_are_cached(monkeypatch):
+    calls = []
+
+    async def list_last_jobs(tg_user_id, limit, offset, completed_only):
+        calls.append((limit, offset, completed_only))
+        return [{"id": f"j{i}"} for i in range(offset, min(offset + limit, 7))]
+
+    monkeypatch.setattr(gallery, "list_last_jobs", list_last_jobs)
+    monkeypatch.setattr(gallery, "_pages_cache", {})
+
+    items, has_next = await gallery.get_gallery_page(1, 0)
+    assert [j["id"] for j in items] == ["j0", "j1", "j2", "j3", "j4"] and has_next
+    items, has_next = await gallery.get_gallery_page(1, 1)
+    assert [j["id"] for j in items] == ["j5", "j6"] and not has_next
+
+    await gallery.get_gallery_page(1, 0)
+    assert calls == [(6, 0, True), (6, 5, True)]
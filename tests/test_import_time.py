@@ -0,0 +1,52 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).parent.parent / "scripts" / "check_import_time.py"
+spec = importlib.util.spec_from_file_location("check_import_time", SCRIPT)
+check_import_time = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(check_import_time)
+
+SAMPLE = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        900 |   json
+import time:       150 |        150 |     json.decoder
+import time:      4000 |      52000 | worker.worker
+import time:      2100 |      30000 |   httpx
+import time:       800 |        800 |     httpx._models
+"""
+
+
+def test_parse_importtime_and_forbidden_modules():
+    entries = check_import_time.parse_importtime(SAMPLE)
+    assert [e.name for e in entries] == ["_io", "json", "json.decoder", "worker.worker", "httpx", "httpx._models"]
+    assert entries[2].depth == 2
+    assert check_import_time.cumulative_ms(entries, "worker.worker") == 52.0
+    assert check_import_time.forbidden_imports(entries, ("httpx", "aiogram")) == ["httpx", "httpx._models"]
+
+
+def test_worker_import_without_env_and_heavy_deps():
+    pytest.importorskip("dotenv")
+    entries = check_import_time.measure("worker.worker")
+    assert not check_import_time.forbidden_imports(entries, check_import_time.FORBIDDEN["worker.worker"])
+
+
+def test_db_adapter_import_defers_metrics():
+    pytest.importorskip("dotenv")
+    pytest.importorskip("asyncpg")
+    entries = check_import_time.measure("app.db_adapter")
+    assert not check_import_time.forbidden_imports(entries, check_import_time.FORBIDDEN["app.db_adapter"])
+
+
+def test_validate_config_reports_all_missing_vars(monkeypatch):
+    pytest.importorskip("dotenv")
+    from app import config
+
+    for name in ("BOT_TOKEN", "DATABASE_URL", "KIE_API_KEY", "KIE_API_KEY_1"):
+        monkeypatch.delenv(name, raising=False)
+    with pytest.raises(config.ConfigError) as exc:
+        config.validate_config("worker")
+    message = str(exc.value)
+    assert "BOT_TOKEN" in message and "DATABASE_URL" in message and "KIE_API_KEY" in message
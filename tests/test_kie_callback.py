@@ -0,0 +1,77 @@
+import pytest
+
+from app import kie_callback
+from app.kie_callback import handle_kie_callback, parse_callback
+
+
+class FakeRequest:
+    """Минимум aiohttp Request, который читает handle_kie_callback"""
+
+    def __init__(self, payload, token="secret"):
+        self.query = {"token": token}
+        self.remote = "127.0.0.1"
+        self._payload = payload
+
+    async def json(self):
+        if isinstance(self._payload, Exception):
+            raise self._payload
+        return self._payload
+
+
+def callback(task_id="t1", state="success"):
+    return {"code": 200, "msg": "success", "data": {"taskId": task_id, "state": state}}
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """record_kie_callback как в SQL: job id на первый callback задачи, дальше None"""
+    calls = []
+
+    async def fake_record(task_id, state, payload):
+        calls.append((task_id, state))
+        return None if len(calls) > 1 else "job-1"
+
+    monkeypatch.setattr(kie_callback, "KIE_CALLBACK_TOKEN", "secret")
+    monkeypatch.setattr(kie_callback, "record_kie_callback", fake_record)
+    return calls
+
+
+def test_parse_callback():
+    assert parse_callback(callback("abc", "SUCCESS")) == ("abc", "success")
+    assert parse_callback({"data": {"taskId": "abc"}}) is None
+    assert parse_callback({"code": 200}) is None
+    assert parse_callback(["not", "a", "dict"]) is None
+
+
+@pytest.mark.asyncio
+async def test_bad_token_is_rejected(recorded):
+    resp = await handle_kie_callback(FakeRequest(callback(), token="wrong"))
+
+    assert resp.status == 401
+    assert recorded == []
+
+
+@pytest.mark.asyncio
+async def test_duplicate_callback_is_acknowledged_once(recorded):
+    first = await handle_kie_callback(FakeRequest(callback()))
+    second = await handle_kie_callback(FakeRequest(callback()))
+
+    # KIE получает 200 оба раза, иначе повторит доставку; записан только первый
+    assert first.status == 200 and second.status == 200
+    assert recorded == [("t1", "success"), ("t1", "success")]
+    assert b"duplicate" in second.body
+
+
+@pytest.mark.asyncio
+async def test_non_terminal_state_is_ignored(recorded):
+    resp = await handle_kie_callback(FakeRequest(callback(state="generating")))
+
+    assert resp.status == 200
+    assert recorded == []
+
+
+@pytest.mark.asyncio
+async def test_bad_payload(recorded):
+    resp = await handle_kie_callback(FakeRequest(ValueError("not json")))
+
+    assert resp.status == 400
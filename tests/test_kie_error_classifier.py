@@ -0,0 +1,35 @@
+import pytest
+
+from worker import kie_error_classifier
+from worker.kie_error_classifier import KieErrorType, classify_kie_error
+
+
+@pytest.mark.parametrize("info, expected", [
+    # Известные коды решают раньше текста
+    ({"data": {"state": "fail", "failCode": "501", "failMsg": "content policy violation"}}, KieErrorType.TEMPORARY),
+    ({"status_code": 200, "data": {"code": 402, "msg": "Insufficient credits"}}, KieErrorType.BILLING),
+    ({"status_code": 429, "error": "Client error '429 Too Many Requests'"}, KieErrorType.RATE_LIMIT),
+    ({"code": 455, "msg": "Service under maintenance", "data": None}, KieErrorType.TEMPORARY),
+    ({"error": "KIE HTTP error 503"}, KieErrorType.TEMPORARY),
+    # Подстроки больше не делают временную ошибку нарушением правил
+    ({"error": "Upstream returned empty content, please try again"}, KieErrorType.TEMPORARY),
+    ({"error": "human-readable: connection reset by peer"}, KieErrorType.TEMPORARY),
+    ({"error": "account service busy"}, KieErrorType.TEMPORARY),
+    ({"error": "request id 40312 failed"}, KieErrorType.UNKNOWN),
+    # Настоящие нарушения по-прежнему USER_VIOLATION
+    ({"data": {"state": "fail", "failMsg": "This content may violate our guardrails"}}, KieErrorType.USER_VIOLATION),
+    ({"data": {"state": "fail", "failMsg": "Image contains photorealistic people"}}, KieErrorType.USER_VIOLATION),
+    ({"status_code": 400, "data": {"msg": "Prompt rejected"}}, KieErrorType.USER_VIOLATION),
+    ({"status_code": 403, "error": "KIE HTTP error 403"}, KieErrorType.USER_VIOLATION),
+])
+def test_classify_kie_error(info, expected):
+    assert classify_kie_error(info)[0] == expected
+
+
+def test_classified_errors_are_counted(monkeypatch):
+    calls = []
+    monkeypatch.setattr(kie_error_classifier, "kie_error_classified", lambda *args: calls.append(args))
+    classify_kie_error({"status_code": 502})
+    classify_kie_error({"error": "Too many requests, slow down"})
+    classify_kie_error({})
+    assert calls == [("temporary", "http"), ("rate_limit", "pattern"), ("unknown", "none")]
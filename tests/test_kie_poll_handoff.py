@@ -0,0 +1,58 @@
+"""
+Прерывание poll KIE при остановке воркера (graceful drain с передачей job'а)
+"""
+import threading
+import time
+
+import pytest
+
+from worker import kie_client
+
+
+class _Response:
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"code": 200, "data": {"taskId": "t1", "state": "generating"}}
+
+
+class _Client:
+    """httpx.Client, на каждый recordInfo отвечающий "ещё генерируется" """
+
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def get(self, url, headers=None):
+        self.calls += 1
+        return _Response()
+
+
+@pytest.fixture
+def generating_kie(monkeypatch):
+    monkeypatch.setattr(kie_client.httpx, "Client", _Client)
+    monkeypatch.setattr(kie_client, "KIE_POLL_INTERVAL", "")
+
+
+def test_poll_interrupted_by_stop_event(generating_kie):
+    stop = threading.Event()
+    threading.Timer(0.2, stop.set).start()
+
+    started = time.monotonic()
+    with pytest.raises(kie_client.PollInterrupted):
+        kie_client.poll_record_info("t1", "key", timeout_sec=60, interval_sec=30, stop_event=stop)
+
+    # Ожидание между poll'ами прервано сразу, а не через interval_sec
+    assert time.monotonic() - started < 5
+
+
+def test_poll_without_stop_event_runs_to_timeout(generating_kie):
+    info = kie_client.poll_record_info("t1", "key", timeout_sec=0.3, interval_sec=0.1)
+
+    assert info["data"]["state"] == "generating"
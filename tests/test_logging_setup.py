@@ -0,0 +1,43 @@
+
+import logging
+from app.logging_setup import ContextFilter, SamplingFilter, log_context, set_log_context
+
+
+def make_record(msg="test", level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, msg, None, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_sampling_filter_passes_one_record_per_interval():
+    sampler = SamplingFilter(interval=60)
+    results = [sampler.filter(make_record(sample="kie_poll")) for _ in range(5)]
+    assert results == [True, False, False, False, False]
+    # Записи без ключа и предупреждения не семплируются
+    assert sampler.filter(make_record())
+    assert sampler.filter(make_record(level=logging.WARNING, sample="kie_poll"))
+
+
+def test_context_filter_adds_job_id_and_stage():
+    context_filter = ContextFilter()
+    with log_context(job_id="job-1", stage="kie"):
+        record = make_record()
+        context_filter.filter(record)
+    assert record.job_id == "job-1"
+    assert record.stage == "kie"
+
+    record = make_record()
+    context_filter.filter(record)
+    assert record.job_id is None
+
+
+def test_set_log_context_clears_stage():
+    context_filter = ContextFilter()
+    with log_context(job_id="job-2"):
+        set_log_context(stage="upload")
+        set_log_context(stage=None)
+        record = make_record()
+        context_filter.filter(record)
+    assert record.job_id == "job-2"
+    assert record.stage is None
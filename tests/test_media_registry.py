@@ -0,0 +1,93 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import media_registry
+
+
+class FakeBot:
+    def __init__(self):
+        self.uploads = []
+
+    async def send_video(self, chat_id, video, **kwargs):
+        self.uploads.append(video.path)
+        return SimpleNamespace(video=SimpleNamespace(file_id=f"vid-{len(self.uploads)}"))
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.uploads.append(photo.path)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="small"), SimpleNamespace(file_id="photo")])
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    store = {}
+
+    async def get_media_file_ids():
+        return dict(store)
+
+    async def save_media_file_id(sha256, path, kind, file_id):
+        store[sha256] = file_id
+
+    @asynccontextmanager
+    async def media_registry_lock():
+        yield
+
+    monkeypatch.setattr(media_registry, "get_media_file_ids", get_media_file_ids)
+    monkeypatch.setattr(media_registry, "save_media_file_id", save_media_file_id)
+    monkeypatch.setattr(media_registry, "media_registry_lock", media_registry_lock)
+    monkeypatch.setattr(media_registry, "SERVICE_CHANNEL_ID", -100)
+    monkeypatch.setattr(media_registry, "_file_ids", {})
+
+    (tmp_path / "menu.jpg").write_bytes(b"jpg")
+    (tmp_path / "welcome_1.mp4").write_bytes(b"one")
+    (tmp_path / "welcome_2.mp4").write_bytes(b"two")
+    (tmp_path / "notes.txt").write_text("skip")
+    return store, tmp_path
+
+
+@pytest.mark.asyncio
+async def test_assets_are_uploaded_once(registry, monkeypatch):
+    store, assets = registry
+    bot = FakeBot()
+
+    assert await media_registry.sync_assets(bot, str(assets)) == 3
+    assert len(store) == 3
+    assert media_registry.get_file_id(str(assets / "menu.jpg")) == "photo"
+    assert media_registry.welcome_video_ids(str(assets)) == ["vid-2", "vid-3"]
+
+    # Новый процесс: всё уже в реестре, заливать нечего
+    monkeypatch.setattr(media_registry, "_file_ids", {})
+    assert await media_registry.sync_assets(bot, str(assets)) == 0
+    assert len(bot.uploads) == 3
+    assert media_registry.media_input(str(assets / "menu.jpg")) == "photo"
+
+
+@pytest.mark.asyncio
+async def test_changed_asset_is_uploaded_again(registry):
+    store, assets = registry
+    bot = FakeBot()
+    await media_registry.sync_assets(bot, str(assets))
+
+    (assets / "welcome_1.mp4").write_bytes(b"new cut")
+    assert await media_registry.sync_assets(bot, str(assets)) == 1
+    assert bot.uploads[-1] == str(assets / "welcome_1.mp4")
+    assert media_registry.welcome_video_ids(str(assets))[0] == "vid-4"
+
+
+@pytest.mark.asyncio
+async def test_background_sync_error_is_logged(registry, monkeypatch, caplog):
+    @asynccontextmanager
+    async def broken_lock():
+        raise ConnectionError("db is down")
+        yield
+
+    monkeypatch.setattr(media_registry, "media_registry_lock", broken_lock)
+    monkeypatch.setattr(media_registry, "ASSETS_DIR", str(registry[1]))
+    task = media_registry.start_sync_assets(FakeBot())
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert task not in media_registry._sync_tasks
+    assert "db is down" in caplog.text
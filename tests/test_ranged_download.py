@@ -0,0 +1,69 @@
+import httpx
+import pytest
+
+from worker import ranged_download
+from worker.ranged_download import download_ranged, split_ranges
+
+PAYLOAD = bytes(range(256)) * 400  # 100 КБ
+
+
+def cdn(ranges=True, fail_once=()):
+    """MockTransport CDN: Range по желанию, первый запрос диапазонов из fail_once обрывается"""
+    seen = []
+    failed = set()
+
+    def handler(request):
+        header = request.headers.get("Range")
+        seen.append(header)
+        if not ranges or not header:
+            return httpx.Response(200, content=PAYLOAD)
+        start, end = (int(x) for x in header.removeprefix("bytes=").split("-"))
+        body = PAYLOAD[start:end + 1]
+        if start in fail_once and start not in failed:
+            failed.add(start)
+            body = body[: len(body) // 2]  # соединение оборвалось на середине
+        return httpx.Response(
+            206, content=body,
+            headers={"Content-Range": f"bytes {start}-{end}/{len(PAYLOAD)}"},
+        )
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), seen
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(ranged_download, "DOWNLOAD_MIN_PART_BYTES", 10_000)
+    monkeypatch.setattr(ranged_download.asyncio, "sleep", _no_sleep)
+
+
+async def _no_sleep(_):
+    return None
+
+
+def test_split_ranges_cover_file_exactly():
+    assert split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(100, 8, min_part=40) == [(0, 49), (50, 99)]
+    assert split_ranges(5, 4, min_part=10) == [(0, 4)]
+
+
+@pytest.mark.asyncio
+async def test_parallel_ranges_assemble_file():
+    client, seen = cdn()
+    assert await download_ranged("https://cdn/v.mp4", client, parts=4) == PAYLOAD
+    assert seen[0] == "bytes=0-0" and len(seen) == 5
+
+
+@pytest.mark.asyncio
+async def test_only_broken_range_is_resumed():
+    client, seen = cdn(fail_once={25_600})
+    assert await download_ranged("https://cdn/v.mp4", client, parts=4) == PAYLOAD
+    # Обрыв на середине второго диапазона: докачивается только его хвост
+    assert "bytes=38400-51199" in seen
+    assert seen.count("bytes=0-25599") == 1
+
+
+@pytest.mark.asyncio
+async def test_no_range_support_uses_single_connection():
+    client, seen = cdn(ranges=False)
+    assert await download_ranged("https://cdn/v.mp4", client, parts=4) == PAYLOAD
+    assert seen == ["bytes=0-0", None]
@@ -0,0 +1,94 @@
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app import db_adapter
+from app.db_pool import MeteredPool
+
+
+class FakeConn:
+    def __init__(self, name, lag=0.0):
+        self.name = name
+        self.lag = lag
+        # Для реплики: весь полученный WAL проигран, поток WAL жив
+        self.caught_up = False
+        self.streaming = True
+
+    async def fetchval(self, query, *args, timeout=None):
+        if self.caught_up and self.streaming and "status = 'streaming'" in query:
+            return 0.0
+        return self.lag
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self, timeout=None):
+        @asynccontextmanager
+        async def ctx():
+            yield self.conn
+        return ctx()
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    primary = MeteredPool(FakePool(FakeConn("primary")), "bot")
+    replica_conn = FakeConn("replica")
+
+    async def create_pool(dsn, **options):
+        if replica_conn.lag is None:
+            raise OSError("connection refused")
+        return FakePool(replica_conn)
+
+    monkeypatch.setattr(db_adapter, "_pool", primary)
+    monkeypatch.setattr(db_adapter, "_replica_pool", None)
+    monkeypatch.setattr(db_adapter, "_replica_checked_at", 0.0)
+    monkeypatch.setattr(db_adapter, "_replica_down_until", 0.0)
+    monkeypatch.setattr(db_adapter, "DATABASE_REPLICA_URL", "postgresql://replica/neurocards")
+    monkeypatch.setattr(db_adapter, "DB_REPLICA_CHECK_INTERVAL", 0.0)
+    monkeypatch.setattr(db_adapter.asyncpg, "create_pool", create_pool, raising=False)
+    return replica_conn
+
+
+async def read_from():
+    async with db_adapter.read_connection() as conn:
+        return conn.name
+
+
+@pytest.mark.asyncio
+async def test_fresh_replica_serves_reads(replica):
+    replica.lag = 1.0
+    assert await read_from() == "replica"
+
+
+@pytest.mark.asyncio
+async def test_stale_replica_falls_back_to_primary(replica):
+    replica.lag = db_adapter.DB_REPLICA_MAX_LAG + 10
+    assert await read_from() == "primary"
+
+
+@pytest.mark.asyncio
+async def test_unreachable_replica_falls_back_to_primary(replica):
+    replica.lag = None
+    assert await read_from() == "primary"
+    # Упавшую реплику не дёргаем до DB_REPLICA_RETRY_SECONDS
+    replica.lag = 0.0
+    assert await read_from() == "primary"
+
+
+@pytest.mark.asyncio
+async def test_disconnected_receiver_is_not_fresh(replica):
+    # Поток WAL оборвался: replay догнал замерший receive LSN, но данные стареют
+    replica.caught_up = True
+    replica.streaming = True
+    replica.lag = 600.0
+    assert await read_from() == "replica"
+
+    replica.streaming = False
+    assert await read_from() == "primary"
+
+    # Ничего не проиграно и потока нет — реплика недоступна
+    replica.lag = None
+    assert await read_from() == "primary"
+    assert db_adapter._replica_lag is None
@@ -0,0 +1,43 @@
+import subprocess
+
+import pytest
+
+from worker import video_transcode
+from worker.video_transcode import PreparedVideo, ffmpeg_available, prepare_video, video_bitrate
+
+
+def test_bitrate_fits_limit_with_audio():
+    limit = 45 * 1024 * 1024
+    bitrate = video_bitrate(60, limit)
+    assert (bitrate + video_transcode.AUDIO_BITRATE) * 60 / 8 < limit
+    # Очень длинный ролик всё равно получает минимально смотрибельный битрейт
+    assert video_bitrate(100_000, limit) == 200_000
+
+
+def test_send_kwargs_skip_unknown_metadata():
+    kwargs = PreparedVideo(b"mp4", width=720, height=1280).send_kwargs()
+    assert kwargs == {"supports_streaming": True, "width": 720, "height": 1280}
+
+
+@pytest.mark.asyncio
+async def test_without_ffmpeg_video_is_sent_as_is(monkeypatch):
+    monkeypatch.setattr(video_transcode, "ffmpeg_available", lambda: False)
+    video = await prepare_video(b"raw", "job-1")
+    assert video.data == b"raw" and video.thumbnail is None and not video.transcoded
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="ffmpeg not installed")
+@pytest.mark.asyncio
+async def test_oversized_video_is_transcoded_under_limit(tmp_path, monkeypatch):
+    src = tmp_path / "src.mp4"
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc2=size=720x1280:rate=30:duration=4",
+        "-c:v", "libx264", "-preset", "ultrafast", "-qp", "0", str(src),
+    ], check=True)
+    data = src.read_bytes()
+    monkeypatch.setattr(video_transcode, "VIDEO_MAX_BYTES", len(data) // 4)
+
+    video = await prepare_video(data, "job-2")
+    assert video.transcoded and video.fits
+    assert (video.width, video.height, video.duration) == (720, 1280, 4)
+    assert video.thumbnail.startswith(b"\xff\xd8")
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.webhook_intake import WebhookIntake, update_user_id
+
+
+class FakeDispatcher:
+    """Записывает порядок обработки и держит хендлер, пока не отпустят gate"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.handled = []
+        self.running = 0
+        self.max_running = 0
+
+    async def feed_raw_update(self, bot, update, **kwargs):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.gate.wait()
+            self.handled.append(update["update_id"])
+        finally:
+            self.running -= 1
+
+    async def silent_call_request(self, bot, result):
+        pass
+
+
+def message_update(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": {"message_id": update_id, "from": {"id": user_id}}}
+
+
+def test_update_user_id():
+    assert update_user_id(message_update(1, 42)) == 42
+    assert update_user_id({"update_id": 2, "callback_query": {"id": "x", "from": {"id": 7}}}) == 7
+    assert update_user_id({"update_id": 3, "poll": {"id": "p"}}) is None
+
+
+@pytest.mark.asyncio
+async def test_submit_returns_before_handler_finishes():
+    dp = FakeDispatcher()
+    intake = WebhookIntake(dp, bot=None, max_tasks=2, max_pending=2)
+
+    await asyncio.wait_for(intake.submit(message_update(1, 1)), timeout=1)
+    assert dp.handled == []
+
+    dp.gate.set()
+    await intake.drain(timeout=1)
+    assert dp.handled == [1]
+
+
+@pytest.mark.asyncio
+async def test_pool_is_bounded_and_applies_backpressure():
+    dp = FakeDispatcher()
+    intake = WebhookIntake(dp, bot=None, max_tasks=2, max_pending=1)
+
+    for i in range(3):
+        await intake.submit(message_update(i, user_id=i))
+    await asyncio.sleep(0)
+    assert dp.max_running == 2
+
+    # Пул (2) и очередь (1) заняты — четвёртый апдейт ждёт
+    blocked = asyncio.create_task(intake.submit(message_update(3, user_id=3)))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    dp.gate.set()
+    await asyncio.wait_for(blocked, timeout=1)
+    await intake.drain(timeout=1)
+    assert sorted(dp.handled) == [0, 1, 2, 3]
+    assert dp.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_updates_of_one_user_are_sequential():
+    dp = FakeDispatcher()
+    intake = WebhookIntake(dp, bot=None, max_tasks=4, max_pending=4)
+
+    for i in range(3):
+        await intake.submit(message_update(i, user_id=1))
+    await asyncio.sleep(0.01)
+    assert dp.max_running == 1
+
+    dp.gate.set()
+    await intake.drain(timeout=1)
+    assert dp.handled == [0, 1, 2]
+    assert intake._user_locks == {}
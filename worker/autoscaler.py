@@ -0,0 +1,306 @@
+"""
+Автоскейлер DB-polling воркеров по глубине очереди
+
+Раз в AUTOSCALE_INTERVAL секунд смотрит на очередь (queued, processing, возраст самого
+старого queued job'а) и держит число воркеров между AUTOSCALE_MIN_WORKERS и AUTOSCALE_MAX_WORKERS:
+- цель = processing + ceil(queued / AUTOSCALE_QUEUE_PER_WORKER);
+  если самый старый job ждёт дольше AUTOSCALE_MAX_WAIT_SECONDS — ещё +AUTOSCALE_UP_STEP
+- потолок дополнительно ограничен ёмкостью KIE: здоровых ключей × AUTOSCALE_JOBS_PER_KIE_KEY
+  (0 = без лимита); ключи перечитываются каждый тик, блокировки воркеров видны через Redis
+- рост не чаще AUTOSCALE_UP_COOLDOWN, сокращение не чаще AUTOSCALE_DOWN_COOLDOWN после любого изменения
+- сокращение = graceful drain: воркер получает SIGTERM, отдаёт job, ждущий KIE, другому воркеру
+  (или доотправляет уже готовое видео) и выходит сам
+
+Бэкенды (AUTOSCALE_BACKEND):
+- process — воркеры дочерние процессы автоскейлера (docker / один хост без systemd)
+- systemd — инстансы neurocards-worker@N (systemctl start / stop --no-block)
+
+Состояние публикуется в Redis (ключ AUTOSCALER_STATE_KEY), его показывает /queue_stats.
+
+Запуск:
+    python -m worker.autoscaler
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.logging_setup import setup_logging
+from app.services.redis_queue import AUTOSCALER_STATE_KEY, get_redis_connection
+
+setup_logging("autoscaler")
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScaleConfig:
+    min_workers: int = int(os.getenv("AUTOSCALE_MIN_WORKERS", "1"))
+    max_workers: int = int(os.getenv("AUTOSCALE_MAX_WORKERS", "20"))
+    queue_per_worker: int = int(os.getenv("AUTOSCALE_QUEUE_PER_WORKER", "2"))
+    max_wait_seconds: float = float(os.getenv("AUTOSCALE_MAX_WAIT_SECONDS", "300"))
+    up_step: int = int(os.getenv("AUTOSCALE_UP_STEP", "4"))
+    down_step: int = int(os.getenv("AUTOSCALE_DOWN_STEP", "1"))
+    up_cooldown: float = float(os.getenv("AUTOSCALE_UP_COOLDOWN", "60"))
+    down_cooldown: float = float(os.getenv("AUTOSCALE_DOWN_COOLDOWN", "600"))
+    jobs_per_kie_key: int = int(os.getenv("AUTOSCALE_JOBS_PER_KIE_KEY", "0"))
+
+
+@dataclass
+class QueueSnapshot:
+    queued: int
+    processing: int
+    oldest_wait: float  # секунды, 0 если очередь пуста
+
+
+# ---------------- РЕШЕНИЕ ----------------
+
+def desired_workers(snap: QueueSnapshot, current: int, cfg: ScaleConfig, kie_keys: Optional[int] = None) -> int:
+    """
+    Сколько воркеров нужно при такой очереди (в границах min/max и ёмкости KIE).
+    kie_keys — здоровые ключи сейчас; 0 — все заблокированы (держим min_workers),
+    None — неизвестно, ёмкость ключами не ограничена.
+    """
+    target = snap.processing + math.ceil(snap.queued / max(cfg.queue_per_worker, 1))
+    if snap.queued and snap.oldest_wait >= cfg.max_wait_seconds:
+        target = max(target, current + cfg.up_step)
+
+    upper = cfg.max_workers
+    if cfg.jobs_per_kie_key and kie_keys is not None:
+        upper = min(upper, kie_keys * cfg.jobs_per_kie_key)
+    return max(cfg.min_workers, min(target, upper))
+
+
+def plan_change(desired: int, current: int, now: float, last_up: float, last_change: float,
+                cfg: ScaleConfig) -> int:
+    """+N запустить, -N отправить в drain, 0 — ничего (с учётом cool-down)"""
+    if desired > current and now - last_up >= cfg.up_cooldown:
+        return min(desired - current, cfg.up_step)
+    if desired < current and now - last_change >= cfg.down_cooldown:
+        return -min(current - desired, cfg.down_step)
+    return 0
+
+
+# ---------------- БЭКЕНДЫ ----------------
+
+class ProcessBackend:
+    """Воркеры — дочерние процессы: python -m worker.worker с WORKER_INSTANCE=N"""
+
+    def __init__(self, drain_timeout: float):
+        self.drain_timeout = drain_timeout
+        self._procs: Dict[int, subprocess.Popen] = {}
+        self._draining: Dict[int, Tuple[subprocess.Popen, float]] = {}
+
+    def running(self) -> List[int]:
+        self._reap()
+        return sorted(self._procs)
+
+    def draining(self) -> List[int]:
+        self._reap()
+        return sorted(self._draining)
+
+    def start(self, index: int) -> None:
+        self._procs[index] = subprocess.Popen(
+            [sys.executable, "-m", "worker.worker"],
+            env={**os.environ, "WORKER_INSTANCE": str(index)},
+        )
+        logger.info(f"🚀 Started worker #{index} (pid {self._procs[index].pid})")
+
+    def drain(self, index: int) -> None:
+        proc = self._procs.pop(index, None)
+        if proc is None:
+            return
+        proc.send_signal(signal.SIGTERM)
+        self._draining[index] = (proc, time.monotonic())
+        logger.info(f"🛬 Draining worker #{index} (pid {proc.pid})")
+
+    def _reap(self) -> None:
+        for index, proc in list(self._procs.items()):
+            if proc.poll() is not None:
+                logger.warning(f"⚠️ Worker #{index} exited unexpectedly with code {proc.returncode}")
+                del self._procs[index]
+        for index, (proc, since) in list(self._draining.items()):
+            if proc.poll() is not None:
+                logger.info(f"✅ Worker #{index} drained (code {proc.returncode})")
+                del self._draining[index]
+            elif time.monotonic() - since > self.drain_timeout:
+                logger.error(f"💀 Worker #{index} did not drain in {self.drain_timeout}s, killing")
+                proc.kill()
+
+    async def shutdown(self) -> None:
+        for index in list(self._procs):
+            self.drain(index)
+        while self.draining():
+            await asyncio.sleep(1)
+
+
+class SystemdBackend:
+    """Инстансы neurocards-worker@N; grace period drain задаёт TimeoutStopSec юнита"""
+
+    UNIT = "neurocards-worker@{}.service"
+    _UNIT_RE = re.compile(r"neurocards-worker@(\d+)\.service\s+\S+\s+(\S+)\s+(\S+)")
+
+    def _units(self) -> Dict[int, str]:
+        out = subprocess.run(
+            ["systemctl", "list-units", "neurocards-worker@*", "--all", "--plain", "--no-legend"],
+            capture_output=True, text=True, check=False,
+        ).stdout
+        units = {}
+        for line in out.splitlines():
+            m = self._UNIT_RE.search(line)
+            if m:
+                units[int(m.group(1))] = f"{m.group(2)}/{m.group(3)}"  # active/running, deactivating/stop-sigterm
+        return units
+
+    def running(self) -> List[int]:
+        return sorted(i for i, state in self._units().items() if state.startswith("active/"))
+
+    def draining(self) -> List[int]:
+        return sorted(i for i, state in self._units().items() if state.startswith("deactivating/"))
+
+    def start(self, index: int) -> None:
+        subprocess.run(["systemctl", "start", "--no-block", self.UNIT.format(index)], check=False)
+        logger.info(f"🚀 Started {self.UNIT.format(index)}")
+
+    def drain(self, index: int) -> None:
+        subprocess.run(["systemctl", "stop", "--no-block", self.UNIT.format(index)], check=False)
+        logger.info(f"🛬 Draining {self.UNIT.format(index)}")
+
+    async def shutdown(self) -> None:
+        # Юниты живут своей жизнью: при остановке автоскейлера воркеры не трогаем
+        pass
+
+
+# ---------------- ЦИКЛ ----------------
+
+async def fetch_queue_snapshot() -> QueueSnapshot:
+    from app.db_adapter import get_pool
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE status = 'queued' AND (run_after IS NULL OR run_after <= NOW())) AS queued,
+                COUNT(*) FILTER (WHERE status = 'processing') AS processing,
+                EXTRACT(EPOCH FROM NOW() - MIN(created_at) FILTER (
+                    WHERE status = 'queued' AND (run_after IS NULL OR run_after <= NOW())
+                ))::DOUBLE PRECISION AS oldest_wait
+            FROM jobs
+            WHERE status IN ('queued', 'processing')
+            """
+        )
+    return QueueSnapshot(
+        queued=row["queued"] or 0,
+        processing=row["processing"] or 0,
+        oldest_wait=row["oldest_wait"] or 0.0,
+    )
+
+
+def kie_key_count() -> Optional[int]:
+    """Здоровые KIE ключи (с блокировками всех воркеров); None — ключи неизвестны, без лимита"""
+    try:
+        from worker.kie_key_rotator import healthy_key_count
+        return healthy_key_count()
+    except Exception as e:
+        logger.warning(f"⚠️ KIE keys unavailable, capacity not limited by keys: {e}")
+        return None
+
+
+def publish_state(state: dict, ttl: int) -> None:
+    try:
+        get_redis_connection().set(AUTOSCALER_STATE_KEY, json.dumps(state), ex=ttl)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to publish autoscaler state: {e}")
+
+
+def _free_indices(used: List[int], count: int) -> List[int]:
+    free, index = [], 1
+    while len(free) < count:
+        if index not in used:
+            free.append(index)
+        index += 1
+    return free
+
+
+async def run(backend, cfg: ScaleConfig, interval: float) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    last_up = last_change = float("-inf")
+    logger.info(f"📈 Autoscaler started: {asdict(cfg)}, backend={type(backend).__name__}")
+
+    while not stop.is_set():
+        try:
+            snap = await fetch_queue_snapshot()
+            # Каждый тик: ключи, заблокированные воркерами (rate limit, биллинг), снижают потолок
+            kie_keys = await asyncio.to_thread(kie_key_count)
+            running = await asyncio.to_thread(backend.running)
+            draining = await asyncio.to_thread(backend.draining)
+            current = len(running)
+            desired = desired_workers(snap, current, cfg, kie_keys)
+            now = time.monotonic()
+            delta = plan_change(desired, current, now, last_up, last_change, cfg)
+
+            if delta > 0:
+                # Номера дренируемых воркеров не занимаем: у них свой порт метрик
+                for index in _free_indices(running + draining, delta):
+                    await asyncio.to_thread(backend.start, index)
+                last_up = last_change = now
+            elif delta < 0:
+                for index in sorted(running, reverse=True)[:-delta]:
+                    await asyncio.to_thread(backend.drain, index)
+                last_change = now
+
+            if delta:
+                logger.info(
+                    f"⚖️ Scale {current} → {current + delta} (desired {desired}): "
+                    f"queued={snap.queued}, processing={snap.processing}, oldest_wait={snap.oldest_wait:.0f}s"
+                )
+            publish_state({
+                **asdict(snap),
+                "running": current + delta,
+                "draining": len(draining) + max(-delta, 0),
+                "desired": desired,
+                "min": cfg.min_workers,
+                "max": cfg.max_workers,
+                "kie_keys": kie_keys,
+                "updated_at": time.time(),
+            }, ttl=int(interval * 4))
+        except Exception as e:
+            logger.error(f"❌ Autoscaler tick failed: {e}", exc_info=True)
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.info("🛑 Autoscaler stopping, draining workers...")
+    await backend.shutdown()
+
+
+async def main():
+    from app.db_adapter import close_db_pool
+
+    backend_name = os.getenv("AUTOSCALE_BACKEND", "process").lower()
+    if backend_name == "systemd":
+        backend = SystemdBackend()
+    else:
+        backend = ProcessBackend(drain_timeout=float(os.getenv("AUTOSCALE_DRAIN_TIMEOUT", "900")))
+    try:
+        await run(backend, ScaleConfig(), float(os.getenv("AUTOSCALE_INTERVAL", "15")))
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
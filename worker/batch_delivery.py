@@ -0,0 +1,118 @@
+"""
+Доставка заказа из нескольких видео одной медиагруппой
+
+- Job'ы одного confirm_generation делят jobs.batch_id (database/job_batches.sql)
+- Готовый ролик батча воркер только заливает в служебный канал (ради file_id)
+  и пользователю сразу не шлёт
+- claim_batch_delivery отдаёт ролики, когда весь батч завершён или с первого
+  готового прошло BATCH_DELIVERY_DEADLINE; шлёт их тот воркер, что забрал:
+  один send_media_group и одно итоговое сообщение с кнопками
+- Упавшие job'ы батча уже получили своё сообщение о возврате кредита —
+  в итоге только их число
+- Воркер опрашивает батчи раз в BATCH_SWEEP_INTERVAL: так уходят батчи
+  по дедлайну и те, где последним завершился failed job
+"""
+import logging
+import os
+from itertools import groupby
+from typing import Any, Dict, List
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaVideo
+
+from app.db_adapter import claim_batch_delivery
+
+logger = logging.getLogger(__name__)
+
+BATCH_DELIVERY_DEADLINE = int(os.getenv("BATCH_DELIVERY_DEADLINE", "900"))
+BATCH_SWEEP_INTERVAL = float(os.getenv("BATCH_SWEEP_INTERVAL", "10"))
+
+# Лимит Telegram на одну медиагруппу
+MEDIA_GROUP_LIMIT = 10
+
+
+def summary_text(rows: List[Dict[str, Any]]) -> str:
+    """Итоговое сообщение батча: сколько готово, сколько упало, сколько ещё в работе"""
+    first = rows[0]
+    completed, failed, total = first["completed"], first["failed"], first["total"]
+    pending = total - completed - failed
+
+    text = f"🎉 <b>Готово видео: {completed} из {total}</b>\n\n"
+    links = [row["video_url"] for row in rows if not row.get("video_file_id") and row.get("video_url")]
+    if len(links) < len(rows):
+        text += "💡 Результаты в альбоме выше ☝️\n\n"
+    if links:
+        text += "🔗 Слишком большие для Telegram, по ссылке:\n" + "\n".join(links) + "\n\n"
+    if failed:
+        text += f"⚠️ Не получилось: {failed} — кредиты за них вернул ✅\n\n"
+    if pending:
+        text += f"⏳ Ещё в работе: {pending} — пришлю отдельно\n\n"
+    text += "🎬 Можешь заказать ещё видео этого товара или вернуться в меню"
+    return text
+
+
+def _retry_markup(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Сделать ещё с этим товаром", callback_data=f"retry:{job_id}")],
+        [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="back_to_menu")],
+    ])
+
+
+async def send_batch(bot: Bot, rows: List[Dict[str, Any]]) -> None:
+    """Один альбом (по 10 роликов) и одно итоговое сообщение на батч"""
+    tg_user_id = int(rows[0]["tg_user_id"])
+    file_ids = [row["video_file_id"] for row in rows if row.get("video_file_id")]
+
+    for start in range(0, len(file_ids), MEDIA_GROUP_LIMIT):
+        chunk = file_ids[start:start + MEDIA_GROUP_LIMIT]
+        media = [
+            InputMediaVideo(
+                media=file_id,
+                caption="✅ <b>Видео готовы!</b>" if start == 0 and i == 0 else None,
+                parse_mode="HTML",
+            )
+            for i, file_id in enumerate(chunk)
+        ]
+        try:
+            await bot.send_media_group(tg_user_id, media=media, request_timeout=60)
+        except Exception as e:
+            # Альбом не ушёл — шлём ролики по одному, как без батча
+            logger.warning(f"⚠️ send_media_group failed for user {tg_user_id}, sending one by one: {e}")
+            for file_id in chunk:
+                try:
+                    await bot.send_video(tg_user_id, video=file_id, request_timeout=30)
+                except Exception as video_error:
+                    logger.error(f"❌ Failed to send batch video to user {tg_user_id}: {video_error}")
+
+    await bot.send_message(
+        tg_user_id,
+        summary_text(rows),
+        parse_mode="HTML",
+        reply_markup=_retry_markup(rows[0]["job_id"]),
+    )
+
+
+async def deliver_ready_batches(bot: Bot, batch_id: str | None = None) -> int:
+    """
+    Забирает и отправляет готовые батчи (batch_id=None — все). Возвращает число
+    отправленных роликов. Ошибки не пробрасывает: опрос идёт из цикла воркера.
+    """
+    try:
+        rows = await claim_batch_delivery(batch_id, BATCH_DELIVERY_DEADLINE)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to claim batch deliveries: {e}")
+        return 0
+
+    sent = 0
+    for claimed_batch, batch_rows in groupby(rows, key=lambda row: row["batch_id"]):
+        batch_rows = list(batch_rows)
+        try:
+            await send_batch(bot, batch_rows)
+            sent += len(batch_rows)
+            logger.info(
+                f"📦 Batch {claimed_batch} delivered: {len(batch_rows)} videos "
+                f"to user {batch_rows[0]['tg_user_id']}"
+            )
+        except Exception as e:
+            logger.error(f"❌ Failed to deliver batch {claimed_batch}: {e}", exc_info=True)
+    return sent
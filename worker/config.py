@@ -1,13 +1,10 @@
 import os
 
-def req(name: str) -> str:
-    v = os.getenv(name)
-    if not v:
-        raise RuntimeError(f"Missing env var: {name}")
-    return v
+# Обязательные переменные проверяет app.config.validate_config("worker") при старте,
+# импорт модуля не падает
 
 # Telegram
-BOT_TOKEN = req("BOT_TOKEN")
+BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 
 # Database configuration
 DATABASE_TYPE = os.getenv("DATABASE_TYPE", "postgres").lower()
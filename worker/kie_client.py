@@ -1,10 +1,43 @@
 import os
+import threading
 import time
+from typing import Callable, Optional, Union
+
 import httpx
+from app.config import kie_callback_url
 from worker.kie_key_rotator import get_rotator
 
-KIE_CREATE_TASK_URL = "https://api.kie.ai/api/v1/jobs/createTask"
-KIE_RECORD_INFO_URL = "https://api.kie.ai/api/v1/jobs/recordInfo"
+# KIE_API_BASE переопределяется для бенчмарков со stub сервером (benchmarks/stubs.py)
+KIE_API_BASE = os.getenv("KIE_API_BASE", "https://api.kie.ai").strip().rstrip("/")
+KIE_CREATE_TASK_URL = f"{KIE_API_BASE}/api/v1/jobs/createTask"
+KIE_RECORD_INFO_URL = f"{KIE_API_BASE}/api/v1/jobs/recordInfo"
+
+# Интервал poll в секундах; пусто = значение, переданное в poll_record_info
+KIE_POLL_INTERVAL = os.getenv("KIE_POLL_INTERVAL", "").strip()
+
+
+class PollInterrupted(Exception):
+    """Ожидание задачи прервано остановкой воркера — задачу можно передать другому воркеру"""
+
+
+def _sleep(
+    stop_event: Optional[threading.Event],
+    seconds: float,
+    wake_event: Optional[threading.Event] = None,
+) -> None:
+    """
+    Пауза между poll'ами. wake_event (callback KIE) обрывает паузу — следующий poll сразу;
+    stop_event — PollInterrupted. Кто ставит stop_event, ставит и wake_event, если он есть.
+    """
+    if wake_event is not None:
+        if wake_event.wait(seconds):
+            wake_event.clear()
+    elif stop_event is not None:
+        stop_event.wait(seconds)
+    else:
+        time.sleep(seconds)
+    if stop_event is not None and stop_event.is_set():
+        raise PollInterrupted()
 
 
 def _auth_headers_json(api_key: str):
@@ -14,6 +47,11 @@ def _auth_headers_json(api_key: str):
     }
 
 
+def get_kie_model() -> str:
+    """Модель KIE (можно переопределить через KIE_MODEL, по умолчанию sora-2-image-to-video)"""
+    return os.getenv("KIE_MODEL", "sora-2-image-to-video").strip() or "sora-2-image-to-video"
+
+
 def create_task_sora_i2v(prompt: str, image_url: str) -> tuple[str, str]:
     """
     Создает задачу генерации видео в KIE.AI
@@ -23,8 +61,7 @@ def create_task_sora_i2v(prompt: str, image_url: str) -> tuple[str, str]:
     api_key = rotator.get_key()
     
     # Усиливаем соответствие входному изображению
-    # Allow overriding model via env (fallback to sora-2-image-to-video)
-    model = os.getenv("KIE_MODEL", "sora-2-image-to-video").strip() or "sora-2-image-to-video"
+    model = get_kie_model()
 
     payload = {
         "model": model,
@@ -36,6 +73,10 @@ def create_task_sora_i2v(prompt: str, image_url: str) -> tuple[str, str]:
             "remove_watermark": True,
         },
     }
+    # KIE сам сообщит о готовности (app/kie_callback.py), poll остаётся страховкой
+    callback_url = kie_callback_url()
+    if callback_url:
+        payload["callBackUrl"] = callback_url
 
     import logging
     logger = logging.getLogger(__name__)
@@ -105,7 +146,7 @@ def create_task_sora_i2v(prompt: str, image_url: str) -> tuple[str, str]:
 
     import logging
     logger = logging.getLogger(__name__)
-    logger.info(f"📋 KIE API response: {data}")
+    logger.info(f"📋 KIE API response: {str(data)[:500]}")
 
     # data может быть {"code": 200, "data": {...}} или {"recordId": ...}
     data_obj = data.get("data") if data.get("data") is not None else data
@@ -120,10 +161,20 @@ def create_task_sora_i2v(prompt: str, image_url: str) -> tuple[str, str]:
     return (task_id, api_key)
 
 
-def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interval_sec: int = 10) -> dict:
+def poll_record_info(
+    task_id: str,
+    api_key: str,
+    timeout_sec: int = 300,
+    interval_sec: Union[float, Callable[[], float]] = 10,
+    stop_event: Optional[threading.Event] = None,
+    wake_event: Optional[threading.Event] = None,
+) -> dict:
     """
     Ждём до timeout_sec (по умолчанию 5 минут), опрашиваем каждые interval_sec секунд.
     Возвращаем последний JSON recordInfo (успех/ошибка/таймаут).
+    stop_event — при установке ожидание прерывается PollInterrupted (graceful shutdown воркера).
+    wake_event — будит poll досрочно (пришёл callback KIE).
+    interval_sec может быть функцией — перечитывается перед каждой паузой.
     """
     import logging
     logger = logging.getLogger(__name__)
@@ -131,6 +182,9 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
     if not task_id:
         raise RuntimeError("Empty task_id")
 
+    if KIE_POLL_INTERVAL:
+        interval_sec = float(KIE_POLL_INTERVAL)
+
     deadline = time.time() + timeout_sec
     poll_count = 0
 
@@ -148,8 +202,8 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                 r.raise_for_status()
                 last = r.json()
                 
-                # 🔍 ЛОГИРУЕМ ВСЕ ОТВЕТЫ ДЛЯ ДЕБАГА (включая fail статусы)
-                logger.debug(f"📡 Poll #{poll_count}: KIE response: {last}")
+                # Poll идёт каждые 10-15 секунд: семплируем, чтобы не засорять логи
+                logger.debug(f"📡 Poll #{poll_count}: KIE response: {str(last)[:500]}", extra={"sample": "kie_poll"})
                 
                 # Парсим статус
                 data = last.get("data") if isinstance(last, dict) else None
@@ -161,7 +215,10 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                 
                 # **ВАЖНО:** Check для fail ПЕРЕД reset counter
                 if status in {"failed", "fail", "error"}:
-                    logger.info(f"🔍 DEBUG: Poll #{poll_count} returned fail status, full response: {last}")
+                    logger.info(
+                        f"🔍 Poll #{poll_count} returned fail status: {str(last)[:500]}",
+                        extra={"sample": "kie_poll_fail"},
+                    )
                     # НЕ сбрасываем счётчик - он будет увеличен ниже
                 else:
                     # Только reset counter если статус НЕ fail (т.е. успех или waiting)
@@ -184,7 +241,7 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                     err.kie_info = info
                     raise err
                 
-                time.sleep(15)  # Wait before retry
+                _sleep(stop_event, 15, wake_event)  # Wait before retry
                 continue
                 
             except httpx.HTTPStatusError as e:
@@ -211,7 +268,7 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                         err = RuntimeError(f"KIE server error {status_code}")
                         err.kie_info = info
                         raise err
-                    time.sleep(10)  # Wait before retry
+                    _sleep(stop_event, 10, wake_event)  # Wait before retry
                     continue
                 
                 # На других ошибках — сразу fail
@@ -221,7 +278,7 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                 raise err
 
             # статус уже распарсен выше
-            logger.info(f"⏳ Poll #{poll_count}: task={task_id[:8]}... status='{status}'")
+            logger.info(f"⏳ Poll #{poll_count}: task={task_id[:8]}... status='{status}'", extra={"sample": "kie_poll_status"})
 
             if status in {"success", "succeeded", "done", "completed", "finish", "finished"}:
                 logger.info(f"✅ Poll #{poll_count}: SUCCESS - video ready!")
@@ -231,26 +288,26 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                 fail_msg = data.get("failMsg") if isinstance(data, dict) else ""
                 fail_code = data.get("failCode") if isinstance(data, dict) else ""
                 
-                logger.info(f"🔍 DEBUG Poll #{poll_count}: status='{status}', failCode={fail_code}, failMsg='{fail_msg}', consecutive_errors={consecutive_errors}")
+                logger.debug(f"🔍 Poll #{poll_count}: status='{status}', failCode={fail_code}, failMsg='{fail_msg}', consecutive_errors={consecutive_errors}")
                 
                 # Если это server error (5xx) - НЕ возвращаем сразу, продолжаем polling
                 # KIE может временно упасть, но задача продолжит выполняться
                 if isinstance(fail_code, (int, str)):
                     try:
                         fail_code_int = int(fail_code) if fail_code else 0
-                        logger.info(f"🔍 DEBUG: fail_code_int={fail_code_int}, checking if >= 500")
+                        logger.debug(f"🔍 fail_code_int={fail_code_int}, checking if >= 500")
                         if fail_code_int >= 500:
                             logger.warning(f"🟠 Poll #{poll_count}: KIE task has server error {fail_code} ('{fail_msg}'), will keep polling (may recover)...")
                             consecutive_errors += 1
-                            logger.info(f"🔍 DEBUG: incremented consecutive_errors to {consecutive_errors}/{max_consecutive_errors}")
+                            logger.debug(f"🔍 incremented consecutive_errors to {consecutive_errors}/{max_consecutive_errors}")
                             if consecutive_errors >= max_consecutive_errors:
                                 logger.error(f"❌ Too many consecutive server errors, giving up")
                                 logger.error(f"📋 Full KIE response on FAIL: {last}")
                                 return last
-                            time.sleep(15)  # Wait longer before next poll
+                            _sleep(stop_event, 15, wake_event)  # Wait longer before next poll
                             continue
                     except (ValueError, TypeError) as e:
-                        logger.info(f"🔍 DEBUG: fail_code conversion failed: {e}")
+                        logger.debug(f"🔍 fail_code conversion failed: {e}")
                         pass  # Если не число - обрабатываем как обычную ошибку
                 
                 # Остальные ошибки - финальны
@@ -259,8 +316,9 @@ def poll_record_info(task_id: str, api_key: str, timeout_sec: int = 300, interva
                 return last
 
             remaining_time = deadline - time.time()
-            logger.debug(f"⏱️  Remaining time: {remaining_time:.0f}s, sleeping {interval_sec}s...")
-            time.sleep(interval_sec)
+            sleep_sec = interval_sec() if callable(interval_sec) else interval_sec
+            logger.debug(f"⏱️  Remaining time: {remaining_time:.0f}s, sleeping {sleep_sec}s...", extra={"sample": "kie_poll_sleep"})
+            _sleep(stop_event, sleep_sec, wake_event)
 
         # таймаут — вернём последний ответ, чтобы увидеть статус/поля
         logger.warning(f"⏲️  Poll TIMEOUT after {poll_count} attempts, returning last response")
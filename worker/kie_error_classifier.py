@@ -1,10 +1,20 @@
 """
 KIE API Error Classifier
 Классифицирует ошибки от KIE.AI для правильной обработки и retry логики
+
+Порядок: сначала известные коды по таблицам (failCode задачи, code в JSON
+ответа KIE, HTTP статус, код из текста вида "HTTP 503"), и только если кода
+нет или он неоднозначен (400/403) — предкомпилированные регулярки по словам.
+Голые подстроки ("content", "human", "account", "403") больше не решают:
+временная ошибка с таким словом не становится USER_VIOLATION с возвратом
+кредита там, где retry бы помог. Каждое решение считается в
+neurocards_kie_errors_total{type, source} — по нему подстраиваются таблицы.
 """
 import re
 from enum import Enum
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Pattern, Tuple
+
+from app.metrics import kie_error_classified
 
 
 class KieErrorType(Enum):
@@ -16,6 +26,93 @@ class KieErrorType(Enum):
     UNKNOWN = "unknown"  # Неизвестная ошибка
 
 
+# Коды с однозначным смыслом: HTTP статусы и code в JSON ответа KIE
+# (KIE отвечает HTTP 200 с code != 200). Всё >= 500, чего нет в таблице, — TEMPORARY.
+CODE_TYPES: Dict[int, KieErrorType] = {
+    401: KieErrorType.BILLING,  # ключ не принят
+    402: KieErrorType.BILLING,  # KIE: недостаточно кредитов
+    408: KieErrorType.TEMPORARY,
+    409: KieErrorType.TEMPORARY,
+    425: KieErrorType.TEMPORARY,
+    429: KieErrorType.RATE_LIMIT,
+    455: KieErrorType.TEMPORARY,  # KIE: сервис на обслуживании
+}
+
+# Неоднозначные коды: решает текст, а если он ни о чём не говорит —
+# KIE возвращает 400, OpenAI может вернуть 403 при нарушении правил
+AMBIGUOUS_CODE_TYPES: Dict[int, KieErrorType] = {
+    400: KieErrorType.USER_VIOLATION,
+    403: KieErrorType.USER_VIOLATION,
+}
+
+# Код в тексте ошибки только рядом с HTTP/status/code/error, а не любые три цифры
+_MESSAGE_CODE = re.compile(r"\b(?:http|status|code|error)\s*[:=]?\s*([1-5]\d\d)\b", re.IGNORECASE)
+
+
+def _words(*patterns: str) -> Pattern[str]:
+    return re.compile(r"\b(?:" + "|".join(patterns) + r")\b", re.IGNORECASE)
+
+
+# Fallback по тексту, в порядке проверки
+MESSAGE_PATTERNS: Tuple[Tuple[KieErrorType, Pattern[str]], ...] = (
+    (KieErrorType.USER_VIOLATION, _words(
+        r"(?:content|safety|usage) polic(?:y|ies)", r"polic(?:y|ies) violations?",
+        r"violat(?:e|es|ed|ing|ions?)", r"guidelines?", r"guardrails?", r"terms of (?:service|use)",
+        r"moderation", r"flagged", r"(?:prompt|image|content|input) (?:was )?(?:rejected|blocked|refused)",
+        r"inappropriate", r"prohibited", r"nsfw", r"explicit", r"harmful", r"offensive",
+        r"copyright(?:ed)?", r"trademarks?", r"photorealistic", r"real(?:istic)? (?:people|persons?|humans?|faces?)",
+        r"(?:contains?|containing|depicts?|detected) (?:an? )?(?:real )?(?:people|persons?|humans?|faces?)",
+        r"public figures?", r"sensitive (?:words?|content)", r"suggestive", r"racy", r"sexual(?:ly)?", r"nud(?:e|ity)",
+        r"violen(?:t|ce)", r"weapons?", r"gore",
+    )),
+    (KieErrorType.BILLING, _words(
+        r"billing", r"payment(?: method)?", r"subscription", r"insufficient (?:funds|credits?|balance)",
+        r"credits? (?:balance|exhausted|insufficient)", r"not enough (?:credits?|balance)",
+        r"(?:low|negative) balance", r"quota exceeded", r"plan limit",
+        r"account (?:is )?(?:suspended|disabled|banned|deactivated)", r"(?:api )?key (?:is )?(?:invalid|expired|revoked)",
+    )),
+    (KieErrorType.RATE_LIMIT, _words(
+        r"rate[ -]?limit(?:ed)?", r"too many requests", r"throttl(?:e|ed|ing)", r"slow down",
+        r"max(?:imum)? requests", r"requests per (?:second|minute|hour)", r"concurren(?:t|cy) limit",
+    )),
+    (KieErrorType.TEMPORARY, _words(
+        r"time[ -]?out", r"timed out", r"service unavailable", r"temporar(?:y|ily)",
+        r"try again", r"retry", r"network", r"connection (?:reset|refused|error|closed|aborted)",
+        r"server error", r"internal error", r"bad gateway", r"gateway timeout",
+        r"maintenance", r"overloaded", r"busy", r"high demand",
+    )),
+)
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None and value != "" else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _code_type(code: Optional[int]) -> Optional[KieErrorType]:
+    if code is None:
+        return None
+    if code in CODE_TYPES:
+        return CODE_TYPES[code]
+    if code >= 500:
+        return KieErrorType.TEMPORARY
+    return None
+
+
+def _message_type(error_msg: str) -> Optional[KieErrorType]:
+    for error_type, pattern in MESSAGE_PATTERNS:
+        if pattern.search(error_msg):
+            return error_type
+    return None
+
+
+def _classified(error_type: KieErrorType, source: str, error_msg: str) -> tuple[KieErrorType, str]:
+    kie_error_classified(error_type.value, source)
+    return (error_type, error_msg)
+
+
 def classify_kie_error(info: Dict[str, Any]) -> tuple[KieErrorType, str]:
     """
     Классифицирует ответ от KIE API на тип ошибки
@@ -28,79 +125,58 @@ def classify_kie_error(info: Dict[str, Any]) -> tuple[KieErrorType, str]:
     """
     status_code = None
     fail_code = None
+    json_code = None
     data = info.get("data") if isinstance(info, dict) else None
 
     if isinstance(info, dict):
-        status_code = info.get("status_code")
-        if isinstance(status_code, str) and status_code.isdigit():
-            status_code = int(status_code)
+        status_code = _as_int(info.get("status_code"))
 
     if isinstance(data, dict):
-        fail_code = data.get("failCode") or data.get("fail_code")
-        try:
-            fail_code = int(fail_code) if fail_code is not None else None
-        except (ValueError, TypeError):
-            fail_code = None
-
-    # Явно считаем 5xx как временную ошибку (retryable)
-    if fail_code is not None and fail_code >= 500:
-        return (KieErrorType.TEMPORARY, f"fail_code={fail_code}")
-    if status_code is not None and status_code >= 500:
-        return (KieErrorType.TEMPORARY, f"HTTP {status_code}")
+        fail_code = _as_int(data.get("failCode") or data.get("fail_code"))
+        json_code = _as_int(data.get("code"))
+    if json_code is None and isinstance(info, dict):
+        json_code = _as_int(info.get("code"))
+
+    if json_code == 200:
+        json_code = None
+
+    # 1. Известные коды: failCode задачи точнее кода ответа, тот — HTTP статуса
+    for source, code, label in (
+        ("fail_code", fail_code, f"fail_code={fail_code}"),
+        ("code", json_code, f"code={json_code}"),
+        ("http", status_code, f"HTTP {status_code}"),
+    ):
+        error_type = _code_type(code)
+        if error_type is not None:
+            # 5xx без текста — как раньше "fail_code=5xx"/"HTTP 5xx" (по ним job_failure_class)
+            if error_type == KieErrorType.TEMPORARY and code >= 500:
+                return _classified(error_type, source, label)
+            return _classified(error_type, source, _extract_error_message(info) or label)
 
     # Извлекаем сообщение об ошибке
     error_msg = _extract_error_message(info)
     if not error_msg:
         if status_code is not None:
-            return (KieErrorType.UNKNOWN, f"HTTP {status_code}")
-        return (KieErrorType.UNKNOWN, "No error message found")
-    
-    error_lower = error_msg.lower()
-    
-    # 1. Policy/Content Violations (USER_VIOLATION)
-    policy_keywords = [
-        "policy", "content", "inappropriate", "violation", "rule", "guideline",
-        "safety", "prohibited", "restricted", "denied", "rejected", "banned",
-        "nsfw", "explicit", "harmful", "offensive", "abuse", "illegal",
-        "copyright", "trademark", "privacy", "terms of service", "tos",
-        "sora 2", "sora2", "photorealistic people", "photorealistic", "realistic people", "human", "people",
-        "suggestive", "racy", "sexual", "nude", "adult", "mature", "violent", "weapon", "gore",
-        "forbidden", "403"
-    ]
-    if any(keyword in error_lower for keyword in policy_keywords):
-        return (KieErrorType.USER_VIOLATION, error_msg)
-    if status_code in {400, 403}:
-        # KIE возвращает 400, OpenAI может вернуть 403 при нарушении правил — считаем это user violation
-        return (KieErrorType.USER_VIOLATION, error_msg)
-    
-    # 2. Billing/Account Issues (BILLING)
-    billing_keywords = [
-        "billing", "payment", "subscription", "credit", "balance", "quota exceeded",
-        "account", "insufficient funds", "expired", "suspended", "disabled",
-        "payment method", "plan limit", "upgrade", "purchase"
-    ]
-    if any(keyword in error_lower for keyword in billing_keywords):
-        return (KieErrorType.BILLING, error_msg)
-    
-    # 3. Rate Limiting (RATE_LIMIT)
-    rate_limit_keywords = [
-        "rate limit", "too many requests", "throttle", "429", "slow down",
-        "max requests", "requests per", "concurrent limit"
-    ]
-    if any(keyword in error_lower for keyword in rate_limit_keywords):
-        return (KieErrorType.RATE_LIMIT, error_msg)
-    
-    # 4. Temporary Errors (TEMPORARY)
-    temporary_keywords = [
-        "timeout", "503", "502", "500", "service unavailable", "temporary",
-        "try again", "retry", "network", "connection", "server error",
-        "maintenance", "overloaded", "busy", "internal error"
-    ]
-    if any(keyword in error_lower for keyword in temporary_keywords):
-        return (KieErrorType.TEMPORARY, error_msg)
-    
-    # 5. Unknown
-    return (KieErrorType.UNKNOWN, error_msg)
+            return _classified(KieErrorType.UNKNOWN, "none", f"HTTP {status_code}")
+        return _classified(KieErrorType.UNKNOWN, "none", "No error message found")
+
+    # 2. Код в тексте ("KIE HTTP error 503", "status: 429")
+    match = _MESSAGE_CODE.search(error_msg)
+    error_type = _code_type(int(match.group(1))) if match else None
+    if error_type is not None:
+        return _classified(error_type, "message_code", error_msg)
+
+    # 3. Слова в тексте
+    error_type = _message_type(error_msg)
+    if error_type is not None:
+        return _classified(error_type, "pattern", error_msg)
+
+    # 4. Неоднозначный код без говорящего текста
+    for code in (fail_code, json_code, status_code):
+        if code in AMBIGUOUS_CODE_TYPES:
+            return _classified(AMBIGUOUS_CODE_TYPES[code], "ambiguous_code", error_msg)
+
+    return _classified(KieErrorType.UNKNOWN, "none", error_msg)
 
 
 def _extract_error_message(info: Dict[str, Any]) -> Optional[str]:
@@ -1,7 +1,12 @@
 """
 KIE API Key Rotator
 Управляет пулом API ключей для KIE.AI с балансировкой нагрузки и обработкой rate limits
+
+Блокировка ключа дублируется в Redis (kie_key_blocked:<хеш ключа> с TTL на время
+блокировки): здоровье ключей у каждого воркера своё, а автоскейлер по этим
+отметкам видит, сколько ключей реально доступно (healthy_key_count).
 """
+import hashlib
 import os
 import time
 import logging
@@ -10,6 +15,32 @@ from threading import Lock
 
 logger = logging.getLogger(__name__)
 
+BLOCKED_KEY_PREFIX = "kie_key_blocked:"
+_redis = None
+
+
+def _shared_redis():
+    """Redis с короткими таймаутами: отметка блокировки не должна тормозить воркер"""
+    global _redis
+    if _redis is None:
+        from redis import Redis
+        _redis = Redis.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            socket_timeout=2, socket_connect_timeout=2,
+        )
+    return _redis
+
+
+def _blocked_marker(key: str) -> str:
+    return BLOCKED_KEY_PREFIX + hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _publish_block(key: str, seconds: float) -> None:
+    try:
+        _shared_redis().set(_blocked_marker(key), "1", ex=max(int(seconds), 1))
+    except Exception as e:
+        logger.debug(f"KIE key block not shared: {e}")
+
 
 class KieKeyRotator:
     """Ротатор API ключей для KIE.AI с round-robin и health tracking"""
@@ -84,6 +115,7 @@ class KieKeyRotator:
             self._health[key]["blocked_until"] = time.time() + 60
             
             logger.warning(f"⚠️ KIE API key marked as failed, blocked for 1 minute")
+        _publish_block(key, 60)
     
     def report_success(self, key: str):
         """Отмечает успешное использование ключа"""
@@ -104,6 +136,7 @@ class KieKeyRotator:
                 f"⚠️ KIE API key rate limited (failures: {self._health[key]['failures']}), "
                 f"blocked for {cooldown_minutes} minutes"
             )
+        _publish_block(key, cooldown_minutes * 60)
     
     def report_billing_error(self, key: str):
         """Отмечает проблему с биллингом и блокирует ключ на долгое время"""
@@ -118,6 +151,7 @@ class KieKeyRotator:
                 f"❌ KIE API key billing error, blocked for 24 hours. "
                 f"Check your KIE account!"
             )
+        _publish_block(key, 24 * 3600)
     
     def get_stats(self) -> Dict:
         """Возвращает статистику по ключам"""
@@ -150,3 +184,22 @@ def get_rotator() -> KieKeyRotator:
     if _rotator is None:
         _rotator = KieKeyRotator()
     return _rotator
+
+
+def healthy_key_count() -> int:
+    """
+    Ключи, не заблокированные ни этим процессом, ни другими воркерами (отметки в Redis).
+    Redis недоступен — только локальное здоровье.
+    """
+    rotator = get_rotator()
+    with rotator._lock:
+        now = time.time()
+        healthy = [key for key in rotator._keys if rotator._health.get(key, {}).get("blocked_until", 0) <= now]
+    if not healthy:
+        return 0
+    try:
+        blocked = _shared_redis().exists(*(_blocked_marker(key) for key in healthy))
+    except Exception as e:
+        logger.debug(f"Shared KIE key health unavailable: {e}")
+        blocked = 0
+    return len(healthy) - blocked
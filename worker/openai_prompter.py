@@ -6,6 +6,9 @@ from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# OPENAI_BASE_URL переопределяется для бенчмарков со stub сервером (benchmarks/stubs.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").strip().rstrip("/")
+
 
 def _req(name: str) -> str:
     v = (os.getenv(name) or "").strip()
@@ -106,7 +109,7 @@ def build_prompt_with_gpt(system: str, instructions: str, product_text: str, ext
             with httpx.Client(**client_kwargs) as client:
                 try:
                     r = client.post(
-                        "https://api.openai.com/v1/chat/completions",
+                        f"{OPENAI_BASE_URL}/chat/completions",
                         headers=headers,
                         json=payload,
                     )
@@ -0,0 +1,134 @@
+"""
+Скачивание готового ролика KIE в несколько параллельных соединений
+
+- probe: GET c Range: bytes=0-0 (HEAD часть CDN не поддерживает) — поддержка
+  Range и полный размер из Content-Range, заодно итоговый URL после редиректов
+- файл делится на DOWNLOAD_PARTS диапазонов (не мельче DOWNLOAD_MIN_PART_BYTES),
+  каждый качается своим запросом прямо на своё место в заранее выделенном буфере:
+  склейки и лишней копии нет
+- таймаут — на чтение каждого куска, а не на весь файл: зависшее соединение
+  отваливается быстро, и перезапрашивается только недокачанный остаток его диапазона
+- без поддержки Range (или маленький файл) — одно соединение, как раньше
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_PARTS = int(os.getenv("DOWNLOAD_PARTS", "4"))
+DOWNLOAD_MIN_PART_BYTES = int(os.getenv("DOWNLOAD_MIN_PART_BYTES", str(4 * 1024 * 1024)))
+DOWNLOAD_RANGE_RETRIES = int(os.getenv("DOWNLOAD_RANGE_RETRIES", "4"))
+# read — пауза между кусками одного ответа, не время всего скачивания
+DOWNLOAD_TIMEOUT = httpx.Timeout(float(os.getenv("DOWNLOAD_READ_TIMEOUT", "30")), connect=10.0)
+
+
+class RangeNotHonored(RuntimeError):
+    """Сервер ответил на Range не 206 — качаем одним соединением"""
+
+
+def split_ranges(total: int, parts: int, min_part: int = 1) -> List[Tuple[int, int]]:
+    """Диапазоны [start, end] включительно, как в заголовке Range"""
+    parts = max(1, min(parts, total // max(min_part, 1) or 1))
+    size = -(-total // parts)
+    return [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+
+async def _probe(client: httpx.AsyncClient, url: str) -> Tuple[str, Optional[int], bool]:
+    """(итоговый URL, размер или None, поддерживает ли Range)"""
+    async with client.stream("GET", url, headers={"Range": "bytes=0-0"}, timeout=DOWNLOAD_TIMEOUT) as r:
+        r.raise_for_status()
+        final_url = str(r.url)
+        if r.status_code == 206:
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            return final_url, (int(total) if total.isdigit() else None), True
+        length = r.headers.get("Content-Length")
+        return final_url, (int(length) if length and length.isdigit() else None), False
+
+
+async def _fetch_range(
+    client: httpx.AsyncClient, url: str, buf: memoryview, start: int, end: int
+) -> None:
+    pos = start
+    for attempt in range(1, DOWNLOAD_RANGE_RETRIES + 1):
+        try:
+            async with client.stream(
+                "GET", url, headers={"Range": f"bytes={pos}-{end}"}, timeout=DOWNLOAD_TIMEOUT
+            ) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RangeNotHonored(f"status {r.status_code} for range {pos}-{end}")
+                async for chunk in r.aiter_bytes():
+                    size = min(len(chunk), end + 1 - pos)
+                    buf[pos:pos + size] = chunk[:size]
+                    pos += size
+            if pos > end:
+                return
+            raise httpx.ReadError(f"range {start}-{end} ended at {pos}")
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if attempt == DOWNLOAD_RANGE_RETRIES:
+                raise
+            logger.warning(
+                f"⚠️ Range {start}-{end} failed at {pos} (attempt {attempt}/{DOWNLOAD_RANGE_RETRIES}): {e!r}"
+            )
+            await asyncio.sleep(attempt)
+
+
+async def _fetch_single(client: httpx.AsyncClient, url: str, total: Optional[int]) -> bytes | bytearray:
+    async with client.stream("GET", url, timeout=DOWNLOAD_TIMEOUT) as r:
+        r.raise_for_status()
+        if total is None:
+            return await r.aread()
+        buf = bytearray(total)
+        pos = 0
+        async for chunk in r.aiter_bytes():
+            buf[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+        return buf if pos == total else buf[:pos]
+
+
+async def _download(client: httpx.AsyncClient, url: str, parts: int) -> bytes | bytearray:
+    final_url, total, ranged = await _probe(client, url)
+    if not ranged or not total or total < 2 * DOWNLOAD_MIN_PART_BYTES or parts <= 1:
+        return await _fetch_single(client, final_url, total)
+
+    buf = bytearray(total)
+    view = memoryview(buf)
+    ranges = split_ranges(total, parts, DOWNLOAD_MIN_PART_BYTES)
+    logger.info(f"📥 Ranged download: {total / 1024 / 1024:.1f} MB in {len(ranges)} parts")
+    tasks = [asyncio.create_task(_fetch_range(client, final_url, view, s, e)) for s, e in ranges]
+    try:
+        await asyncio.gather(*tasks)
+    except RangeNotHonored as e:
+        await _cancel(tasks)
+        logger.warning(f"⚠️ {e}, falling back to single connection")
+        return await _fetch_single(client, final_url, total)
+    except BaseException:
+        await _cancel(tasks)
+        raise
+    return buf
+
+
+async def _cancel(tasks: List[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def download_ranged(
+    url: str, client: Optional[httpx.AsyncClient] = None, parts: Optional[int] = None
+) -> bytes | bytearray:
+    """
+    Скачивает url в память, по возможности в несколько диапазонов параллельно.
+    Возвращает bytes-like (bytearray при скачивании по диапазонам — без копии в bytes).
+    """
+    parts = DOWNLOAD_PARTS if parts is None else parts
+    if client is not None:
+        return await _download(client, url, parts)
+    async with httpx.AsyncClient(follow_redirects=True) as c:
+        return await _download(c, url, parts)
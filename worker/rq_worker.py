@@ -1,25 +1,42 @@
 """
 RQ Worker для обработки задач из Redis
-Запускается через: rq worker -c worker.rq_worker_config
+Запускается через: rq worker -w worker.rq_worker.RuntimeWorker neurocards
+
+RuntimeWorker выполняет job'ы в самом процессе (без fork на каждый job),
+поэтому event loop, пул БД и сессия Bot живут весь срок жизни процесса.
 """
 import os
 import sys
-import asyncio
 import logging
 from pathlib import Path
 
 # Добавляем корень проекта в sys.path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from rq import SimpleWorker
+
+from app.logging_setup import setup_logging, log_context
+from app.metrics import JOBS_IN_FLIGHT, start_metrics_server
+from worker.runtime import get_runtime
 from worker.video_processor import process_video_generation
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
+setup_logging("rq_worker")
 logger = logging.getLogger(__name__)
 
 
+class RuntimeWorker(SimpleWorker):
+    """SimpleWorker с lifecycle hook'ами для WorkerRuntime"""
+
+    def work(self, *args, **kwargs):
+        start_metrics_server()
+        runtime = get_runtime()
+        runtime.start()
+        try:
+            return super().work(*args, **kwargs)
+        finally:
+            runtime.stop()
+
+
 def process_video_job(job_data: dict, **kwargs) -> dict:
     """
     Главная функция обработки задачи (вызывается из RQ)
@@ -41,12 +58,10 @@ def process_video_job(job_data: dict, **kwargs) -> dict:
     """
     logger.info(f"🚀 Starting job {job_data['job_id']}")
     
-    # Запускаем async функцию в event loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
+    # Запускаем async функцию на общем event loop процесса
     try:
-        result = loop.run_until_complete(process_video_generation(job_data))
+        with JOBS_IN_FLIGHT.track_inprogress(), log_context(job_id=job_data["job_id"]):
+            result = get_runtime().run(process_video_generation(job_data))
         logger.info(f"✅ Job {job_data['job_id']} completed successfully")
         return result
     except Exception as e:
@@ -56,5 +71,3 @@ def process_video_job(job_data: dict, **kwargs) -> dict:
             "output_url": None,
             "error": str(e)
         }
-    finally:
-        loop.close()
@@ -0,0 +1,147 @@
+"""
+Долгоживущий runtime воркера для RQ пути
+
+Один event loop, один пул БД, одна сессия Bot и общий HTTP клиент на процесс.
+Раньше всё это создавалось заново на каждый job (и на каждую попытку отправки).
+
+Запуск:
+    rq worker -w worker.rq_worker.RuntimeWorker neurocards
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import ClientTimeout
+
+from app.db_adapter import init_db_pool, close_db_pool
+from worker.config import BOT_TOKEN
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerRuntime:
+    """Ресурсы, которые живут столько же, сколько процесс воркера"""
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.bot: Optional[Bot] = None
+        self.http: Optional[httpx.AsyncClient] = None
+        self._started = False
+
+    # ---------------- LIFECYCLE ----------------
+
+    def start(self) -> None:
+        """Создаёт event loop процесса и поднимает ресурсы (идемпотентно)"""
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+        if not self._started:
+            self.loop.run_until_complete(self.startup())
+
+    async def startup(self) -> None:
+        """Инициализирует пул БД, ProxyRotator, Bot и HTTP клиент один раз на процесс"""
+        if self._started:
+            return
+
+        from app.config import validate_config
+        validate_config("worker")
+        await init_db_pool("worker")
+
+        try:
+            from app.proxy_rotator import init_proxy_rotator
+            from app.config import PROXY_FILE, load_proxies_from_file, PROXY_COOLDOWN
+            proxies = load_proxies_from_file(PROXY_FILE)
+            if proxies:
+                init_proxy_rotator(proxies, cooldown_seconds=PROXY_COOLDOWN)
+                logger.info(f"✅ ProxyRotator initialized in worker with {len(proxies)} proxies")
+            else:
+                logger.warning("⚠️ No proxies found, will try to send without proxy")
+        except Exception as e:
+            logger.warning(f"⚠️ ProxyRotator init failed (will try to send without proxy): {e}")
+
+        # Таймауты сессии рассчитаны на upload видео; короткие запросы передают request_timeout
+        timeout = ClientTimeout(
+            total=180.0,
+            connect=30.0,
+            sock_connect=30.0,
+            sock_read=180.0,
+        )
+        from app.config import telegram_api_server
+        self.bot = Bot(
+            token=BOT_TOKEN,
+            session=AiohttpSession(api=telegram_api_server(), proxy=None, timeout=timeout),
+        )
+
+        # Увеличенный timeout на случай больших видео
+        self.http = httpx.AsyncClient(timeout=300.0, follow_redirects=True)
+
+        self._started = True
+        logger.info("✅ Worker runtime started (DB pool, Bot session, HTTP client)")
+
+    async def shutdown(self) -> None:
+        """Закрывает все ресурсы процесса"""
+        if not self._started:
+            return
+        self._started = False
+
+        if self.bot is not None:
+            with contextlib.suppress(Exception):
+                await self.bot.session.close()
+            self.bot = None
+        if self.http is not None:
+            with contextlib.suppress(Exception):
+                await self.http.aclose()
+            self.http = None
+        with contextlib.suppress(Exception):
+            await close_db_pool()
+
+        logger.info("✅ Worker runtime stopped")
+
+    def stop(self) -> None:
+        """Синхронная обёртка над shutdown() + закрытие event loop"""
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            self.loop.run_until_complete(self.shutdown())
+        finally:
+            self.loop.close()
+            self.loop = None
+
+    # ---------------- EXECUTION ----------------
+
+    def run(self, coro: Awaitable[T]) -> T:
+        """
+        Выполняет корутину на loop'е процесса.
+        Если RQ прервал job (timeout через сигнал), задача отменяется,
+        чтобы loop остался чистым для следующего job'а.
+        """
+        self.start()
+        task = self.loop.create_task(coro)
+        try:
+            return self.loop.run_until_complete(task)
+        except BaseException:
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(BaseException):
+                    self.loop.run_until_complete(task)
+            raise
+
+
+# Глобальный инстанс runtime
+_runtime: Optional[WorkerRuntime] = None
+
+
+def get_runtime() -> WorkerRuntime:
+    """Возвращает runtime процесса (singleton)"""
+    global _runtime
+    if _runtime is None:
+        _runtime = WorkerRuntime()
+    return _runtime
@@ -0,0 +1,78 @@
+"""
+Замер длительностей этапов обработки job'а
+
+Этапы: queue_wait, gpt (промпт), kie (создание задачи + ожидание), download,
+transcode (ffmpeg, worker/video_transcode.py), upload.
+- durations сохраняется в jobs.stage_durations вместе с complete_job
+  и используется для оценки ETA (database/job_eta.sql, app/services/eta.py)
+- события копятся в памяти и дописываются в jobs.timeline тем же запросом,
+  что и ближайший переход состояния (database/job_timeline.sql)
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.logging_setup import set_log_context
+from app.metrics import observe_stage
+
+
+class StageTimer:
+    """Копит длительности и события этапов одного job'а (в секундах)"""
+
+    def __init__(self, attempt: int = 1):
+        self.attempt = attempt
+        self.durations: Dict[str, float] = {}
+        self._open: Dict[str, Tuple[float, float]] = {}
+        self._events: List[Dict[str, Any]] = []
+
+    def begin(self, stage: str) -> None:
+        """Начинает этап, который нельзя обернуть в with (несколько выходов из блока)"""
+        self._open[stage] = (time.monotonic(), time.time())
+        set_log_context(stage=stage)
+
+    def end(self, stage: str) -> Optional[float]:
+        """Завершает этап; повторные замеры одного этапа суммируются"""
+        opened = self._open.pop(stage, None)
+        if opened is None:
+            return None
+        started, started_at = opened
+        elapsed = time.monotonic() - started
+        set_log_context(stage=None)
+        self.durations[stage] = round(self.durations.get(stage, 0.0) + elapsed, 3)
+        self._add_event(stage, started_at, elapsed)
+        observe_stage(stage, elapsed)
+        return elapsed
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        self.begin(stage)
+        try:
+            yield
+        finally:
+            self.end(stage)
+
+    def record(self, stage: str, started_at: float, seconds: float) -> None:
+        """Этап, измеренный снаружи (например, queue_wait из created_at/started_at)"""
+        self._add_event(stage, started_at, seconds)
+        observe_stage(stage, seconds)
+
+    def _add_event(self, stage: str, started_at: float, seconds: float) -> None:
+        self._events.append({
+            "stage": stage,
+            "at": round(started_at, 3),
+            "dur": round(max(seconds, 0.0), 3),
+            "attempt": self.attempt,
+        })
+
+    def flush_events(self, close_open: bool = False) -> List[Dict[str, Any]]:
+        """
+        Забирает накопленные события для записи в jobs.timeline.
+        close_open=True — сначала закрывает незавершённые этапы (fail/requeue).
+        """
+        if close_open:
+            for stage in list(self._open):
+                self.end(stage)
+        events, self._events = self._events, []
+        return events
@@ -10,18 +10,21 @@ import os
 from datetime import datetime, timezone
 
 import httpx
-from aiogram import Bot
 from aiogram.types import FSInputFile, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 
-from app.db_adapter import update_job, refund_credit, get_user_by_tg_id, init_db_pool, close_db_pool
+from app.db_adapter import update_job, get_user_by_tg_id, fail_job_and_refund, complete_job
 from app.services.storage_factory import get_storage
 from app.utils import ensure_dict
-from worker.kie_client import create_task_sora_i2v, poll_record_info
+from worker.kie_client import create_task_sora_i2v, poll_record_info, get_kie_model
 from worker.kie_error_classifier import classify_kie_error, should_retry, get_user_error_message
 from worker.kie_key_rotator import get_rotator
 from worker.openai_prompter import build_prompt_with_gpt
 from worker.prompt_templates import TEMPLATES
-from worker.config import BOT_TOKEN, MAX_RETRY_ATTEMPTS, STORAGE_BASE_PATH
+from worker.config import MAX_RETRY_ATTEMPTS, STORAGE_BASE_PATH
+from worker.runtime import get_runtime
+from worker.ranged_download import download_ranged
+from worker.stage_timer import StageTimer
+from app.metrics import observe_transfer
 
 logger = logging.getLogger(__name__)
 
@@ -79,14 +82,11 @@ def find_video_url(obj) -> str | None:
     return None
 
 
-async def download_bytes(url: str) -> bytes:
-    """Скачать видео по URL"""
-    # Увеличиваем timeout до 300s (5 минут) на случай больших видео
-    async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as c:
-        r = await c.get(url)
-        r.raise_for_status()
-        logger.info(f"✅ Downloaded video: {len(r.content) / 1024 / 1024:.2f} MB")
-        return r.content
+async def download_bytes(url: str, client: httpx.AsyncClient | None = None) -> bytes | bytearray:
+    """Скачать видео по URL диапазонами параллельно (через общий клиент runtime, если передан)"""
+    content = await download_ranged(url, client)
+    logger.info(f"✅ Downloaded video: {len(content) / 1024 / 1024:.2f} MB")
+    return content
 
 
 def build_prompt(product_info: dict, template_id: str, extra_wishes: str | None) -> str:
@@ -163,284 +163,242 @@ async def process_video_generation(job_data: dict) -> dict:
     template_id = job_data.get("template_id", "ugc")
     extra_wishes = job_data.get("extra_wishes")
     
-    # Инициализируем БД и прокси
-    await init_db_pool()
+    # БД, прокси, Bot и HTTP клиент поднимаются один раз на процесс
+    runtime = get_runtime()
+    await runtime.startup()
+    bot = runtime.bot
+    timer = StageTimer()
     
-    # Инициализируем ProxyRotator для отправки видео
-    try:
-        from app.proxy_rotator import init_proxy_rotator
-        from app.config import PROXY_FILE, load_proxies_from_file, PROXY_COOLDOWN
-        proxies = load_proxies_from_file(PROXY_FILE)
-        if proxies:
-            init_proxy_rotator(proxies, cooldown_seconds=PROXY_COOLDOWN)
-            logger.info(f"✅ ProxyRotator initialized in worker with {len(proxies)} proxies")
-        else:
-            logger.warning("⚠️ No proxies found, will try to send without proxy")
-    except Exception as e:
-        logger.warning(f"⚠️ ProxyRotator init failed (will try to send without proxy): {e}")
+    # 1. Обновляем статус в БД
+    await update_job(job_id, {"status": "processing", "started_at": datetime.now(timezone.utc)})
     
-    try:
-        # 1. Обновляем статус в БД
-        await update_job(job_id, {"status": "processing", "started_at": datetime.now(timezone.utc)})
-        
-        # 2. Получаем публичный URL фото
-        image_url = await get_public_input_url(input_photo_path)
-        logger.info(f"📸 Image URL: {image_url}")
-        
-        # 3. Генерируем промпт
+    # 2. Получаем публичный URL фото
+    image_url = await get_public_input_url(input_photo_path)
+    logger.info(f"📸 Image URL: {image_url}")
+    
+    # 3. Генерируем промпт
+    with timer.stage("gpt"):
         prompt = build_prompt(product_info, template_id, extra_wishes)
-        
-        # ========== LOOP 1: ГЕНЕРАЦИЯ ВИДЕО (KIE.AI) ==========
-        # Retry только если генерация fail, не если видео просто не готово
-        attempt = 0
-        last_error = None
-        video_url = None
-        
-        while attempt < MAX_RETRY_ATTEMPTS:
-            attempt += 1
-            try:
-                kie_task_id, api_key_used = create_task_sora_i2v(prompt, image_url)
-                logger.info(f"✅ KIE task created: {kie_task_id}")
-                
-                # Сохраняем task_id в БД
-                await update_job(job_id, {"kie_task_id": kie_task_id})
-                
-                # 5. Ждем результата (Sora-2 может генерировать до 15 минут)
-                logger.info(f"⏳ Waiting for KIE.AI to generate video (timeout: 900s, poll interval: 10s)...")
-                info = poll_record_info(kie_task_id, api_key_used, timeout_sec=900, interval_sec=10)
-                
-                logger.info(f"📊 KIE response received: {info}")
-                
-                # Проверяем state (может быть fail)
-                data = info.get("data", {}) if isinstance(info, dict) else {}
-                state = data.get("state", "").lower()
-                status = data.get("status", "").lower()
-                
-                # 🔍 ЯВНО ЛОГИРУЕМ СТАТУС
-                logger.info(f"🔍 KIE task state='{state}', status='{status}'")
-                
-                if state in {"fail", "failed"} or status in {"fail", "failed", "error"}:
-                    fail_msg = data.get("failMsg", "Unknown error")
-                    fail_code = data.get("failCode", "")
-                    error_detail = f"KIE.AI error (code {fail_code}): {fail_msg}"
-                    logger.error(f"❌ KIE TASK FAILED: {error_detail}")
-                    logger.error(f"📋 Full KIE response: {info}")
-                    # Создаем exception с info для классификации
-                    error = RuntimeError(error_detail)
-                    error.kie_info = info  # Прикрепляем полный ответ для классификации
-                    raise error
-                
-                # Если timeout произошел
-                if info.get("error") == "timeout":
-                    error_detail = f"KIE.AI generation timeout after 900s"
-                    logger.error(f"⏲️  {error_detail}")
-                    error = RuntimeError(error_detail)
-                    error.kie_info = info
-                    raise error
-                
-                video_url = find_video_url(info)
-                
-                if not video_url:
-                    error_detail = f"Could not find video URL in KIE response"
-                    logger.error(f"❌ {error_detail}")
-                    logger.error(f"📋 Full KIE response: {info}")
-                    error = RuntimeError(error_detail)
-                    error.kie_info = info
-                    raise error
-                
-                logger.info(f"✅ KIE generation SUCCESS! Video URL: {video_url}")
-                
-                # ✅ УСПЕШНО! Видео готово - выходим из KIE loop (НЕ делаем continue!)
-                break
-                
-            except Exception as e:
-                last_error = e
-                # Классифицируем ошибку
-                if hasattr(e, 'kie_info'):
-                    error_type, error_msg = classify_kie_error(e.kie_info)
-                else:
-                    error_type, error_msg = classify_kie_error({"error": str(e)})
-                
-                logger.info(f"📊 Classified error: {error_type} - {error_msg}")
-                
-                if should_retry(error_type, attempt, MAX_RETRY_ATTEMPTS):
-                    logger.warning(f"⚠️ Attempt {attempt} failed ({error_type}), retrying KIE generation...")
-                    # Ротируем ключ для следующей попытки
-                    if 'api_key_used' in locals():
-                        try:
-                            get_rotator().mark_failed(api_key_used)
-                        except:
-                            pass
-                    await asyncio.sleep(5)
-                    continue  # Переходим к следующей итерации while loop
-                else:
-                    # Permanent error или исчерпаны попытки
-                    logger.error(f"❌ Job {job_id} failed permanently: {error_type} - {e}")
-                    # Возвращаем кредит
-                    await refund_credit(tg_user_id)
-                    
-                    # Отправляем сообщение об ошибке пользователю
-                    try:
-                        error_msg_to_user = get_user_error_message(error_type)
-                        # Create a temporary bot instance to send message
-                        from aiogram.client.session.aiohttp import AiohttpSession
-                        from aiohttp import ClientTimeout
-                        temp_timeout = ClientTimeout(total=30.0, connect=10.0)
-                        temp_session = AiohttpSession(proxy=None, timeout=temp_timeout)
-                        temp_bot = Bot(token=BOT_TOKEN, session=temp_session)
-                        await temp_bot.send_message(
-                            tg_user_id, 
-                            error_msg_to_user,
-                            parse_mode="HTML"
-                        )
-                        await temp_session.close()
-                    except Exception as send_error:
-                        logger.error(f"⚠️ Failed to send error message to user: {send_error}")
-                    
-                    raise RuntimeError(f"Generation failed: {error_type} - {e}")
-        
-        # После KIE loop мы имеем video_url готовый к отправке!
-        if not video_url:
-            logger.error(f"❌ Failed to get video URL from KIE after {attempt} attempts")
-            await refund_credit(tg_user_id)
-            raise RuntimeError("Failed to generate video")
-        
-        # ========== LOOP 2: ОТПРАВКА ВИДЕО ==========
-        # Скачиваем видео один раз
-        video_bytes = await download_bytes(video_url)
-        logger.info(f"✅ Downloaded video: {len(video_bytes)/1024/1024:.2f} MB")
-
-        # Сохраняем видео в локальное хранилище, чтобы отправлять из файла
-        os.makedirs(os.path.join(STORAGE_BASE_PATH, "outputs"), exist_ok=True)
-        video_path = os.path.join(STORAGE_BASE_PATH, "outputs", f"{job_id}.mp4")
+    
+    # ========== LOOP 1: ГЕНЕРАЦИЯ ВИДЕО (KIE.AI) ==========
+    # Retry только если генерация fail, не если видео просто не готово
+    attempt = 0
+    last_error = None
+    video_url = None
+    
+    while attempt < MAX_RETRY_ATTEMPTS:
+        attempt += 1
+        timer.attempt = attempt
         try:
-            with open(video_path, "wb") as f:
-                f.write(video_bytes)
-            logger.info(f"💾 Saved video to {video_path}")
+            timer.begin("kie")
+            kie_task_id, api_key_used = await asyncio.to_thread(create_task_sora_i2v, prompt, image_url)
+            logger.info(f"✅ KIE task created: {kie_task_id}")
+            
+            # Сохраняем task_id в БД
+            # gpt (и прошлые попытки kie) уходят в jobs.timeline тем же UPDATE
+            await update_job(job_id, {
+                "kie_task_id": kie_task_id,
+                "model": get_kie_model(),
+                "timeline": timer.flush_events(),
+            })
+            
+            # 5. Ждем результата (Sora-2 может генерировать до 15 минут)
+            logger.info(f"⏳ Waiting for KIE.AI to generate video (timeout: 900s, poll interval: 10s)...")
+            info = await asyncio.to_thread(poll_record_info, kie_task_id, api_key_used, 900, 10)
+            timer.end("kie")
+            
+            logger.info(f"📊 KIE response received: {info}")
+            
+            # Проверяем state (может быть fail)
+            data = info.get("data", {}) if isinstance(info, dict) else {}
+            state = data.get("state", "").lower()
+            status = data.get("status", "").lower()
+            
+            # 🔍 ЯВНО ЛОГИРУЕМ СТАТУС
+            logger.info(f"🔍 KIE task state='{state}', status='{status}'")
+            
+            if state in {"fail", "failed"} or status in {"fail", "failed", "error"}:
+                fail_msg = data.get("failMsg", "Unknown error")
+                fail_code = data.get("failCode", "")
+                error_detail = f"KIE.AI error (code {fail_code}): {fail_msg}"
+                logger.error(f"❌ KIE TASK FAILED: {error_detail}")
+                logger.error(f"📋 Full KIE response: {info}")
+                # Создаем exception с info для классификации
+                error = RuntimeError(error_detail)
+                error.kie_info = info  # Прикрепляем полный ответ для классификации
+                raise error
+            
+            # Если timeout произошел
+            if info.get("error") == "timeout":
+                error_detail = f"KIE.AI generation timeout after 900s"
+                logger.error(f"⏲️  {error_detail}")
+                error = RuntimeError(error_detail)
+                error.kie_info = info
+                raise error
+            
+            video_url = find_video_url(info)
+            
+            if not video_url:
+                error_detail = f"Could not find video URL in KIE response"
+                logger.error(f"❌ {error_detail}")
+                logger.error(f"📋 Full KIE response: {info}")
+                error = RuntimeError(error_detail)
+                error.kie_info = info
+                raise error
+            
+            logger.info(f"✅ KIE generation SUCCESS! Video URL: {video_url}")
+            
+            # ✅ УСПЕШНО! Видео готово - выходим из KIE loop (НЕ делаем continue!)
+            break
+            
         except Exception as e:
-            logger.error(f"❌ Failed to save video to storage: {e}")
-            await refund_credit(tg_user_id)
-            raise
-        
-        # Отправка видео имеет отдельный retry механизм (не создавать новое видео!)
-        send_attempts = 0
-        send_error = None
-        
-        while send_attempts < 3:  # 3 попытки отправить существующее видео
-            send_attempts += 1
-            try:
-                # Создаем Bot с таймаутами для отправки
-                from aiogram.client.session.aiohttp import AiohttpSession
-                from aiohttp import ClientTimeout
-                
-                # Таймауты для ОТПРАВКИ в Telegram (короче, чем генерация KIE)
-                timeout = ClientTimeout(
-                    total=180.0,        # 3 минуты на весь запрос
-                    connect=30.0,       # 30 секунд на connect
-                    sock_connect=30.0,  # 30 секунд на socket connect
-                    sock_read=180.0     # 3 минуты на чтение/upload
-                )
-                
-                # Используем простую отправку БЕЗ прокси (работает!)
-                session = AiohttpSession(proxy=None, timeout=timeout)
-                bot = Bot(token=BOT_TOKEN, session=session)
+            last_error = e
+            # Классифицируем ошибку
+            if hasattr(e, 'kie_info'):
+                error_type, error_msg = classify_kie_error(e.kie_info)
+            else:
+                error_type, error_msg = classify_kie_error({"error": str(e)})
+            
+            logger.info(f"📊 Classified error: {error_type} - {error_msg}")
+            
+            if should_retry(error_type, attempt, MAX_RETRY_ATTEMPTS):
+                logger.warning(f"⚠️ Attempt {attempt} failed ({error_type}), retrying KIE generation...")
+                timer.end("kie")  # неудачная попытка тоже попадает в timeline
+                # Ротируем ключ для следующей попытки
+                if 'api_key_used' in locals():
+                    try:
+                        get_rotator().mark_failed(api_key_used)
+                    except:
+                        pass
+                await asyncio.sleep(5)
+                continue  # Переходим к следующей итерации while loop
+            else:
+                # Permanent error или исчерпаны попытки
+                logger.error(f"❌ Job {job_id} failed permanently: {error_type} - {e}")
+                # Возвращаем кредит и помечаем job одной транзакцией
+                await fail_job_and_refund(job_id, f"{error_type.value}: {e}", timer.flush_events(close_open=True))
                 
-                logger.info(f"📤 Send attempt {send_attempts}/3: Sending video (timeout: {timeout.total}s)")
+                # Отправляем сообщение об ошибке пользователю
+                try:
+                    error_msg_to_user = get_user_error_message(error_type)
+                    await bot.send_message(
+                        tg_user_id, 
+                        error_msg_to_user,
+                        parse_mode="HTML",
+                        request_timeout=30,
+                    )
+                except Exception as send_error:
+                    logger.error(f"⚠️ Failed to send error message to user: {send_error}")
                 
-                # Отправляем видео БЕЗ asyncio.wait_for (timeout уже в session)
-                await bot.send_video(
+                raise RuntimeError(f"Generation failed: {error_type} - {e}")
+    
+    # После KIE loop мы имеем video_url готовый к отправке!
+    if not video_url:
+        logger.error(f"❌ Failed to get video URL from KIE after {attempt} attempts")
+        await fail_job_and_refund(job_id, f"no_video_url after {attempt} attempts", timer.flush_events(close_open=True))
+        raise RuntimeError("Failed to generate video")
+    
+    # ========== LOOP 2: ОТПРАВКА ВИДЕО ==========
+    # Скачиваем видео один раз
+    with timer.stage("download"):
+        video_bytes = await download_bytes(video_url, runtime.http)
+    observe_transfer("download", len(video_bytes), timer.durations["download"])
+    logger.info(f"✅ Downloaded video: {len(video_bytes)/1024/1024:.2f} MB")
+
+    # Сохраняем видео в локальное хранилище, чтобы отправлять из файла
+    os.makedirs(os.path.join(STORAGE_BASE_PATH, "outputs"), exist_ok=True)
+    video_path = os.path.join(STORAGE_BASE_PATH, "outputs", f"{job_id}.mp4")
+    try:
+        with open(video_path, "wb") as f:
+            f.write(video_bytes)
+        logger.info(f"💾 Saved video to {video_path}")
+    except Exception as e:
+        logger.error(f"❌ Failed to save video to storage: {e}")
+        await fail_job_and_refund(job_id, f"Failed to save video: {e}", timer.flush_events(close_open=True))
+        raise
+    
+    # Отправка видео имеет отдельный retry механизм (не создавать новое видео!)
+    send_attempts = 0
+    send_error = None
+    video_file_id = None
+    
+    while send_attempts < 3:  # 3 попытки отправить существующее видео
+        send_attempts += 1
+        try:
+            # Сессия Bot общая для процесса, timeout upload'а — 3 минуты
+            logger.info(f"📤 Send attempt {send_attempts}/3: Sending video (timeout: 180s)")
+            
+            with timer.stage("upload"):
+                video_msg = await bot.send_video(
                     tg_user_id,
                     FSInputFile(video_path),
                     caption="✅ Ваше видео готово!",
-                    reply_markup=kb_result(job_data.get("kind", "reels"), job_id)
+                    reply_markup=kb_result(job_data.get("kind", "reels"), job_id),
+                    request_timeout=180,
                 )
-                logger.info(f"✅ Video sent successfully to user {tg_user_id}")
-                
-                # Success! Break из send_attempts loop
-                break
+            video_file_id = video_msg.video.file_id if video_msg.video else None
+            observe_transfer("upload", len(video_bytes), timer.durations["upload"])
+            logger.info(f"✅ Video sent successfully to user {tg_user_id}")
+            
+            # Success! Break из send_attempts loop
+            break
+            
+        except Exception as send_error_exc:
+            send_error = send_error_exc
+            logger.warning(f"⚠️ Send attempt {send_attempts}/3 failed: {type(send_error).__name__}: {send_error}")
+            
+            if send_attempts < 3:
+                logger.info(f"⏳ Retrying send in 5 seconds...")
+                await asyncio.sleep(5)
+            else:
+                # ✅ Исчерпаны попытки отправки - ВОЗВРАЩАЕМ КРЕДИТЫ И УВЕДОМЛЯЕМ!
+                logger.error(f"❌ Failed to send video after {send_attempts} attempts: {send_error}")
+                logger.info(f"💰 Refunding credits to user {tg_user_id} due to send failure")
                 
-            except Exception as send_error_exc:
-                send_error = send_error_exc
-                logger.warning(f"⚠️ Send attempt {send_attempts}/3 failed: {type(send_error).__name__}: {send_error}")
+                # Возвращаем кредиты и помечаем job как failed (одна транзакция)
+                try:
+                    await fail_job_and_refund(
+                        job_id, f"Send failed after 3 attempts: {send_error}", timer.flush_events(close_open=True)
+                    )
+                except Exception as refund_error:
+                    logger.error(f"⚠️ Failed to refund credits: {refund_error}")
                 
-                if send_attempts < 3:
-                    logger.info(f"⏳ Retrying send in 5 seconds...")
-                    await asyncio.sleep(5)
-                else:
-                    # ✅ Исчерпаны попытки отправки - ВОЗВРАЩАЕМ КРЕДИТЫ И УВЕДОМЛЯЕМ!
-                    logger.error(f"❌ Failed to send video after {send_attempts} attempts: {send_error}")
-                    logger.info(f"💰 Refunding credits to user {tg_user_id} due to send failure")
-                    
-                    # Возвращаем кредиты
-                    try:
-                        await refund_credit(tg_user_id)
-                    except Exception as refund_error:
-                        logger.error(f"⚠️ Failed to refund credits: {refund_error}")
-                    
-                    # Отправляем сообщение пользователю о ошибке отправки
-                    try:
-                        from aiogram.client.session.aiohttp import AiohttpSession
-                        from aiohttp import ClientTimeout
-                        temp_timeout = ClientTimeout(total=30.0, connect=10.0)
-                        temp_session = AiohttpSession(proxy=None, timeout=temp_timeout)
-                        temp_bot = Bot(token=BOT_TOKEN, session=temp_session)
-                        
-                        error_msg = (
-                            "🌐 <b>Ошибка при отправке видео</b>\n\n"
-                            "Видео успешно сгенерировано, но не удалось отправить в Telegram.\n\n"
-                            "💰 1 кредит вернули на баланс ✅\n\n"
-                            "🔄 Попробуйте еще раз позже."
-                        )
-                        
-                        await temp_bot.send_message(
-                            tg_user_id,
-                            error_msg,
-                            parse_mode="HTML",
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                                InlineKeyboardButton(text="🔄 Попробовать еще", callback_data="back_to_menu")
-                            ]])
-                        )
-                        await temp_session.close()
-                    except Exception as msg_error:
-                        logger.error(f"⚠️ Failed to notify user about send error: {msg_error}")
-                    
-                    # Обновляем status в базе как failed
-                    try:
-                        await update_job(job_id, {
-                            "status": "failed",
-                            "error": f"Send failed after 3 attempts: {send_error}",
-                            "finished_at": datetime.now(timezone.utc)
-                        })
-                    except Exception as update_error:
-                        logger.error(f"⚠️ Failed to update job status: {update_error}")
-                    
-                    raise RuntimeError(f"Video send failed after {send_attempts} attempts: {send_error}")
-            finally:
+                # Отправляем сообщение пользователю о ошибке отправки
                 try:
-                    await session.close()
-                except:
-                    pass
-        
-        # 7. Обновляем статус в "completed" и сохраняем video_url
-        await update_job(job_id, {
-            "status": "completed",
-            "video_url": video_url,
-            "finished_at": datetime.now(timezone.utc)
-        })
+                    error_msg = (
+                        "🌐 <b>Ошибка при отправке видео</b>\n\n"
+                        "Видео успешно сгенерировано, но не удалось отправить в Telegram.\n\n"
+                        "💰 1 кредит вернули на баланс ✅\n\n"
+                        "🔄 Попробуйте еще раз позже."
+                    )
+                    
+                    await bot.send_message(
+                        tg_user_id,
+                        error_msg,
+                        parse_mode="HTML",
+                        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                            InlineKeyboardButton(text="🔄 Попробовать еще", callback_data="back_to_menu")
+                        ]]),
+                        request_timeout=30,
+                    )
+                except Exception as msg_error:
+                    logger.error(f"⚠️ Failed to notify user about send error: {msg_error}")
+                
+                raise RuntimeError(f"Video send failed after {send_attempts} attempts: {send_error}")
+    
+    # 7. Обновляем статус в "completed" и сохраняем video_url
+    await complete_job(job_id, video_url, video_file_id, timer.durations, timer.flush_events())
 
-        # Удаляем локальный файл после успешной отправки
-        try:
-            if os.path.exists(video_path):
-                os.remove(video_path)
-                logger.info(f"🧹 Deleted local video file {video_path}")
-        except Exception as e:
-            logger.warning(f"⚠️ Failed to delete local video file {video_path}: {e}")
-        
-        return {
-            "success": True,
-            "output_url": video_url,
-            "error": None
-        }
+    # Удаляем локальный файл после успешной отправки
+    try:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+            logger.info(f"🧹 Deleted local video file {video_path}")
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to delete local video file {video_path}: {e}")
     
-    finally:
-        await close_db_pool()
+    return {
+        "success": True,
+        "output_url": video_url,
+        "error": None
+    }
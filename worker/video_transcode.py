@@ -0,0 +1,188 @@
+"""
+Подготовка готового ролика KIE к отправке в Telegram (ffmpeg)
+
+- remux с +faststart: moov в начале файла, превью в Telegram грузится сразу
+- ролик больше VIDEO_MAX_BYTES перекодируется в H.264/AAC с битрейтом под лимит,
+  чтобы он ушёл видео, а не ссылкой KIE, которая может протухнуть
+- постер (JPEG до 320px) и width/height/duration — для send_video
+- ffmpeg работает в ProcessPoolExecutor на TRANSCODE_CONCURRENCY процессов,
+  каждому не больше TRANSCODE_THREADS потоков: воркер не съедает весь CPU
+- нет ffmpeg или он упал — ролик уходит как есть, как до этого этапа
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Лимит размера видео на отправку (облачный Bot API — 50 МБ, берём с запасом)
+VIDEO_MAX_BYTES = int(os.getenv("VIDEO_MAX_BYTES", str(45 * 1024 * 1024)))
+TRANSCODE_CONCURRENCY = int(os.getenv("TRANSCODE_CONCURRENCY", "1"))
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "2"))
+TRANSCODE_TIMEOUT = int(os.getenv("TRANSCODE_TIMEOUT", "600"))
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+
+AUDIO_BITRATE = 128_000
+# Доля лимита под поток: контейнер и неточность rate control x264
+BITRATE_HEADROOM = 0.9
+THUMBNAIL_SIZE = 320
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class PreparedVideo:
+    data: bytes
+    thumbnail: Optional[bytes] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[int] = None
+    transcoded: bool = False
+
+    @property
+    def fits(self) -> bool:
+        return len(self.data) <= VIDEO_MAX_BYTES
+
+    def send_kwargs(self) -> Dict[str, Any]:
+        """Доп. аргументы send_video: размеры, длительность, постер, стриминг"""
+        from aiogram.types import BufferedInputFile
+
+        kwargs: Dict[str, Any] = {"supports_streaming": True}
+        for key in ("width", "height", "duration"):
+            if getattr(self, key):
+                kwargs[key] = getattr(self, key)
+        if self.thumbnail:
+            kwargs["thumbnail"] = BufferedInputFile(self.thumbnail, filename="thumb.jpg")
+        return kwargs
+
+
+def video_bitrate(duration: float, max_bytes: int) -> int:
+    """Битрейт видеопотока (бит/с), чтобы ролик длиной duration влез в max_bytes"""
+    total = max_bytes * 8 * BITRATE_HEADROOM / max(duration, 1.0)
+    return max(int(total - AUDIO_BITRATE), 200_000)
+
+
+def _run(args: list[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(args, capture_output=True, timeout=TRANSCODE_TIMEOUT, check=True)
+
+
+def _probe(path: str) -> Dict[str, Any]:
+    out = _run([
+        FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:format=duration", "-of", "json", path,
+    ]).stdout
+    info = json.loads(out or b"{}")
+    stream = (info.get("streams") or [{}])[0]
+    return {
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+        "duration": float((info.get("format") or {}).get("duration") or 0),
+    }
+
+
+def _prepare_file(src: str, workdir: str, max_bytes: int) -> Dict[str, Any]:
+    """Выполняется в процессе пула: только пути и числа, без больших bytes через pickle"""
+    meta = _probe(src)
+    out = os.path.join(workdir, "out.mp4")
+    threads = ["-threads", str(TRANSCODE_THREADS)]
+    transcoded = False
+
+    if os.path.getsize(src) <= max_bytes:
+        _run([FFMPEG_BIN, "-y", "-v", "error", "-i", src, "-map", "0", "-c", "copy",
+              "-movflags", "+faststart", out])
+    else:
+        bitrate = video_bitrate(meta["duration"], max_bytes)
+        # Вторая попытка — на 25% ниже, если x264 всё-таки перебрал
+        for attempt in range(2):
+            _run([FFMPEG_BIN, "-y", "-v", "error", "-i", src, *threads,
+                  "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                  "-b:v", str(bitrate), "-maxrate", str(bitrate), "-bufsize", str(bitrate * 2),
+                  "-c:a", "aac", "-b:a", str(AUDIO_BITRATE),
+                  "-movflags", "+faststart", out])
+            if os.path.getsize(out) <= max_bytes:
+                break
+            bitrate = int(bitrate * 0.75)
+        transcoded = True
+
+    thumb = os.path.join(workdir, "thumb.jpg")
+    try:
+        _run([FFMPEG_BIN, "-y", "-v", "error", "-ss", str(min(1.0, meta["duration"] / 2)), "-i", out,
+              "-frames:v", "1", "-vf",
+              f"scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease",
+              "-q:v", "5", thumb])
+    except Exception:
+        thumb = ""
+
+    return {**meta, "path": out, "thumbnail": thumb if thumb and os.path.exists(thumb) else "",
+            "transcoded": transcoded}
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max(TRANSCODE_CONCURRENCY, 1))
+    return _executor
+
+
+def ffmpeg_available() -> bool:
+    return bool(shutil.which(FFMPEG_BIN) and shutil.which(FFPROBE_BIN))
+
+
+async def prepare_video(data: bytes, job_id: str = "") -> PreparedVideo:
+    """
+    faststart + постер + метаданные, при превышении VIDEO_MAX_BYTES — перекодирование.
+    Не пробрасывает ошибки ffmpeg: тогда возвращает исходные bytes без метаданных.
+    """
+    if not ffmpeg_available():
+        logger.warning("⚠️ ffmpeg not found, sending video as is")
+        return PreparedVideo(data)
+
+    with tempfile.TemporaryDirectory(prefix="transcode-") as workdir:
+        src = os.path.join(workdir, "src.mp4")
+        with open(src, "wb") as f:
+            f.write(data)
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(_get_executor(), _prepare_file, src, workdir, VIDEO_MAX_BYTES)
+        except Exception as e:
+            logger.error(f"❌ Transcode failed for job {job_id}, sending original: {e}")
+            return PreparedVideo(data)
+
+        with open(result["path"], "rb") as f:
+            prepared = f.read()
+        thumbnail = None
+        if result["thumbnail"]:
+            with open(result["thumbnail"], "rb") as f:
+                thumbnail = f.read()
+
+    video = PreparedVideo(
+        data=prepared,
+        thumbnail=thumbnail,
+        width=result["width"],
+        height=result["height"],
+        duration=round(result["duration"]) or None,
+        transcoded=result["transcoded"],
+    )
+    logger.info(
+        f"🎞️ Job {job_id} video prepared: {len(data) / 1024 / 1024:.1f} → "
+        f"{len(prepared) / 1024 / 1024:.1f} MB, {video.width}x{video.height}, {video.duration}s"
+        + (" (transcoded)" if video.transcoded else "")
+    )
+    return video
+
+
+def shutdown_transcoder() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,3 +1,13 @@
+"""
+DB-polling воркер: python -m worker.worker
+
+На уровне модуля — только stdlib, логирование и app.config: тяжёлые модули
+(aiogram, httpx, asyncpg, prometheus_client, шаблоны, ffmpeg/скачивание)
+импортируются в main() после проверки конфигурации или при первом
+использовании. Бюджет времени импорта — scripts/check_import_time.py.
+"""
+from __future__ import annotations
+
 import time
 import traceback
 import asyncio
@@ -7,58 +17,43 @@ import re
 import logging
 import sys
 import signal
+import threading
 from datetime import datetime, timezone
 from pathlib import Path
 
-import httpx
-from aiogram import Bot
-from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-
 # Добавляем корень проекта в sys.path для импорта app модулей
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.db_adapter import (
-    init_db_pool, close_db_pool, fetch_next_queued_job,
-    update_job, refund_credit, get_user_by_tg_id
-)
 MAX_RETRY_ATTEMPTS = 3  # Максимум попыток для TEMPORARY errors
-from app.services.storage_factory import get_storage
-from worker.kie_client import create_task_sora_i2v, poll_record_info, KIE_RECORD_INFO_URL
-from worker.kie_error_classifier import classify_kie_error, should_retry, get_retry_delay, get_user_error_message, KieErrorType
-from worker.kie_key_rotator import get_rotator
-from worker.openai_prompter import build_prompt_with_gpt
-from worker.prompt_templates import TEMPLATES  # ✅ ВАЖНО
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from app.logging_setup import setup_logging, set_log_context
+from app.config import BOT_TOKEN, KIE_CALLBACK_TOKEN, KIE_CALLBACK_POLL_INTERVAL, SERVICE_CHANNEL_ID, validate_config
+
+# Настройка логирования: уровень через LOG_LEVEL / LOG_LEVELS (app/logging_setup.py)
+setup_logging("worker")
 logger = logging.getLogger(__name__)
 
 # Флаг для graceful shutdown
 shutdown_flag = False
+# То же для потока poll_record_info: прерывает ожидание KIE, job передаётся другому воркеру
+shutdown_event = threading.Event()
+# Callback KIE (NOTIFY kie_task_done) будит poll задачи, которую сейчас ждёт воркер
+kie_wakeup = threading.Event()
+waiting_kie_task = None
+# Интервал poll KIE без живого LISTEN (нет callback'ов или подключение оборвано), сек
+KIE_POLL_FALLBACK_INTERVAL = 15
 
 def handle_shutdown(signum, frame):
     global shutdown_flag
     logger.info(f"⚠️ Received signal {signum}, initiating graceful shutdown...")
     shutdown_flag = True
+    shutdown_event.set()
+    kie_wakeup.set()
 
 
-def req(name: str) -> str:
-    v = os.getenv(name)
-    if not v:
-        logger.error(f"❌ Missing env var: {name}")
-        raise RuntimeError(f"Missing env var: {name}")
-    logger.info(f"✅ Environment variable {name} is set")
-    return v.strip()
-
-
-BOT_TOKEN = req("BOT_TOKEN")
-SERVICE_CHANNEL_ID = int(os.getenv("SERVICE_CHANNEL_ID", "0"))  # Optional: for pre-uploading videos
+def on_kie_task_done(task_id: str):
+    if task_id and task_id == waiting_kie_task:
+        logger.info(f"📬 KIE callback for task {task_id}, polling now")
+        kie_wakeup.set()
 
 
 def now_iso() -> str:
@@ -66,6 +61,8 @@ def now_iso() -> str:
 
 
 def kb_result(kind: str = "reels") -> InlineKeyboardMarkup:
+    from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔁 Сгенерировать ещё", callback_data=f"again:{kind}")],
         [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="back_to_menu")],
@@ -79,6 +76,8 @@ async def get_public_input_url(input_path: str) -> str:
         return input_path
     
     try:
+        from app.services.storage_factory import get_storage
+
         storage = get_storage()
         # Normalize path
         rel = (input_path or "").strip().lstrip("/")
@@ -132,27 +131,32 @@ def find_video_url(obj):
     return None
 
 
-async def download_bytes(url: str) -> bytes:
-    """Скачивает видео с KIE по URL (не сохраняет на диск)"""
+async def download_bytes(url: str) -> bytes | bytearray:
+    """Скачивает видео с KIE по URL (не сохраняет на диск), диапазонами параллельно"""
     import time
     start_time = time.time()
     
-    # Увеличиваем timeout до 300 сек (5 минут) для больших видео
-    # Видео могут быть 50-100+ МБ и скачиваться долго
-    async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as c:
-        r = await c.get(url)
-        r.raise_for_status()
-        
-        elapsed = time.time() - start_time
-        size_mb = len(r.content) / 1024 / 1024
-        speed_mbps = (size_mb / elapsed) if elapsed > 0 else 0
-        
-        logger.info(f"✅ Downloaded video: {size_mb:.2f} MB in {elapsed:.1f}s ({speed_mbps:.2f} MB/s)")
-        return r.content
+    from app.metrics import observe_transfer
+    from worker.ranged_download import download_ranged
+
+    # Большие видео (50-100+ МБ) — в DOWNLOAD_PARTS соединений, упавший диапазон
+    # докачивается сам (worker/ranged_download.py)
+    content = await download_ranged(url)
+    
+    elapsed = time.time() - start_time
+    observe_transfer("download", len(content), elapsed)
+    size_mb = len(content) / 1024 / 1024
+    speed_mbps = (size_mb / elapsed) if elapsed > 0 else 0
+    
+    logger.info(f"✅ Downloaded video: {size_mb:.2f} MB in {elapsed:.1f}s ({speed_mbps:.2f} MB/s)")
+    return content
 
 
 async def fetch_record_info_once(task_id: str, api_key: str) -> dict:
     """Делает один запрос recordInfo (без долгого poll)."""
+    import httpx
+    from worker.kie_client import KIE_RECORD_INFO_URL
+
     async with httpx.AsyncClient(timeout=60.0) as c:
         r = await c.get(f"{KIE_RECORD_INFO_URL}?taskId={task_id}", headers={"Authorization": f"Bearer {api_key}"})
         r.raise_for_status()
@@ -164,49 +168,25 @@ def build_script_for_job(job: dict) -> str:
     ✅ ВАЖНО: тут выбираем шаблон по job.template_id
     """
     logger.info(f"🔧 Building script for job {job.get('id')}")
+    from worker.openai_prompter import build_prompt_with_gpt
+    from worker.prompt_templates import TEMPLATES
     
-    # Template_id хранится в error_details JSONB
-    error_details = job.get("error_details") or {}
-    if isinstance(error_details, str):
-        import json
-        try:
-            error_details = json.loads(error_details)
-        except:
-            error_details = {}
-    
-    template_id = error_details.get("template_id") or job.get("template_id") or "ugc"
-    template_id = template_id.strip()
+    # Параметры генерации — колонки jobs (database/job_metadata.sql),
+    # product_info (JSONB) драйвер уже отдаёт dict'ом — разбирать нечего
+    template_id = (job.get("template_id") or "ugc").strip()
     tpl = TEMPLATES.get(template_id) or TEMPLATES.get("ugc")
 
-    # 🔍 DEBUG: Смотрим что есть в job
-    logger.info(f"🔍 DEBUG job fields: product_info={job.get('product_info')}, product_text={job.get('product_text')[:100] if job.get('product_text') else None}, prompt={job.get('prompt')[:100] if job.get('prompt') else None}")
-    logger.info(f"🔍 DEBUG error_details: {error_details}")
-    
-    # ИСПРАВЛЕНИЕ: product_info НЕ существует в БД! Читаем из product_text (это JSON)
-    product_info_raw = job.get("product_text") or job.get("prompt") or "{}"
-    product_info = {}
-    
-    if isinstance(product_info_raw, str):
-        import json
-        try:
-            product_info = json.loads(product_info_raw)
-        except Exception as e:
-            logger.warning(f"⚠️ Failed to parse product_text as JSON: {e}, using as plain text")
-            # Если не JSON - это просто текст, оборачиваем в dict
-            product_info = {"text": product_info_raw}
-    elif isinstance(product_info_raw, dict):
-        product_info = product_info_raw
-    
+    product_info = job.get("product_info") or {"text": job.get("product_text") or ""}
     product_text = (product_info.get("text") or "").strip()
     
     # 🔍 ЛОГИРУЕМ ЧТО ПРИШЛО ПОЛЬЗОВАТЕЛЕМ
-    logger.info(f"🔍 Product info from user: text='{product_text[:500]}{'...' if len(product_text) > 500 else ''}'")
+    logger.debug(f"🔍 Product info from user: text='{product_text[:200]}{'...' if len(product_text) > 200 else ''}'")
     logger.info(f"🔍 Template selected: {template_id}")
     extra_wishes = job.get("extra_wishes")
 
     # 🧑‍💻 Сам себе продюсер — GPT НЕ нужен
     if tpl.get("type") == "direct":
-        user_prompt = (product_info.get("user_prompt") or "").strip()
+        user_prompt = (job.get("user_prompt") or product_info.get("user_prompt") or "").strip()
         if not user_prompt:
             raise RuntimeError("self_template_missing_user_prompt")
         
@@ -255,21 +235,61 @@ def build_script_for_job(job: dict) -> str:
 
 
 async def main():
-    global shutdown_flag
+    global shutdown_flag, waiting_kie_task
     
     # Регистрируем обработчики сигналов
     signal.signal(signal.SIGTERM, handle_shutdown)
     signal.signal(signal.SIGINT, handle_shutdown)
+
+    # Конфигурация проверяется один раз здесь, до тяжёлых импортов и подключений
+    validate_config("worker")
+
+    import httpx
+    from aiogram import Bot
+    from aiogram.types import BufferedInputFile
+
+    from app.db_adapter import (
+        init_db_pool, close_db_pool, fetch_next_queued_job,
+        update_job, get_user_by_tg_id,
+        fail_job_and_refund, complete_job, requeue_job, handoff_job, listen
+    )
+    from app.metrics import JOBS_IN_FLIGHT, observe_transfer, start_metrics_server
+    from app.services.eta import get_job_eta, format_eta
+    from worker.batch_delivery import BATCH_SWEEP_INTERVAL, deliver_ready_batches
+    from worker.kie_client import create_task_sora_i2v, poll_record_info, get_kie_model, PollInterrupted
+    from worker.kie_error_classifier import (
+        classify_kie_error, should_retry, get_retry_delay, get_user_error_message, KieErrorType,
+    )
+    from worker.kie_key_rotator import get_rotator
+    from worker.stage_timer import StageTimer
+    from worker.video_transcode import prepare_video, shutdown_transcoder
     
     logger.info("🚀 WORKER: started main loop")
+    start_metrics_server()
     
     # Инициализируем database pool
     try:
-        await init_db_pool()
+        await init_db_pool("worker")
         logger.info("✅ Database pool initialized")
     except Exception as e:
         logger.critical(f"❌ Failed to initialize database pool: {e}")
         raise
+
+    # С callback'ом KIE poll нужен только как страховка — редкий. Пока LISTEN
+    # оборван (рестарт Postgres, сеть), NOTIFY не приходят — опрашиваем часто;
+    # после переподключения будим poll: callback'и за время обрыва потеряны
+    kie_listener = None
+    if KIE_CALLBACK_TOKEN:
+        try:
+            kie_listener = await listen("kie_task_done", on_kie_task_done, on_reconnect=kie_wakeup.set)
+            logger.info(f"✅ Listening for KIE callbacks, safety poll every {KIE_CALLBACK_POLL_INTERVAL}s")
+        except Exception as e:
+            logger.warning(f"⚠️ KIE callback listener unavailable, polling every {KIE_POLL_FALLBACK_INTERVAL}s: {e}")
+
+    def poll_interval() -> int:
+        if kie_listener is None or kie_listener.is_closed():
+            return KIE_POLL_FALLBACK_INTERVAL
+        return KIE_CALLBACK_POLL_INTERVAL
     
     # Проверяем наличие критичных переменных
     try:
@@ -279,8 +299,10 @@ async def main():
         from aiogram.client.session.aiohttp import AiohttpSession
         import aiohttp
         
+        from app.config import telegram_api_server
+        
         timeout = aiohttp.ClientTimeout(total=600)  # 10 минут для отправки видео
-        session = AiohttpSession(timeout=timeout)
+        session = AiohttpSession(api=telegram_api_server(), timeout=timeout)
         bot = Bot(BOT_TOKEN, session=session)
         logger.info("✅ Bot initialized successfully with 600s timeout")
     except Exception as e:
@@ -290,136 +312,196 @@ async def main():
     
     consecutive_errors = 0
     max_consecutive_errors = 5
+    last_batch_sweep = 0.0
 
     try:
         while not shutdown_flag:
+            # Сброс каждую итерацию: после requeue/handoff прошлый job уже не наш —
+            # ошибка sweep'а или fetch'а не должна его фейлить и писать его пользователю
+            job = job_id = tg_user_id = timer = None
             try:
+                JOBS_IN_FLIGHT.set(0)
+                set_log_context(job_id=None, stage=None)
+
+                # Батчи по дедлайну и те, где последним завершился failed job
+                if time.monotonic() - last_batch_sweep >= BATCH_SWEEP_INTERVAL:
+                    last_batch_sweep = time.monotonic()
+                    await deliver_ready_batches(bot)
+
                 job = await fetch_next_queued_job()
                 
                 if not job:
-                    logger.debug(f"⏳ No job available, sleeping 2s...")
+                    logger.debug("⏳ No job available, sleeping 2s...", extra={"sample": "worker_idle"})
                     await asyncio.sleep(2)
                     continue
 
                 # Сбрасываем счетчик ошибок при успешном получении задачи
                 consecutive_errors = 0
-                credit_refunded = False  # Флаг для предотвращения двойного возврата кредитов
                 
                 job_id = job["id"]
+                set_log_context(job_id=job_id)
                 logger.info(f"💼 Processing job {job_id}")
+                JOBS_IN_FLIGHT.set(1)
                 
                 # Получаем tg_user_id напрямую из job
                 tg_user_id = int(job["tg_user_id"])
                 kind = job.get("kind") or "reels"
 
-                attempts = int(job.get("attempts") or 0) + 1
-                await update_job(job_id, {"status": "processing", "started_at": "NOW()", "attempts": attempts})
+                # claim_next_job уже перевёл job в processing и увеличил attempts
+                attempts = int(job.get("attempts") or 1)
                 logger.info(f"🔄 Job {job_id} attempt {attempts}")
+                timer = StageTimer(attempts)
+                # Job передан остановленным воркером: задача KIE уже создана, продолжаем её poll
+                resume = bool(job.get("kie_handoff") and job.get("kie_task_id"))
+                if job.get("created_at") and job.get("started_at") and not resume:
+                    timer.record(
+                        "queue_wait",
+                        job["created_at"].timestamp(),
+                        (job["started_at"] - job["created_at"]).total_seconds(),
+                    )
 
-                input_path = job.get("product_image_url")
-                if not input_path:
-                    raise RuntimeError("Missing product_image_url")
+                if resume:
+                    task_id = job["kie_task_id"]
+                    api_key = job.get("kie_api_key") or get_rotator().get_key()
+                    logger.info(f"🔁 Resuming KIE task {task_id} handed off by a stopped worker")
+                    await update_job(job_id, {"kie_handoff": False})
+                    timer.begin("kie")
+                else:
+                    input_path = job.get("product_image_url")
+                    if not input_path:
+                        raise RuntimeError("Missing product_image_url")
 
-                image_url = await get_public_input_url(input_path)
-                logger.info(f"🖼️ IMAGE_URL: {image_url}")
+                    image_url = await get_public_input_url(input_path)
+                    logger.info(f"🖼️ IMAGE_URL: {image_url}")
 
-                # ✅ ВОТ ТУТ теперь выбирается нужный шаблон
-                script = build_script_for_job(job)
-                logger.info(f"📝 Generated script (first 200 chars): {script[:200]}...")
+                    # ✅ ВОТ ТУТ теперь выбирается нужный шаблон
+                    with timer.stage("gpt"):
+                        script = build_script_for_job(job)
+                    logger.info(f"📝 Generated script: {len(script)} chars")
+                    logger.debug(f"📝 Script (first 200 chars): {script[:200]}...")
 
-                try:
-                    task_id, api_key = create_task_sora_i2v(prompt=script, image_url=image_url)
-                except Exception as e:
-                    logger.error(f"❌ Failed to create KIE task: {repr(e)}", exc_info=True)
-                    raise
+                    timer.begin("kie")
+                    try:
+                        task_id, api_key = create_task_sora_i2v(prompt=script, image_url=image_url)
+                    except Exception as e:
+                        logger.error(f"❌ Failed to create KIE task: {repr(e)}", exc_info=True)
+                        raise
                 
-                if not task_id:
-                    raise RuntimeError("KIE: could not extract task_id")
+                    if not task_id:
+                        raise RuntimeError("KIE: could not extract task_id")
                 
-                logger.info(f"✅ KIE task created: {task_id}")
-                await update_job(job_id, {"kie_task_id": task_id})
+                    logger.info(f"✅ KIE task created: {task_id}")
+                    # queue_wait и gpt уходят в jobs.timeline тем же UPDATE
+                    await update_job(job_id, {
+                        "kie_task_id": task_id,
+                        "kie_api_key": api_key,
+                        # Итог прошлой попытки не должен выдать новый callback за дубль
+                        "kie_state": None,
+                        "kie_result": None,
+                        "kie_callback_at": None,
+                        "model": get_kie_model(),
+                        "timeline": timer.flush_events(),
+                    })
 
-                # Отправляем уведомление только при первой попытке
-                if attempts == 1:
-                    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+                    # Отправляем уведомление только при первой попытке
+                    if attempts == 1:
+                        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
                     
-                    # Кнопки для параллельного заказа ещё видео
-                    startup_markup = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="🔄 Сделать ещё с этим товаром", callback_data="make_another_same_product")],
-                        [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="back_to_menu")]
-                    ])
+                        # Кнопки для параллельного заказа ещё видео
+                        startup_markup = InlineKeyboardMarkup(inline_keyboard=[
+                            [InlineKeyboardButton(text="🔄 Сделать ещё с этим товаром", callback_data="make_another_same_product")],
+                            [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="back_to_menu")]
+                        ])
                     
-                    await bot.send_message(
-                        tg_user_id,
-                        "🎬 <b>Генерация запущена!</b>\n\n"
-                        "⏱ Обработка занимает от <b>1 до 30 минут</b> в зависимости от загруженности Sora 2.\n\n"
-                        "Я отправлю видео сюда, как только оно будет готово 🎥\n\n"
-                        "<i>💡 Можешь заказать ещё видео с этим товаром пока обрабатывается это!</i>",
-                        parse_mode="HTML",
-                        reply_markup=startup_markup,
-                    )
-
-                # REMOVED: Дублирующее уведомление "Фото прошло проверку" - уже есть "Генерация запущена"
-                accepted_notified = False
-                try:
-                    initial_info = await fetch_record_info_once(task_id, api_key)
-                    data0 = initial_info.get("data") if isinstance(initial_info, dict) else {}
-                    status0 = (data0.get("state") or data0.get("status") or "").lower()
-                    fail_msg0 = data0.get("failMsg") if isinstance(data0, dict) else ""
-                    fail_code0 = data0.get("failCode") if isinstance(data0, dict) else ""
-
-                    if status0 in {"waiting", "processing", "running", "queued", "pending", "doing"}:
-                        # Already notified with "Генерация запущена" and "Фото прошло проверку" messages above
-                        accepted_notified = True
-                    elif status0 in {"failed", "fail", "error", "canceled", "cancelled"}:
-                        logger.warning(f"❌ Initial KIE status fail: code={fail_code0}, msg={fail_msg0}")
-                        error_type, error_msg = classify_kie_error(initial_info)
-                        await refund_credit(tg_user_id)
-                        credit_refunded = True
-                        await update_job(job_id, {"status": "failed", "error": error_msg, "finished_at": "NOW()"})
-                        
-                        # Показываем реальное сообщение об ошибке от Sora если есть
-                        if error_type == KieErrorType.USER_VIOLATION:
-                            user_msg = (
-                                "⚠️ <b>Контент не прошёл модерацию</b>\n\n"
-                            )
-                            # Добавляем реальное сообщение от Sora если есть
-                            if fail_msg0:
-                                user_msg += f"🔴 <b>Причина:</b> {fail_msg0}\n\n"
-                            user_msg += (
-                                "💡 <b>Что делать:</b>\n"
-                                "• Загрузите другое фото (без людей и провокационного контента)\n"
-                                "• Измените описание товара на более нейтральное\n"
-                                "• Попробуйте более простой и спокойный стиль\n\n"
-                                "💰 1 кредит вернул на баланс ✅"
-                            )
-                        else:
-                            user_msg = (
-                                "⚠️ <b>Фото не прошло проверку Sora 2</b>\n\n"
-                                "💡 Требования к фото:\n"
-                                "• Без людей и лиц\n"
-                                "• Один товар, чётко и без водяных знаков\n"
-                                "• JPG/PNG до 5 МБ, вертикально или квадрат\n\n"
-                                "💰 1 кредит вернул на баланс ✅"
-                            )
+                        eta_text = format_eta(await get_job_eta(job_id))
                         await bot.send_message(
                             tg_user_id,
-                            user_msg,
+                            "🎬 <b>Генерация запущена!</b>\n\n"
+                            f"⏱ Ориентировочное время: {eta_text} (по текущей очереди Sora 2).\n\n"
+                            "Я отправлю видео сюда, как только оно будет готово 🎥\n\n"
+                            "<i>💡 Можешь заказать ещё видео с этим товаром пока обрабатывается это!</i>",
                             parse_mode="HTML",
-                            reply_markup=kb_result(kind),
+                            reply_markup=startup_markup,
                         )
-                        await asyncio.sleep(1)
-                        continue
-                except Exception as e:
-                    logger.warning(f"⚠️ Initial recordInfo check failed: {e}")
+
+                    # REMOVED: Дублирующее уведомление "Фото прошло проверку" - уже есть "Генерация запущена"
+                    accepted_notified = False
+                    try:
+                        initial_info = await fetch_record_info_once(task_id, api_key)
+                        data0 = initial_info.get("data") if isinstance(initial_info, dict) else {}
+                        status0 = (data0.get("state") or data0.get("status") or "").lower()
+                        fail_msg0 = data0.get("failMsg") if isinstance(data0, dict) else ""
+                        fail_code0 = data0.get("failCode") if isinstance(data0, dict) else ""
+
+                        if status0 in {"waiting", "processing", "running", "queued", "pending", "doing"}:
+                            # Already notified with "Генерация запущена" and "Фото прошло проверку" messages above
+                            accepted_notified = True
+                        elif status0 in {"failed", "fail", "error", "canceled", "cancelled"}:
+                            logger.warning(f"❌ Initial KIE status fail: code={fail_code0}, msg={fail_msg0}")
+                            error_type, error_msg = classify_kie_error(initial_info)
+                            await fail_job_and_refund(job_id, error_msg, timer.flush_events(close_open=True))
+                        
+                            # Показываем реальное сообщение об ошибке от Sora если есть
+                            if error_type == KieErrorType.USER_VIOLATION:
+                                user_msg = (
+                                    "⚠️ <b>Контент не прошёл модерацию</b>\n\n"
+                                )
+                                # Добавляем реальное сообщение от Sora если есть
+                                if fail_msg0:
+                                    user_msg += f"🔴 <b>Причина:</b> {fail_msg0}\n\n"
+                                user_msg += (
+                                    "💡 <b>Что делать:</b>\n"
+                                    "• Загрузите другое фото (без людей и провокационного контента)\n"
+                                    "• Измените описание товара на более нейтральное\n"
+                                    "• Попробуйте более простой и спокойный стиль\n\n"
+                                    "💰 1 кредит вернул на баланс ✅"
+                                )
+                            else:
+                                user_msg = (
+                                    "⚠️ <b>Фото не прошло проверку Sora 2</b>\n\n"
+                                    "💡 Требования к фото:\n"
+                                    "• Без людей и лиц\n"
+                                    "• Один товар, чётко и без водяных знаков\n"
+                                    "• JPG/PNG до 5 МБ, вертикально или квадрат\n\n"
+                                    "💰 1 кредит вернул на баланс ✅"
+                                )
+                            await bot.send_message(
+                                tg_user_id,
+                                user_msg,
+                                parse_mode="HTML",
+                                reply_markup=kb_result(kind),
+                            )
+                            await asyncio.sleep(1)
+                            continue
+                    except Exception as e:
+                        logger.warning(f"⚠️ Initial recordInfo check failed: {e}")
                 
                 logger.info(f"⏳ Polling KIE for task {task_id}...")
                 # Увеличим таймаут до 6 минут (360 сек) для большей надежности
-                info = await asyncio.to_thread(poll_record_info, task_id, api_key, 1800, 15)
+                waiting_kie_task = task_id
+                kie_wakeup.clear()
+                try:
+                    if shutdown_flag:
+                        raise PollInterrupted()
+                    info = await asyncio.to_thread(
+                        poll_record_info, task_id, api_key, 1800, poll_interval, shutdown_event, kie_wakeup
+                    )
+                except PollInterrupted:
+                    # Генерация идёт на стороне KIE — не ждём её, отдаём job другому воркеру
+                    if await handoff_job(job_id, timer.flush_events(close_open=True)):
+                        logger.info(f"🤝 Job {job_id} handed off with KIE task {task_id}")
+                    else:
+                        # Статус уже не processing — handoff_job ничего не вернул в очередь
+                        logger.warning(f"⚠️ Job {job_id} not handed off: no longer processing (KIE task {task_id})")
+                    continue
+                finally:
+                    waiting_kie_task = None
+                timer.end("kie")
 
-                logger.info("\n==== KIE recordInfo raw ====")
-                logger.info(json.dumps(info, ensure_ascii=False, indent=2))
-                logger.info("==== /KIE recordInfo raw ====\n")
+                info_data = info.get("data") if isinstance(info, dict) else None
+                if isinstance(info_data, dict):
+                    logger.info(f"📡 KIE recordInfo: state={info_data.get('state') or info_data.get('status')}")
+                logger.debug(f"📡 KIE recordInfo raw: {json.dumps(info, ensure_ascii=False)[:1000]}")
 
                 fail_msg = extract_fail_message(info)
                 if fail_msg:
@@ -460,18 +542,13 @@ async def main():
                                 parse_mode="HTML",
                             )
                         
-                        # Возвращаем job обратно в очередь для retry
-                        await update_job(job_id, {"status": "queued", "attempts": attempts})
-                        
-                        # Ждём перед retry
-                        logger.info(f"⏳ Sleeping {retry_delay}s before retry...")
-                        await asyncio.sleep(retry_delay)
+                        # Возвращаем job обратно в очередь: fetch не выдаст его раньше retry_delay,
+                        # воркер тем временем берёт другие задачи
+                        await requeue_job(job_id, retry_delay, timer.flush_events(close_open=True))
                         continue
                     
                     # Финальный fail - возвращаем кредит и уведомляем
-                    await refund_credit(tg_user_id)
-                    credit_refunded = True
-                    await update_job(job_id, {"status": "failed", "error": error_msg, "finished_at": "NOW()"})
+                    await fail_job_and_refund(job_id, error_msg, timer.flush_events(close_open=True))
                     
                     await bot.send_message(
                         tg_user_id,
@@ -485,9 +562,7 @@ async def main():
                 video_url = find_video_url(info)
                 if not video_url:
                     logger.warning("❌ Video URL not found in KIE response")
-                    await refund_credit(tg_user_id)
-                    credit_refunded = True
-                    await update_job(job_id, {"status": "failed", "error": "no_video_url", "finished_at": "NOW()"})
+                    await fail_job_and_refund(job_id, "no_video_url", timer.flush_events(close_open=True))
                     await bot.send_message(
                         tg_user_id,
                         "❌ Я дождался ответа KIE, но не нашёл ссылку на видео. Кредит вернул ✅",
@@ -502,16 +577,17 @@ async def main():
                 rotator = get_rotator()
                 rotator.report_success(api_key)
                 
-                # Скачиваем видео с retry для timeout ошибок
+                # Диапазоны ретраятся внутри download_bytes; здесь — только если не помогло
                 logger.info(f"📥 Downloading video from {video_url}...")
                 download_attempts = 0
-                max_download_attempts = 5
+                max_download_attempts = 2
                 data = None
                 
                 while download_attempts < max_download_attempts:
                     download_attempts += 1
                     try:
-                        data = await download_bytes(video_url)
+                        with timer.stage("download"):
+                            data = await download_bytes(video_url)
                         logger.info(f"✅ Downloaded {len(data)} bytes")
                         break
                     except httpx.TimeoutException as e:
@@ -529,10 +605,17 @@ async def main():
                 if not data:
                     raise RuntimeError("Failed to download video after retries")
 
-                max_bytes = 45 * 1024 * 1024
-                if len(data) > max_bytes:
+                # faststart, постер, метаданные; больше лимита — перекодируем под него
+                with timer.stage("transcode"):
+                    video = await prepare_video(data, job_id)
+                data = video.data
+
+                if not video.fits:
                     logger.info(f"⚠️ Video too large ({len(data)} bytes), sending URL instead")
-                    await update_job(job_id, {"status": "completed", "finished_at": "NOW()", "video_url": video_url})
+                    if job.get("batch_id"):
+                        # Ссылку шлём сразу — батч этот ролик не ждёт
+                        await update_job(job_id, {"batch_delivered_at": "NOW()"})
+                    await complete_job(job_id, video_url, stage_durations=timer.durations, timeline=timer.flush_events())
                     await bot.send_message(
                         tg_user_id,
                         f"✅ Видео готово! Ссылка:\n{video_url}",
@@ -553,6 +636,9 @@ async def main():
                     ])
                     
                     video_file_id = ""
+                    # Ролик заказа из нескольких видео ждёт батч: нужен только file_id (worker/batch_delivery.py)
+                    batch_id = job.get("batch_id") if SERVICE_CHANNEL_ID else None
+                    timer.begin("upload")
                     
                     # СТРАТЕГИЯ: Сначала загружаем в служебный канал (с большим timeout),
                     # затем отправляем пользователю по file_id (мгновенно)
@@ -564,38 +650,44 @@ async def main():
                                 video=BufferedInputFile(data, filename="reels.mp4"),
                                 caption=f"Job: {job_id}",
                                 request_timeout=600,  # Большой timeout для первой загрузки
+                                **video.send_kwargs(),
                             )
                             video_file_id = service_msg.video.file_id if service_msg.video else ""
                             logger.info(f"✅ Pre-uploaded to service channel, file_id: {video_file_id[:30]}...")
+                            if batch_id and video_file_id:
+                                logger.info(f"📦 Video held for batch {batch_id} delivery")
+                            else:
+                                batch_id = None
                             
-                            # Отправляем пользователю по file_id (мгновенно!)
-                            logger.info(f"📤 Sending video to user {tg_user_id} via file_id...")
-                            await bot.send_video(
-                                tg_user_id,
-                                video=video_file_id,
-                                caption="✅ <b>Видео готово!</b>",
-                                parse_mode="HTML",
-                                reply_markup=video_markup,
-                                request_timeout=30,  # Быстро
-                            )
-                            logger.info(f"✅ Video sent to user via file_id")
-                            
-                            # Отправляем финальное сообщение об итоге
-                            try:
-                                await bot.send_message(
+                                # Отправляем пользователю по file_id (мгновенно!)
+                                logger.info(f"📤 Sending video to user {tg_user_id} via file_id...")
+                                await bot.send_video(
                                     tg_user_id,
-                                    "🎉 <b>Видео успешно готово и отправлено!</b>\n\n"
-                                    "💡 Результат в видео выше ☝️\n\n"
-                                    "🎬 Можешь заказать ещё видео этого товара или вернуться в меню",
+                                    video=video_file_id,
+                                    caption="✅ <b>Видео готово!</b>",
                                     parse_mode="HTML",
-                                    reply_markup=retry_markup,
+                                    reply_markup=video_markup,
+                                    request_timeout=30,  # Быстро
                                 )
-                                logger.info(f"✅ Final result message sent")
-                            except Exception as msg_error:
-                                logger.error(f"⚠️ Failed to send final message: {msg_error}")
+                                logger.info(f"✅ Video sent to user via file_id")
+                            
+                                # Отправляем финальное сообщение об итоге
+                                try:
+                                    await bot.send_message(
+                                        tg_user_id,
+                                        "🎉 <b>Видео успешно готово и отправлено!</b>\n\n"
+                                        "💡 Результат в видео выше ☝️\n\n"
+                                        "🎬 Можешь заказать ещё видео этого товара или вернуться в меню",
+                                        parse_mode="HTML",
+                                        reply_markup=retry_markup,
+                                    )
+                                    logger.info(f"✅ Final result message sent")
+                                except Exception as msg_error:
+                                    logger.error(f"⚠️ Failed to send final message: {msg_error}")
                             
                         except Exception as upload_error:
                             logger.error(f"❌ Failed to pre-upload to service channel: {upload_error}")
+                            batch_id = None
                             # Fallback: отправляем напрямую
                             logger.info(f"📤 Fallback: sending directly to user...")
                             video_msg = await bot.send_video(
@@ -605,6 +697,7 @@ async def main():
                                 parse_mode="HTML",
                                 reply_markup=video_markup,
                                 request_timeout=600,
+                                **video.send_kwargs(),
                             )
                             video_file_id = video_msg.video.file_id if video_msg.video else ""
                     else:
@@ -617,19 +710,26 @@ async def main():
                             parse_mode="HTML",
                             reply_markup=video_markup,
                             request_timeout=600,
+                            **video.send_kwargs(),
                         )
                         video_file_id = video_msg.video.file_id if video_msg.video else ""
                     
-                    # Сохраняем file_id для быстрых повторных отправок
-                    await update_job(job_id, {
-                        "status": "completed",
-                        "finished_at": "NOW()",
-                        "video_url": video_url,
-                        "video_file_id": video_file_id  # сохраняем для повторной отправки
-                    })
+                    upload_seconds = timer.end("upload")
+                    if upload_seconds:
+                        observe_transfer("upload", len(data), upload_seconds)
+                    
+                    if job.get("batch_id") and not batch_id:
+                        # Ролик уже у пользователя — батч его не ждёт
+                        await update_job(job_id, {"batch_delivered_at": "NOW()"})
+                    
+                    # Сохраняем file_id и длительности этапов для быстрых повторных отправок и ETA
+                    await complete_job(job_id, video_url, video_file_id, timer.durations, timer.flush_events())
                     logger.info(f"✅ Job {job_id} completed successfully")
                     if video_file_id:
                         logger.info(f"💾 Saved file_id for fast resend: {video_file_id[:30]}...")
+                    if batch_id:
+                        # Последний завершившийся job батча отправляет весь альбом
+                        await deliver_ready_batches(bot, batch_id)
 
             except Exception as e:
                 consecutive_errors += 1
@@ -639,21 +739,16 @@ async def main():
                     logger.critical(f"💥 Too many consecutive errors ({max_consecutive_errors}), shutting down...")
                     break
                 
-                try:
-                    if 'tg_user_id' in locals() and not credit_refunded:
-                        await refund_credit(tg_user_id)
-                        credit_refunded = True
-                except Exception:
-                    pass
-                
-                if 'job_id' in locals():
+                # fail_job_and_refund идемпотентна: если кредит уже вернули выше, второго возврата не будет
+                if job_id is not None:
                     try:
-                        await update_job(job_id, {"status": "failed", "error": str(e), "finished_at": "NOW()"})
+                        timeline = timer.flush_events(close_open=True) if timer is not None else None
+                        await fail_job_and_refund(job_id, str(e), timeline)
                     except Exception:
                         pass
                 
                 try:
-                    if 'tg_user_id' in locals() and 'job' in locals():
+                    if tg_user_id is not None and job is not None:
                         error_type = KieErrorType.UNKNOWN
                         error_msg = str(e)
                         
@@ -693,9 +788,12 @@ async def main():
             await asyncio.sleep(1)
     finally:
         # Закрываем database pool и bot session при выходе
+        if kie_listener is not None:
+            await kie_listener.close()
         if 'session' in locals() and session:
             await session.close()
             logger.info("✅ Bot session closed")
+        shutdown_transcoder()
         await close_db_pool()
         logger.info("✅ Database pool closed")
     